@@ -0,0 +1,294 @@
+'''
+datapoints.py
+
+Encodes geostreams datapoints straight into a JSON request body for the bulk
+datapoints endpoint, instead of building one dict per datapoint and encoding
+the whole batch afterwards.
+
+The parts shared by every datapoint of a stream (stream id, type and geometry)
+are encoded once, property names are encoded once, and NaN/infinite values are
+dropped while encoding. The body can optionally be gzip-compressed.
+
+Batches are sized by a BatchPolicy, which keeps each request under a byte
+budget and grows or shrinks the number of datapoints per request according
+to how quickly the server responds.
+'''
+
+import bisect
+import json
+import math
+import time
+import zlib
+
+import requests
+
+
+class DatapointEncoder(object):
+    '''
+    Accumulates encoded datapoints for one stream in a reusable buffer.
+    '''
+
+    def __init__(self, stream_id, geometry, compress=False):
+        self.compress = compress
+        self._prefix = ('{"stream_id": %s, "type": "Point", "geometry": %s, ' %
+                        (json.dumps(str(stream_id)), json.dumps(geometry))).encode('utf-8')
+        self._keys = {}
+        self._constants = b''
+        # Every datapoint is stored with a leading ", " and _offsets holds where each one starts,
+        # so any leading run of datapoints can be sent as one slice of the buffer.
+        self._buffer = bytearray()
+        self._offsets = []
+
+    def set_constants(self, properties):
+        '''
+        Set properties added to every following datapoint (e.g. source, source_file).
+        '''
+        self._constants = self._encode_properties(properties)
+
+    def add(self, start_time, end_time, properties):
+        '''
+        Encode one datapoint.
+        '''
+        self._offsets.append(len(self._buffer))
+        self._buffer += b', '
+        self._buffer += self._prefix
+        self._buffer += ('"start_time": "%s", "end_time": "%s", "properties": {' % (start_time, end_time)).encode('utf-8')
+        encoded = self._encode_properties(properties)
+        self._buffer += encoded
+        if self._constants:
+            if encoded:
+                self._buffer += b', '
+            self._buffer += self._constants
+        self._buffer += b'}}'
+
+    def add_columns(self, start_times, end_times, columns):
+        '''
+        Encode one datapoint per row of columnar data, where columns maps each
+        property name to a sequence of values aligned with start_times.
+        '''
+        names = list(columns)
+        values = [columns[name] for name in names]
+        for index in range(len(start_times)):
+            self.add(start_times[index], end_times[index],
+                     [(name, value[index]) for name, value in zip(names, values)])
+
+    @property
+    def count(self):
+        '''
+        Number of datapoints waiting to be sent.
+        '''
+        return len(self._offsets)
+
+    @property
+    def nbytes(self):
+        '''
+        Size of the uncompressed body for the datapoints waiting to be sent.
+        '''
+        return len(self._buffer)
+
+    def count_within(self, max_bytes):
+        '''
+        Number of leading datapoints whose uncompressed body fits in max_bytes (at least one).
+        '''
+        if self.nbytes <= max_bytes:
+            return self.count
+        # _offsets[k] is the size of the first k datapoints.
+        return max(bisect.bisect_right(self._offsets, max_bytes) - 1, 1)
+
+    def body(self, count=None):
+        '''
+        Return the request body for the first count datapoints (all of them by default).
+        '''
+        end = len(self._buffer) if count is None or count >= self.count else self._offsets[count]
+        payload = b'[' + bytes(self._buffer[2:end]) + b']'
+        if self.compress:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            payload = compressor.compress(payload) + compressor.flush()
+        return payload
+
+    def drop(self, count):
+        '''
+        Remove the first count datapoints, once they have been sent.
+        '''
+        if count >= self.count:
+            self.reset()
+        else:
+            shift = self._offsets[count]
+            del self._buffer[:shift]
+            self._offsets = [offset - shift for offset in self._offsets[count:]]
+
+    def reset(self):
+        '''
+        Empty the buffer so the encoder can be reused for the next batch.
+        '''
+        del self._buffer[:]
+        self._offsets = []
+
+    def _encode_key(self, name):
+        if name not in self._keys:
+            self._keys[name] = (json.dumps(name) + ': ').encode('utf-8')
+        return self._keys[name]
+
+    def _encode_properties(self, properties):
+        items = properties.items() if isinstance(properties, dict) else properties
+        encoded = []
+        for name, value in items:
+            # numpy scalars (np.float32, np.int64, ...), without importing numpy
+            if hasattr(value, 'dtype') and hasattr(value, 'item'):
+                value = value.item()
+            if isinstance(value, float):
+                # NaN and infinity are not valid JSON, leave the property out.
+                if math.isnan(value) or math.isinf(value):
+                    continue
+                value = repr(value)
+            elif isinstance(value, bool) or value is None:
+                value = json.dumps(value)
+            elif isinstance(value, (int, long)):
+                value = str(value)
+            else:
+                value = json.dumps(value)
+            encoded.append(self._encode_key(name) + value.encode('utf-8'))
+        return b', '.join(encoded)
+
+
+class BatchPolicy(object):
+    '''
+    Decides how many datapoints go in each request.
+
+    Batches never exceed max_bytes of uncompressed JSON. The number of datapoints
+    per batch grows while the server answers faster than fast_seconds and shrinks
+    when it answers slower than slow_seconds, or rejects a batch as too large (413)
+    or fails with a server error (5xx), in which case the batch is retried smaller (after a
+    server error, only once retry_delay has passed, doubling from backoff seconds).
+    Every request is recorded in history as (datapoints, bytes, seconds, status).
+    '''
+
+    GROWTH = 1.5
+    SHRINK = 0.5
+    MAX_RETRIES = 5
+
+    def __init__(self, size=3000, max_bytes=2*1024*1024, fast_seconds=1.0, slow_seconds=5.0,
+                 min_size=1, max_size=50000, backoff=1.0):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.fast_seconds = fast_seconds
+        self.slow_seconds = slow_seconds
+        self.min_size = min_size
+        self.max_size = max_size
+        self.backoff = backoff
+        self.history = []
+        self.retries = 0
+        # Batches the server rejected as too large put a cap on later growth.
+        self.ceiling = max_size
+
+    def full(self, encoder):
+        '''
+        Whether the encoder holds enough datapoints to send a batch.
+        '''
+        return encoder.count >= self.size or encoder.nbytes >= self.max_bytes
+
+    def batch_count(self, encoder):
+        '''
+        Number of datapoints from the encoder to put in the next request.
+        '''
+        return min(self.size, encoder.count_within(self.max_bytes))
+
+    def record(self, count, nbytes, seconds, status):
+        '''
+        Adjust the batch size after a request. Returns True if the batch should be retried.
+        '''
+        self.history.append((count, nbytes, seconds, status))
+
+        if status == 413 or status >= 500:
+            if self.retries >= self.MAX_RETRIES or (status == 413 and count <= self.min_size):
+                return False
+            self.retries += 1
+            if status == 413:
+                self.ceiling = max(self.min_size, count - 1)
+            self.size = max(self.min_size, int(min(self.size, count) * self.SHRINK))
+            return True
+
+        self.retries = 0
+        if status < 400:
+            if seconds > self.slow_seconds:
+                self.size = max(self.min_size, int(self.size * self.SHRINK))
+            elif seconds < self.fast_seconds and count >= self.size and nbytes < self.max_bytes:
+                # Only grow when the last batch was actually limited by the count.
+                self.size = min(self.ceiling, int(math.ceil(self.size * self.GROWTH)))
+        return False
+
+    def retry_delay(self):
+        '''
+        Seconds to wait before retrying a batch the server failed, doubling with each retry in a row.
+        '''
+        return min(self.backoff * 2 ** max(self.retries - 1, 0), 60)
+
+    def summary(self):
+        '''
+        One line describing the requests made so far, for the logs.
+        '''
+        sent = [entry for entry in self.history if entry[3] < 400]
+        if not sent:
+            return "no datapoint batches sent"
+        sizes = [entry[0] for entry in sent]
+        return "%s datapoints in %s batches (size min %s, mean %s, max %s, %s bytes, %.2fs waiting, %s retried)" % (
+            sum(sizes), len(sent), min(sizes), sum(sizes) / len(sizes), max(sizes),
+            sum(entry[1] for entry in sent), sum(entry[2] for entry in self.history),
+            len(self.history) - len(sent))
+
+
+def add_batch_arguments(parser):
+    '''
+    Add the arguments controlling datapoint batches to an extractor's parser.
+    '''
+    parser.add_argument('--batchsize', type=int, default=3000,
+                        help="number of datapoints to submit at a time to start with")
+    parser.add_argument('--maxbatchsize', type=int, default=50000,
+                        help="max number of datapoints to submit at a time")
+    parser.add_argument('--batchbytes', type=int, default=2*1024*1024,
+                        help="max size in bytes of the datapoints submitted at a time")
+    parser.add_argument('--batchlatency', type=float, nargs=2, default=[1.0, 5.0],
+                        help="grow batches while the server responds in less than the first value (seconds) "
+                             "and shrink them when it takes more than the second")
+    parser.add_argument('--gzip', action='store_true',
+                        help="gzip-compress datapoint request bodies")
+
+
+def batch_policy_from_args(args):
+    '''
+    Build a BatchPolicy from the arguments added by add_batch_arguments.
+    '''
+    return BatchPolicy(size=args.batchsize, max_bytes=args.batchbytes,
+                       fast_seconds=args.batchlatency[0], slow_seconds=args.batchlatency[1],
+                       max_size=max(args.maxbatchsize, args.batchsize))
+
+
+def post_datapoints(connector, host, key, encoder, policy=None):
+    '''
+    Send the encoded datapoints to the geostreams bulk endpoint, in as many requests
+    as the policy asks for, and remove them from the encoder.
+    Returns the number of datapoints sent.
+    '''
+    headers = {'Content-type': 'application/json'}
+    if encoder.compress:
+        headers['Content-Encoding'] = 'gzip'
+    url = "%sapi/geostreams/datapoints/bulk?key=%s" % (host + ("" if host.endswith("/") else "/"), key)
+
+    sent = 0
+    while encoder.count > 0:
+        count = encoder.count if policy is None else policy.batch_count(encoder)
+        body = encoder.body(count)
+        started = time.time()
+        result = requests.post(url, headers=headers, data=body,
+                               verify=connector.ssl_verify if connector else True)
+        if policy is not None and policy.record(count, len(body), time.time() - started, result.status_code):
+            if result.status_code >= 500:
+                # Give an overloaded server time to recover instead of sending it the smaller batch at once
+                time.sleep(policy.retry_delay())
+            continue
+        result.raise_for_status()
+
+        encoder.drop(count)
+        sent += count
+
+    return sent
@@ -8,16 +8,19 @@ from pyclowder.utils import CheckMessage
 
 from pyclowder.files import upload_metadata, download_metadata
 from terrautils.extractors import TerrarefExtractor, build_metadata
-from terrautils.geostreams import create_datapoints, create_sensor, create_stream, \
-	get_stream_by_name, get_sensor_by_name
+from terrautils.geostreams import create_sensor, create_stream, get_stream_by_name, get_sensor_by_name
 
 from parser import *
+from datapoints import DatapointEncoder, post_datapoints, add_batch_arguments, batch_policy_from_args
+from profiling import add_profiling_arguments, profile_messages
+from concurrency import add_concurrency_arguments, pool_messages, start_extractor
 
 
 def add_local_arguments(parser):
 	# add any additional arguments to parser
-	parser.add_argument('--batchsize', type=int, default=3000,
-						help="max number of datapoints to submit at a time")
+	add_batch_arguments(parser)
+	add_profiling_arguments(parser)
+	add_concurrency_arguments(parser)
 
 class MetDATFileParser(TerrarefExtractor):
 	def __init__(self):
@@ -29,7 +32,13 @@ class MetDATFileParser(TerrarefExtractor):
 		# parse command line and load default logging configuration
 		self.setup(sensor='energyfarm_datparser')
 
-		self.batchsize = self.args.batchsize
+		self.gzip = self.args.gzip
+
+		# profile each message if asked to
+		profile_messages(self)
+
+		# process several messages at a time if asked to
+		pool_messages(self)
 
 	def check_message(self, connector, host, secret_key, resource, parameters):
 		# Weather CEN_Avg15.dat, Weather CEN_DayAvg.dat
@@ -103,27 +112,17 @@ class MetDATFileParser(TerrarefExtractor):
 		ISO_8601_UTC_OFFSET = dateutil.tz.tzoffset("-07:00", -7 * 60 * 60)
 		records = parse_file(resource["local_paths"][0], last_processed_time, utc_offset=ISO_8601_UTC_OFFSET)
 		# Add props to each record.
-		for record in records:
-			record['properties']['source_file'] = resource['id']
-			record['stream_id'] = str(stream_id)
-
 		total_dp = 0
-		datapoint_list = []
-		for record in records:
-			datapoint_list.append({
-				"start_time": record['start_time'],
-				"end_time": record['end_time'],
-				"type": "Point",
-				"geometry": record['geometry'],
-				"properties": record['properties']
-			})
-			if len(datapoint_list) > self.batchsize:
-				create_datapoints(connector, host, secret_key, stream_id, datapoint_list)
-				total_dp += len(datapoint_list)
-				datapoint_list = []
-		if len(datapoint_list) > 0:
-			create_datapoints(connector, host, secret_key, stream_id, datapoint_list)
-			total_dp += len(datapoint_list)
+		batch_policy = batch_policy_from_args(self.args)
+		if len(records) > 0:
+			encoder = DatapointEncoder(stream_id, records[0]['geometry'], compress=self.gzip)
+			encoder.set_constants([('source_file', resource['id'])])
+			for record in records:
+				encoder.add(record['start_time'], record['end_time'], record['properties'])
+				if batch_policy.full(encoder):
+					total_dp += post_datapoints(connector, host, secret_key, encoder, batch_policy)
+			total_dp += post_datapoints(connector, host, secret_key, encoder, batch_policy)
+			self.log_info(resource, "geostreams: %s" % batch_policy.summary())
 
 		# Mark dataset as processed
 		metadata = build_metadata(host, self.extractor_info, resource['id'], {
@@ -153,4 +152,4 @@ def delete_metadata(connector, host, key, fileid, extractor=None):
 
 if __name__ == "__main__":
 	extractor = MetDATFileParser()
-	extractor.start()
+	start_extractor(extractor)
@@ -0,0 +1,288 @@
+'''
+chunked_upload.py
+
+Uploads large files (the full-day netCDF and geostreams CSV) to a Clowder dataset in
+chunks read from disk, so memory use does not grow with the file, with retries, and
+with progress in the logs.
+
+Files under one of the connector's mounted_paths are on a file system Clowder reads too,
+so they are handed to pyclowder.files.upload_to_dataset, which adds them by path instead
+of sending their contents.
+
+Otherwise the file goes in one multipart POST to api/uploadToDataset, as with
+pyclowder.files.upload_to_dataset, but streamed from disk, and sent again from the start
+after a failure.
+
+Clowder itself has no resumable uploads. Only when asked to (allow_resumable), and the
+server answers OPTIONS <host>api/uploads with a Tus-Resumable header (e.g. a tus endpoint
+in front of Clowder), the file is sent with the tus resumable upload protocol
+(https://tus.io/protocols/resumable-upload): the upload is created with a POST, then sent
+in PATCH requests of one chunk each from the offset the server acknowledged. After a
+failure, the acknowledged offset is asked for again with a HEAD and the upload resumes
+from there. That server has to answer the last PATCH with the new file, as uploadToDataset
+does ({"id": ...}); this is not part of tus.
+'''
+
+import base64
+import os
+import time
+import urlparse
+import uuid
+from multiprocessing.pool import ThreadPool
+
+import requests
+from pyclowder.files import upload_to_dataset
+
+
+TUS_VERSION = "1.0.0"
+
+
+class UploadError(Exception):
+    pass
+
+
+class _MultipartBody(object):
+    '''
+    A multipart/form-data body holding one file, read from disk as it is sent
+    '''
+
+    def __init__(self, path, field="File", progress=None):
+        self.boundary = uuid.uuid4().hex
+        filename = os.path.basename(path)
+        # Paths read from JSON (e.g. a shard index) are unicode, the body is bytes
+        if isinstance(filename, unicode):
+            filename = filename.encode("utf-8")
+        self._parts = [('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                        'Content-Type: application/octet-stream\r\n\r\n' % (self.boundary, field, filename)),
+                       open(path, 'rb'),
+                       '\r\n--%s--\r\n' % self.boundary]
+        self._length = len(self._parts[0]) + os.path.getsize(path) + len(self._parts[2])
+        self._progress = progress
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def content_type(self):
+        return "multipart/form-data; boundary=%s" % self.boundary
+
+    def read(self, size=-1):
+        data = ''
+        while self._parts and (size < 0 or len(data) < size):
+            part = self._parts[0]
+            if isinstance(part, str):
+                taken = part if size < 0 else part[:size - len(data)]
+                if len(taken) == len(part):
+                    self._parts.pop(0)
+                else:
+                    self._parts[0] = part[len(taken):]
+            else:
+                taken = part.read(-1 if size < 0 else size - len(data))
+                if not taken or size < 0:
+                    part.close()
+                    self._parts.pop(0)
+            data += taken
+        if self._progress:
+            self._progress(len(data))
+        return data
+
+    def close(self):
+        for part in self._parts:
+            if not isinstance(part, str):
+                part.close()
+        self._parts = []
+
+
+class ChunkedUpload(object):
+    '''
+    Uploads one file to a dataset (see run).
+    '''
+
+    def __init__(self, connector, host, key, dataset_id, path, chunk_size=8*1024**2, retries=5, backoff=2.0, log=None,
+                 timeout=300, allow_resumable=False):
+        self.connector = connector
+        self.host = host + ("" if host.endswith("/") else "/")
+        self.key = key
+        self.dataset_id = dataset_id
+        self.path = path
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.log = log or (lambda message: None)
+        # Seconds without an answer before a request counts as failed
+        self.timeout = timeout
+        # Whether to look for a tus endpoint (see the module docstring)
+        self.allow_resumable = allow_resumable
+        self.size = os.path.getsize(path)
+        self.verify = connector.ssl_verify if connector else True
+
+        # Instrumentation: bytes sent (including those sent again), failed requests and how the file went
+        self.sent = 0
+        self.failures = 0
+        self.mounted = None
+        self.resumable = None
+        self.seconds = 0.0
+        self._reported = 0
+
+    def run(self):
+        '''
+        Upload the file, returning the id of the new file
+        '''
+        started = time.time()
+        try:
+            self.mounted = self._is_mounted()
+            if self.mounted:
+                return upload_to_dataset(self.connector, self.host, self.key, self.dataset_id, self.path)
+            self.resumable = self.allow_resumable and self._server_is_resumable()
+            return self._run_resumable() if self.resumable else self._run_multipart()
+        finally:
+            self.seconds = time.time() - started
+
+    def summary(self):
+        '''
+        One line describing the upload, for the logs.
+        '''
+        return "%s: %s bytes in %.1fs (%s), %s bytes sent, %s failed requests" % (
+            os.path.basename(self.path), self.size, self.seconds,
+            "mounted" if self.mounted else "resumable" if self.resumable else "multipart", self.sent, self.failures)
+
+    def _url(self, path):
+        url = urlparse.urljoin(self.host, path)
+        return url + ("&" if "?" in url else "?") + "key=%s" % self.key
+
+    def _progress(self, count):
+        self.sent += count
+        # Report every tenth of the file
+        if self.size and (self.sent - self._reported) * 10 >= self.size:
+            self._reported = self.sent
+            self.log("uploading %s: %s of %s bytes sent" % (os.path.basename(self.path), self.sent, self.size))
+
+    def _wait(self, attempt, error):
+        self.failures += 1
+        if attempt >= self.retries:
+            raise UploadError("upload of %s failed after %s attempts: %s" % (self.path, attempt + 1, error))
+        delay = min(self.backoff * 2 ** attempt, 60)
+        self.log("uploading %s failed (%s), retrying in %ss" % (os.path.basename(self.path), error, delay))
+        time.sleep(delay)
+
+    def _is_mounted(self):
+        mounted_paths = getattr(self.connector, "mounted_paths", None) or {}
+        return any(self.path.startswith(local_path) for local_path in mounted_paths.values())
+
+    def _server_is_resumable(self):
+        try:
+            result = requests.options(self._url("api/uploads"), verify=self.verify, timeout=self.timeout)
+        except requests.RequestException:
+            return False
+        return result.status_code < 400 and "Tus-Resumable" in result.headers
+
+    def _run_multipart(self):
+        attempt = 0
+        while True:
+            body = _MultipartBody(self.path, progress=self._progress)
+            try:
+                result = requests.post(self._url("api/uploadToDataset/%s" % self.dataset_id), data=body,
+                                       headers={"Content-Type": body.content_type}, verify=self.verify, timeout=self.timeout)
+                if result.status_code < 500:
+                    result.raise_for_status()
+                    return result.json()["id"]
+                error = "HTTP %s" % result.status_code
+            except (requests.ConnectionError, requests.Timeout) as connection_error:
+                error = connection_error
+            finally:
+                body.close()
+            self._wait(attempt, error)
+            attempt += 1
+
+    def _run_resumable(self):
+        headers = {"Tus-Resumable": TUS_VERSION}
+        metadata = ",".join("%s %s" % (name, base64.b64encode(value)) for name, value in
+                            (("filename", os.path.basename(self.path)), ("dataset", self.dataset_id)))
+        attempt = 0
+        while True:
+            try:
+                result = requests.post(self._url("api/uploads"), verify=self.verify, timeout=self.timeout,
+                                       headers=dict(headers, **{"Upload-Length": str(self.size), "Upload-Metadata": metadata}))
+                if result.status_code < 500:
+                    result.raise_for_status()
+                    break
+                error = "HTTP %s" % result.status_code
+            except (requests.ConnectionError, requests.Timeout) as connection_error:
+                error = connection_error
+            self._wait(attempt, error)
+            attempt += 1
+        upload_url = urlparse.urljoin(self.host, result.headers["Location"])
+
+        offset = 0
+        attempt = 0
+        with open(self.path, 'rb') as upload_file:
+            while True:
+                try:
+                    upload_file.seek(offset)
+                    chunk = upload_file.read(self.chunk_size)
+                    self._progress(len(chunk))
+                    result = requests.patch(self._url(upload_url), data=chunk, verify=self.verify, timeout=self.timeout,
+                                            headers=dict(headers, **{"Upload-Offset": str(offset),
+                                                                     "Content-Type": "application/offset+octet-stream"}))
+                    if result.status_code < 400:
+                        offset = int(result.headers["Upload-Offset"])
+                        attempt = 0
+                        if offset >= self.size:
+                            return result.json()["id"]
+                        continue
+                    if result.status_code < 500 and result.status_code != 409:
+                        result.raise_for_status()
+                    error = "HTTP %s" % result.status_code
+                except (requests.ConnectionError, requests.Timeout) as connection_error:
+                    error = connection_error
+
+                self._wait(attempt, error)
+                attempt += 1
+                # Resume from what the server has
+                try:
+                    result = requests.head(self._url(upload_url), headers=headers, verify=self.verify, timeout=self.timeout)
+                    result.raise_for_status()
+                    offset = int(result.headers["Upload-Offset"])
+                    self.log("resuming upload of %s from byte %s" % (os.path.basename(self.path), offset))
+                except requests.RequestException:
+                    pass
+
+
+def delete_file(connector, host, key, file_id):
+    '''
+    Delete a file from Clowder, e.g. the older copy of an output uploaded again
+    '''
+    result = requests.delete(urlparse.urljoin(host, "api/files/%s?key=%s" % (file_id, key)),
+                             verify=connector.ssl_verify if connector else True)
+    result.raise_for_status()
+
+
+class UploadPool(object):
+    '''
+    Runs ChunkedUploads on a fixed number of threads, shared by every message of the extractor, so
+    the uploads of a message (e.g. many geostreams CSV shards) and of concurrent messages queue for
+    them in the order they are started, instead of all sending at once
+    '''
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._pool = ThreadPool(workers)
+
+    def start(self, upload):
+        '''
+        Queue an upload, returning a BackgroundUpload to wait for it with
+        '''
+        return BackgroundUpload(upload, self._pool.apply_async(upload.run))
+
+
+class BackgroundUpload(object):
+    '''
+    An upload queued on an UploadPool; result waits for it and returns the id of the new file
+    '''
+
+    def __init__(self, upload, pending):
+        self.upload = upload
+        self._pending = pending
+
+    def result(self):
+        return self._pending.get()
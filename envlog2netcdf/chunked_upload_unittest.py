@@ -0,0 +1,155 @@
+'''
+This is the unit test module for chunked_upload.py.
+It uploads a file to the local Clowder stand-in of the replay harness
+(replay/clowder_standin.py), which makes some of the upload requests fail,
+and checks that the file arrives whole. pyclowder has to be importable.
+
+To run the unit test, simply use:
+python chunked_upload_unittest.py
+'''
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "replay"))
+from clowder_standin import ClowderStandIn
+import chunked_upload
+from chunked_upload import ChunkedUpload, UploadError, UploadPool, delete_file
+
+
+class chunked_uploadUnitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.file = tempfile.NamedTemporaryFile(suffix=".nc")
+		self.file.write(os.urandom(3 * 1024 * 1024 + 17))
+		self.file.flush()
+		with open(self.file.name, 'rb') as uploaded:
+			self.sha1 = hashlib.sha1(uploaded.read()).hexdigest()
+
+	def tearDown(self):
+		self.file.close()
+
+	def upload(self, standin, retries=50, allow_resumable=True):
+		return ChunkedUpload(None, standin.url, "key", "dataset", self.file.name,
+							 chunk_size=256 * 1024, retries=retries, backoff=0.001, allow_resumable=allow_resumable)
+
+	def test_resumableUploadSurvivesFailures(self):
+		'''
+		Dropped connections and server errors are resumed from the offset the server acknowledged
+		'''
+		with ClowderStandIn(resumable=True, failure_rate=0.3, seed=3) as standin:
+			upload = self.upload(standin)
+			fileId = upload.run()
+			uploaded = standin.dataset_files["dataset"]
+			self.assertTrue(upload.resumable)
+			self.assertTrue(upload.failures > 0)
+			self.assertEqual([entry["id"] for entry in uploaded], [fileId])
+			self.assertEqual(uploaded[0]["sha1"], self.sha1)
+			# Only the failed chunks were sent again
+			self.assertTrue(upload.sent < 2 * upload.size)
+
+	def test_multipartUploadIsSentAgain(self):
+		'''
+		Without resumable uploads, the whole file is sent again after a failure
+		'''
+		with ClowderStandIn(failure_rate=0.5, seed=5) as standin:
+			upload = self.upload(standin)
+			fileId = upload.run()
+			uploaded = standin.dataset_files["dataset"]
+			self.assertFalse(upload.resumable)
+			self.assertEqual([entry["id"] for entry in uploaded], [fileId])
+			self.assertEqual(uploaded[0]["filename"], os.path.basename(self.file.name))
+			self.assertTrue(uploaded[0]["size"] > upload.size)
+
+	def test_resumableUploadOnlyWhenAllowed(self):
+		'''
+		Without allow_resumable, a server offering tus uploads still gets a multipart upload
+		'''
+		with ClowderStandIn(resumable=True) as standin:
+			upload = self.upload(standin, allow_resumable=False)
+			upload.run()
+			self.assertFalse(upload.resumable)
+			self.assertEqual(standin.requests["resumable"], 0)
+
+	def test_mountedFileIsAddedByPath(self):
+		'''
+		A file under one of the connector's mounted paths is handed to pyclowder's upload_to_dataset, not sent
+		'''
+		class Connector(object):
+			ssl_verify = True
+			mounted_paths = {"/home/clowder/sites": os.path.dirname(self.file.name)}
+		added = []
+		realUpload = chunked_upload.upload_to_dataset
+		chunked_upload.upload_to_dataset = lambda connector, host, key, datasetId, path: added.append(path) or "mounted"
+		try:
+			with ClowderStandIn() as standin:
+				upload = ChunkedUpload(Connector(), standin.url, "key", "dataset", self.file.name)
+				self.assertEqual(upload.run(), "mounted")
+				self.assertEqual(standin.dataset_files["dataset"], [])
+		finally:
+			chunked_upload.upload_to_dataset = realUpload
+		self.assertEqual(added, [self.file.name])
+		self.assertTrue(upload.mounted)
+		self.assertEqual(upload.sent, 0)
+
+	def test_multipartUploadOfAUnicodePath(self):
+		'''
+		Paths read from JSON (e.g. the shards of a geostreams CSV index) are unicode, the file is still sent as bytes
+		'''
+		with ClowderStandIn() as standin:
+			upload = ChunkedUpload(None, standin.url, "key", "dataset", unicode(self.file.name), backoff=0.001)
+			upload.run()
+			self.assertEqual(standin.dataset_files["dataset"][0]["filename"], os.path.basename(self.file.name))
+
+	def test_uploadGivesUpAfterItsRetries(self):
+		with ClowderStandIn(resumable=True, failure_rate=1.0, seed=1) as standin:
+			self.assertRaises(UploadError, self.upload(standin, retries=2).run)
+			self.assertEqual(standin.dataset_files["dataset"], [])
+
+	def test_uploadReplacesOlderCopy(self):
+		'''
+		An output uploaded again replaces the older copy once the older one is deleted
+		'''
+		with ClowderStandIn() as standin:
+			olderId = self.upload(standin).run()
+			newerId = self.upload(standin).run()
+			delete_file(None, standin.url, "key", olderId)
+			self.assertEqual([entry["id"] for entry in standin.dataset_files["dataset"]], [newerId])
+
+	def test_uploadPoolBoundsConcurrentUploads(self):
+		'''
+		No more uploads than the pool has workers are sent at a time, and each result is that of its upload
+		'''
+		running = []
+		sending = threading.Lock()
+		class SlowUpload(object):
+			def __init__(self, number):
+				self.number = number
+			def run(self):
+				with sending:
+					running.append(1)
+					self.concurrent = len(running)
+				time.sleep(0.05)
+				with sending:
+					running.pop()
+				return self.number
+
+		pool = UploadPool(2)
+		uploads = [SlowUpload(number) for number in range(6)]
+		pending = [pool.start(upload) for upload in uploads]
+		self.assertEqual([background.result() for background in pending], range(6))
+		self.assertEqual(max(upload.concurrent for upload in uploads), 2)
+
+	def test_uploadPoolRaisesUploadErrors(self):
+		with ClowderStandIn(resumable=True, failure_rate=1.0, seed=1) as standin:
+			background = UploadPool(2).start(self.upload(standin, retries=2))
+			self.assertRaises(UploadError, background.result)
+
+
+if __name__ == '__main__':
+	unittest.main()
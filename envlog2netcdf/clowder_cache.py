@@ -0,0 +1,128 @@
+'''
+clowder_cache.py
+
+A cache of what the extractor looks up in Clowder for every message: the dataset id
+at the end of a collection hierarchy (space, sensor, year, month, day), and the
+files of a dataset. Entries expire after a TTL, and file listings are updated locally
+when the extractor uploads a file, so a backfill does not walk the same hierarchy
+and list the same dataset again for every message.
+
+Entries are kept in memory, and optionally in a directory shared by several extractor
+processes (or containers), one small JSON file per entry:
+
+  <cache directory>/<kind>-<SHA-1 of the key>.json  -> {"key", "value", "expires"}
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class ClowderCache(object):
+    '''
+    Caches dataset ids by hierarchy path and file listings by dataset id, for ttl seconds.
+    '''
+
+    def __init__(self, ttl=3600, directory=None):
+        self.ttl = ttl
+        self.directory = directory
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Instrumentation: lookups answered from the cache and lookups that went to Clowder
+        self.hits = 0
+        self.misses = 0
+
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def dataset_id(self, path, resolve):
+        '''
+        Return the id of the dataset at the end of path (a tuple of collection and dataset
+        names), calling resolve() to find or create it if it is not cached
+        '''
+        return self._get("dataset", "/".join(path), resolve)
+
+    def file_list(self, dataset_id, fetch):
+        '''
+        Return the files of a dataset, calling fetch() to list them if they are not cached
+        '''
+        return self._get("files", dataset_id, fetch)
+
+    def add_file(self, dataset_id, file_id, filename):
+        '''
+        Record a file uploaded to a dataset in its cached listing, if there is one
+        '''
+        with self._lock:
+            files = self._read("files", dataset_id)
+            if files is not None:
+                self._write("files", dataset_id, [f for f in files if f['filename'] != filename] +
+                            [{"id": file_id, "filename": filename}], keep_expiry=True)
+
+    def invalidate(self, kind, key):
+        '''
+        Forget an entry ("dataset" by path tuple, or "files" by dataset id), e.g. after a request using it failed
+        '''
+        key = "/".join(key) if kind == "dataset" else key
+        with self._lock:
+            self._entries.pop((kind, key), None)
+            if self.directory:
+                try:
+                    os.remove(self._path(kind, key))
+                except OSError:
+                    pass
+
+    def summary(self):
+        '''
+        One line describing the lookups, for the logs.
+        '''
+        return "%s cached, %s from Clowder" % (self.hits, self.misses)
+
+    def _get(self, kind, key, fetch):
+        with self._lock:
+            value = self._read(kind, key)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = fetch()
+        with self._lock:
+            self._write(kind, key, value)
+        return value
+
+    def _path(self, kind, key):
+        return os.path.join(self.directory, "%s-%s.json" % (kind, hashlib.sha1(key).hexdigest()))
+
+    def _read(self, kind, key):
+        now = time.time()
+        entry = self._entries.get((kind, key))
+        if (entry is None or entry["expires"] <= now) and self.directory:
+            # Another process may have cached it
+            try:
+                with open(self._path(kind, key), 'r') as entry_file:
+                    entry = json.load(entry_file)
+            except (IOError, ValueError):
+                entry = None
+            if entry is not None and entry["key"] == key:
+                self._entries[(kind, key)] = entry
+        if entry is None or entry["expires"] <= now:
+            return None
+        return entry["value"]
+
+    def _write(self, kind, key, value, keep_expiry=False):
+        entry = self._entries.get((kind, key))
+        expires = entry["expires"] if keep_expiry and entry else time.time() + self.ttl
+        entry = {"key": key, "value": value, "expires": expires}
+        self._entries[(kind, key)] = entry
+        if self.directory:
+            # Write next to the entry and rename it, so other processes never read half an entry
+            descriptor, temporary_path = tempfile.mkstemp(prefix=".tmp-", dir=self.directory)
+            with os.fdopen(descriptor, 'w') as entry_file:
+                json.dump(entry, entry_file)
+            os.rename(temporary_path, self._path(kind, key))
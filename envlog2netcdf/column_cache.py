@@ -0,0 +1,127 @@
+'''
+column_cache.py
+
+An on-disk cache of the columns parsed from environmental logger JSON files,
+so reprocessing (a new extractor version, a new netCDF layout or CSV export)
+does not have to parse the same JSON again.
+
+Entries are keyed by the SHA-1 of the file contents and the parser version,
+and each entry is a directory holding one .npy file per column plus an
+index.json with the column names and the parser metadata:
+
+  <cache directory>/<key>/index.json
+  <cache directory>/<key>/<n>.npy
+
+Columns are loaded by memory mapping. The cache is kept under a size limit by
+evicting the least recently used entries (entries are touched when read).
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+_INDEX = "index.json"
+
+
+class ColumnCache(object):
+    '''
+    Stores (metadata, arrays) pairs, where metadata can be encoded as JSON
+    and arrays maps column names to numpy arrays.
+    '''
+
+    def __init__(self, directory, max_bytes=10*1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Instrumentation: lookups that found an entry, lookups that did not and entries evicted.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(contents, version):
+        '''
+        Return the cache key of a file's contents, for the given parser version.
+        '''
+        return "%s-v%s" % (hashlib.sha1(contents).hexdigest(), version)
+
+    def get(self, key):
+        '''
+        Return the (metadata, arrays) stored under key, with the arrays memory mapped, or None.
+        '''
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, _INDEX), 'r') as indexFile:
+                index = json.load(indexFile)
+            arrays = dict((name, np.load(os.path.join(entry, "%s.npy" % number), mmap_mode='r'))
+                          for number, name in enumerate(index["columns"]))
+        except (IOError, OSError, ValueError):
+            # Missing, or evicted by another process while being read.
+            self.misses += 1
+            return None
+
+        os.utime(entry, None)
+        self.hits += 1
+        return index["metadata"], arrays
+
+    def put(self, key, metadata, arrays):
+        '''
+        Store (metadata, arrays) under key, then evict entries until the cache fits its size limit.
+        '''
+        entry = os.path.join(self.directory, key)
+        if os.path.isdir(entry):
+            return
+
+        # Write the entry next to its final place and rename it, so readers never see half an entry.
+        temporary = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        try:
+            names = sorted(arrays)
+            for number, name in enumerate(names):
+                np.save(os.path.join(temporary, "%s.npy" % number), np.ascontiguousarray(arrays[name]))
+            with open(os.path.join(temporary, _INDEX), 'w') as indexFile:
+                json.dump({"columns": names, "metadata": metadata}, indexFile)
+            os.rename(temporary, entry)
+        except OSError:
+            # Another process stored the same entry first.
+            shutil.rmtree(temporary, ignore_errors=True)
+            if not os.path.isdir(entry):
+                raise
+
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the cache is under its size limit.
+        '''
+        entries = []
+        total = 0
+        for key in os.listdir(self.directory):
+            entry = os.path.join(self.directory, key)
+            if key.startswith(".") or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                continue
+            total += size
+
+        for used, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            self.evictions += 1
+
+    def summary(self):
+        '''
+        One line describing the lookups, for the logs.
+        '''
+        return "%s cached, %s parsed, %s evicted" % (self.hits, self.misses, self.evictions)
@@ -0,0 +1,78 @@
+'''
+This is the unit test module for column_cache.py.
+It stores columns in a cache in a temporary directory and checks that they are
+read back as stored, and that the least recently used entries are evicted.
+
+To run the unit test, simply use:
+python column_cache_unittest.py
+'''
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from column_cache import ColumnCache
+
+
+class column_cacheUnitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.arrays = {"time": np.arange(100, dtype=np.float64),
+					   "spectrum": np.arange(100 * 1024, dtype=np.int32).reshape(100, 1024)}
+		self.metadata = {"sensors": [["par", {"units": "umol/(m^2*s)"}]]}
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def entries(self, cache):
+		return sorted(key for key in os.listdir(cache.directory) if not key.startswith("."))
+
+	def test_canReadBackWhatWasStored(self):
+		'''
+		Columns come back equal and memory mapped, with their metadata, and missing keys are misses
+		'''
+		cache = ColumnCache(self.directory)
+		key = cache.key("contents", 1)
+		self.assertEqual(cache.get(key), None)
+		cache.put(key, self.metadata, self.arrays)
+		metadata, arrays = cache.get(key)
+		self.assertEqual(metadata, self.metadata)
+		self.assertEqual(sorted(arrays), sorted(self.arrays))
+		for name in arrays:
+			self.assertTrue(isinstance(arrays[name], np.memmap))
+			self.assertTrue(np.array_equal(arrays[name], self.arrays[name]))
+		self.assertEqual((cache.hits, cache.misses), (1, 1))
+		# A second put of the same entry leaves it alone
+		cache.put(key, {}, {"time": np.zeros(1)})
+		self.assertEqual(cache.get(key)[0], self.metadata)
+
+	def test_canKeyByContentsAndParserVersion(self):
+		self.assertEqual(ColumnCache.key("contents", 1), ColumnCache.key("contents", 1))
+		self.assertNotEqual(ColumnCache.key("contents", 1), ColumnCache.key("contents", 2))
+		self.assertNotEqual(ColumnCache.key("contents", 1), ColumnCache.key("other contents", 1))
+
+	def test_canEvictTheLeastRecentlyUsedEntries(self):
+		'''
+		Once the cache outgrows its limit, the entries read or written longest ago are removed first
+		'''
+		entrySize = sum(array.nbytes for array in self.arrays.values())
+		cache = ColumnCache(self.directory, max_bytes=int(2.5 * entrySize))
+		now = time.time()
+		for number, key in enumerate(["a", "b"]):
+			cache.put(key, self.metadata, self.arrays)
+			os.utime(os.path.join(self.directory, key), (now - 100 + number, now - 100 + number))
+		# Reading a makes b the least recently used
+		cache.get("a")
+		cache.put("c", self.metadata, self.arrays)
+		self.assertEqual(self.entries(cache), ["a", "c"])
+		self.assertEqual(cache.evictions, 1)
+		self.assertEqual(cache.get("b"), None)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+'''
+environmental_logger_chunkstore.py
+
+----------------------------------------------------------------------------------------
+A chunked directory store for the environmental logger outputs, as an alternative to
+the full-day netCDF file: every JSON file is converted into its own time chunk, which
+independent workers can write at the same time, and late files are just more chunks.
+----------------------------------------------------------------------------------------
+
+Layout (in the spirit of Zarr, one file per variable per chunk, but with chunks of
+the size of their JSON file, which Zarr's regular chunk grid cannot describe):
+
+  <store>/store.json                 -> consolidated metadata: dimensions, variables (dtype,
+                                        dimensions, attributes), global attributes, and the
+                                        chunks in time order with their time range
+  <store>/<chunk>/chunk.json         -> the metadata of one chunk
+  <store>/<chunk>/<variable>.npy     -> the values of one variable in that chunk
+
+Chunks are named after their JSON file. Variables without a time dimension are stored
+in every chunk, and readers use the ones of the first chunk (as ncrcat does). Variables
+that were never assigned (e.g. sensor_par, which only has attributes) have no file.
+
+Usage:
+
+python environmental_logger_json2netcdf.py drc_in CHUNKED store_out # Convert every file of drc_in into a chunk of store_out
+python environmental_logger_chunkstore.py store_out day.nc          # Convert a store to one netCDF file
+----------------------------------------------------------------------------------------
+'''
+
+import argparse
+import collections
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from netCDF4 import Dataset
+
+
+# The output file type that selects the chunk store in environmental_logger_json2netcdf.main
+CHUNK_STORE = "CHUNKED"
+
+_STORE_METADATA = "store.json"
+_CHUNK_METADATA = "chunk.json"
+_LOCK = ".lock"
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class ChunkVariable(object):
+    '''
+    A variable of a chunk being written, with the parts of the netCDF4.Variable interface
+    environmental_logger_json2netcdf.main uses (assignment, attributes, dtype)
+    '''
+
+    def __init__(self, name, dtype, dimensions):
+        self.__dict__["name"] = name
+        self.__dict__["dtype"] = np.dtype(dtype)
+        self.__dict__["dimensions"] = tuple(dimensions)
+        self.__dict__["_attributes"] = collections.OrderedDict()
+        self.__dict__["_data"] = None
+
+    def __setattr__(self, name, value):
+        self.setncattr(name, value)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["_attributes"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def setncattr(self, name, value):
+        self._attributes[name] = _jsonable(value)
+
+    def getncattr(self, name):
+        return self._attributes[name]
+
+    def ncattrs(self):
+        return list(self._attributes)
+
+    def __setitem__(self, key, value):
+        if self._data is None or key in (slice(None), Ellipsis) or key == (slice(None), slice(None)):
+            # Assigning the whole variable, the only assignment main makes
+            self.__dict__["_data"] = np.array(value, dtype=self.dtype)
+        else:
+            self._data[key] = value
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+
+class ChunkWriter(object):
+    '''
+    Writes one chunk of a store, with the parts of the netCDF4.Dataset interface
+    environmental_logger_json2netcdf.main uses. The chunk appears in the store, and the
+    store metadata is consolidated, when the writer is closed.
+    '''
+
+    def __init__(self, storeDirectory, chunkName):
+        self.__dict__["storeDirectory"] = storeDirectory
+        self.__dict__["chunkName"] = chunkName
+        self.__dict__["dimensions"] = collections.OrderedDict()
+        self.__dict__["variables"] = collections.OrderedDict()
+        self.__dict__["_attributes"] = collections.OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        return False
+
+    def __setattr__(self, name, value):
+        self.setncattr(name, value)
+
+    def setncattr(self, name, value):
+        self._attributes[name] = _jsonable(value)
+
+    def getncattr(self, name):
+        return self._attributes[name]
+
+    def ncattrs(self):
+        return list(self._attributes)
+
+    def createDimension(self, name, size=None):
+        self.dimensions[name] = size
+
+    def createVariable(self, name, dtype, dimensions=()):
+        self.variables[name] = ChunkVariable(name, dtype, dimensions)
+        return self.variables[name]
+
+    def close(self):
+        '''
+        Write the chunk next to its final place and rename it, so readers and other writers
+        never see half a chunk, then consolidate the store metadata
+        '''
+        if not os.path.isdir(self.storeDirectory):
+            try:
+                os.makedirs(self.storeDirectory)
+            except OSError:
+                if not os.path.isdir(self.storeDirectory):
+                    raise
+
+        times = self.variables["time"][:]
+        metadata = {"name": self.chunkName,
+                    "start": float(times.min()), "end": float(times.max()), "records": len(times),
+                    "dimensions": self.dimensions.items(),
+                    "attributes": self._attributes.items(),
+                    "variables": [{"name": variable.name,
+                                   "dtype": variable.dtype.str,
+                                   "dimensions": variable.dimensions,
+                                   "attributes": variable._attributes.items(),
+                                   "stored": variable._data is not None}
+                                  for variable in self.variables.values()]}
+
+        temporary = tempfile.mkdtemp(prefix=".tmp-", dir=self.storeDirectory)
+        try:
+            for variable in [variable for variable in self.variables.values() if variable._data is not None]:
+                np.save(os.path.join(temporary, variable.name + ".npy"), variable._data)
+            with open(os.path.join(temporary, _CHUNK_METADATA), 'w') as metadataFile:
+                json.dump(metadata, metadataFile)
+
+            chunkDirectory = os.path.join(self.storeDirectory, self.chunkName)
+            if os.path.isdir(chunkDirectory):
+                # Converting the same file again replaces its chunk
+                shutil.rmtree(chunkDirectory)
+            os.rename(temporary, chunkDirectory)
+        except:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+
+        consolidate(self.storeDirectory)
+
+
+def consolidate(storeDirectory):
+    '''
+    Gather the metadata of every chunk of a store into its store.json, with the chunks in time order.
+    Writers hold a lock while doing so, so the last one to finish always sees every chunk.
+    '''
+    with open(os.path.join(storeDirectory, _LOCK), 'a') as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        try:
+            chunks = []
+            for name in os.listdir(storeDirectory):
+                path = os.path.join(storeDirectory, name, _CHUNK_METADATA)
+                if not name.startswith(".") and os.path.exists(path):
+                    with open(path, 'r') as metadataFile:
+                        chunks.append(json.load(metadataFile))
+            chunks.sort(key=lambda chunk: chunk["start"])
+
+            first = chunks[0] if chunks else {"dimensions": [], "attributes": [], "variables": []}
+            metadata = {"dimensions": first["dimensions"],
+                        "attributes": first["attributes"],
+                        "variables": first["variables"],
+                        "records": sum(chunk["records"] for chunk in chunks),
+                        "chunks": [dict((key, chunk[key]) for key in ("name", "start", "end", "records"))
+                                   for chunk in chunks]}
+
+            temporaryPath = os.path.join(storeDirectory, ".tmp-" + _STORE_METADATA)
+            with open(temporaryPath, 'w') as metadataFile:
+                json.dump(metadata, metadataFile, indent=1)
+            os.rename(temporaryPath, os.path.join(storeDirectory, _STORE_METADATA))
+        finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+    return metadata
+
+
+def readMetadata(storeDirectory):
+    '''
+    Return the consolidated metadata of a store
+    '''
+    with open(os.path.join(storeDirectory, _STORE_METADATA), 'r') as metadataFile:
+        return json.load(metadataFile)
+
+
+def readVariable(storeDirectory, name, metadata=None):
+    '''
+    Return the values of a variable of a store, concatenated over its chunks along time
+    (or those of the first chunk, for variables without a time dimension), or None if it was never assigned
+    '''
+    metadata = metadata or readMetadata(storeDirectory)
+    variable = [variable for variable in metadata["variables"] if variable["name"] == name][0]
+    if not variable["stored"]:
+        return None
+    chunks = [os.path.join(storeDirectory, chunk["name"], name + ".npy") for chunk in metadata["chunks"]]
+    if not variable["dimensions"] or variable["dimensions"][0] != "time":
+        return np.load(chunks[0])
+    return np.concatenate([np.load(chunk, mmap_mode='r') for chunk in chunks])
+
+
+def storeToNetCDF(storeDirectory, outputFileName, fileType="NETCDF4"):
+    '''
+    Convert a store to a single netCDF file, as written for a whole day by the extractor,
+    with a manifest of the chunks (see environmental_logger_json2netcdf.readManifest)
+    '''
+    # environmental_logger_json2netcdf imports this module to write chunks
+    from environmental_logger_json2netcdf import writeManifest
+
+    metadata = readMetadata(storeDirectory)
+    with Dataset(outputFileName, 'w', format=fileType) as netCDFHandler:
+        for name, size in metadata["dimensions"]:
+            netCDFHandler.createDimension(name, size)
+        for variable in metadata["variables"]:
+            ncVariable = netCDFHandler.createVariable(variable["name"], variable["dtype"], tuple(variable["dimensions"]))
+            for attribute, value in variable["attributes"]:
+                ncVariable.setncattr(attribute, value)
+
+            if not variable["stored"]:
+                continue
+            elif variable["dimensions"] and variable["dimensions"][0] == "time":
+                # One chunk at a time, so the whole variable is never in memory
+                offset = 0
+                for chunk in metadata["chunks"]:
+                    values = np.load(os.path.join(storeDirectory, chunk["name"], variable["name"] + ".npy"), mmap_mode='r')
+                    ncVariable[offset:offset + len(values)] = values
+                    offset += len(values)
+            else:
+                ncVariable[...] = readVariable(storeDirectory, variable["name"], metadata)
+
+        for attribute, value in metadata["attributes"]:
+            netCDFHandler.setncattr(attribute, value)
+        writeManifest(netCDFHandler, [{"file": chunk["name"], "start": chunk["start"],
+                                       "end": chunk["end"], "records": chunk["records"]}
+                                      for chunk in metadata["chunks"]])
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Convert an environmental logger chunk store to a netCDF file")
+    parser.add_argument('store', type=str, help='The chunk store directory')
+    parser.add_argument('output_file_path', type=str, help='The netCDF file to write')
+    parser.add_argument('netCDF_format', type=str, nargs='?', default="NETCDF4",
+                        help='The format of the output netCDF file (can be NETCDF3_64BIT_DATA or NETCDF4)')
+    parser.add_argument('--consolidate', action='store_true',
+                        help='Consolidate the store metadata first (e.g. after a writer was killed)')
+    args = parser.parse_args()
+
+    if args.consolidate:
+        consolidate(args.store)
+    storeToNetCDF(args.store, args.output_file_path, args.netCDF_format)
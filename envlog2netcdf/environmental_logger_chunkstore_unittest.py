@@ -0,0 +1,101 @@
+'''
+This is the unit test module for environmental_logger_chunkstore.py.
+It writes small chunks to a store in a temporary directory, out of time order and
+from several threads at once, and checks the consolidated store and the netCDF
+file converted from it.
+
+To run the unit test, simply use:
+python environmental_logger_chunkstore_unittest.py
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+from netCDF4 import Dataset
+
+from environmental_logger_chunkstore import ChunkWriter, consolidate, readMetadata, readVariable, storeToNetCDF
+from environmental_logger_json2netcdf import readManifest
+
+
+class environmental_logger_chunkstoreUnitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.store = os.path.join(self.directory, "store")
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def writeChunk(self, name, start, count):
+		'''
+		Write a chunk of count records, one a second from start (in days since 1970-01-01)
+		'''
+		with ChunkWriter(self.store, name) as chunk:
+			chunk.createDimension("time", None)
+			chunk.createDimension("wvl_lgr", 4)
+			chunk.createVariable("time", "f8", ("time",))[:] = start + np.arange(count) / 86400.0
+			chunk.createVariable("par", "f4", ("time",))[:] = np.arange(count) + start
+			chunk.createVariable("wvl_lgr", "f4", ("wvl_lgr",))[:] = np.array([400, 500, 600, 700]) + start
+			# Only has attributes, like sensor_par
+			chunk.createVariable("sensor_par", "i4").units = "umol/(m^2*s)"
+			chunk.title = "chunk %s" % name
+
+	def test_canConsolidateChunksInTimeOrder(self):
+		'''
+		Chunks written out of time order are listed, and their records read, in time order
+		'''
+		self.writeChunk("b", 17318.5, 5)
+		self.writeChunk("a", 17318.0, 3)
+		self.writeChunk("c", 17319.0, 2)
+		metadata = readMetadata(self.store)
+		self.assertEqual([chunk["name"] for chunk in metadata["chunks"]], ["a", "b", "c"])
+		self.assertEqual(metadata["records"], 10)
+		par = readVariable(self.store, "par", metadata)
+		self.assertTrue(np.array_equal(par, np.concatenate([np.arange(3) + 17318.0, np.arange(5) + 17318.5,
+															np.arange(2) + 17319.0]).astype(np.float32)))
+		self.assertTrue(np.all(np.diff(readVariable(self.store, "time", metadata)) > 0))
+		# Variables without a time dimension, and attributes, come from the first chunk
+		self.assertTrue(np.array_equal(readVariable(self.store, "wvl_lgr", metadata), np.array([400, 500, 600, 700]) + 17318.0))
+		self.assertEqual(dict(metadata["attributes"])["title"], "chunk a")
+		self.assertEqual(readVariable(self.store, "sensor_par", metadata), None)
+
+	def test_canReplaceAChunk(self):
+		self.writeChunk("a", 17318.0, 3)
+		self.writeChunk("a", 17318.0, 7)
+		self.assertEqual([(chunk["name"], chunk["records"]) for chunk in readMetadata(self.store)["chunks"]], [("a", 7)])
+		self.assertEqual(sorted(name for name in os.listdir(self.store) if name.startswith(".tmp-")), [])
+
+	def test_canWriteChunksConcurrently(self):
+		'''
+		The last writer to consolidate sees every chunk, however the writers interleave
+		'''
+		writers = [threading.Thread(target=self.writeChunk, args=("%02d" % number, 17318.0 + number / 24.0, 10))
+				   for number in range(16)]
+		for writer in writers:
+			writer.start()
+		for writer in writers:
+			writer.join()
+		self.assertEqual([chunk["name"] for chunk in readMetadata(self.store)["chunks"]], ["%02d" % number for number in range(16)])
+		self.assertEqual(consolidate(self.store)["records"], 160)
+
+	def test_canConvertAStoreToNetCDF(self):
+		'''
+		The netCDF file holds the records of every chunk in time order, and a manifest of the chunks
+		'''
+		self.writeChunk("b", 17318.5, 5)
+		self.writeChunk("a", 17318.0, 3)
+		outputFileName = os.path.join(self.directory, "day.nc")
+		storeToNetCDF(self.store, outputFileName)
+		with Dataset(outputFileName) as netCDFHandler:
+			self.assertTrue(np.array_equal(netCDFHandler.variables["par"][:], readVariable(self.store, "par")))
+			self.assertTrue(np.array_equal(netCDFHandler.variables["time"][:], readVariable(self.store, "time")))
+			self.assertEqual(netCDFHandler.variables["sensor_par"].units, "umol/(m^2*s)")
+			self.assertEqual([(entry["file"], entry["records"]) for entry in readManifest(netCDFHandler)], [("a", 3), ("b", 5)])
+
+
+if __name__ == "__main__":
+	unittest.main()
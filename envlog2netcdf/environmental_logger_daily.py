@@ -0,0 +1,282 @@
+'''
+environmental_logger_daily.py
+
+Assembles the full-day netCDF file and geostreams CSV of the environmental logger
+from the day's JSON files. Used by the extractor (terra_envlog2netcdf.py) and by
+the reprocessing scheduler (environmental_logger_reprocess.py), so it does not
+depend on Clowder.
+
+The full-day netCDF carries a manifest of the JSON files it was built from (see
+environmental_logger_json2netcdf.readManifest), so JSON files added to the day
+later are converted on their own and inserted, instead of rebuilding the day.
+It also carries the hourly and daily summary of the day (see environmental_logger_summary.py),
+merged from the summaries of its JSON files as they are converted or inserted, and optionally
+the time means of its spectrum (see environmental_logger_pyramid.py), combined the same way.
+The geostreams CSV can also be written as compressed shards with an index (see geo_csv.py).
+
+Readings repeated in overlapping JSON files are only converted from the first file (in file
+name order) that has them, and the records of the day are sorted by time once they are all
+written, so its time axis is strictly increasing even when files overlap or arrive out of order.
+'''
+
+import glob
+import os
+import shutil
+import subprocess
+
+import numpy as np
+from netCDF4 import Dataset
+
+import environmental_logger_json2netcdf as ela
+from environmental_logger_summary import Summary
+from environmental_logger_pyramid import Pyramid
+from geo_csv import GeoCSVFile, GeoCSVShards, geo_index_path, geo_output_files, add_to_geo_index
+from prefetch import Prefetcher
+
+
+_TEMP_FULL = "temp_full.nc"
+_TEMP_SINGLE = "temp_single.nc"
+_TEMP_GEO_CSV = "temp_geo.csv"
+
+
+def read_sensor_columns(ncdf):
+    '''
+    Read the sensor columns back from a full-day netCDF, in the form returned by
+    environmental_logger_json2netcdf.main (only for days converted before the CSV was written alongside)
+    '''
+    columns = {"time": ncdf.variables["time"][:], "sensors": []}
+    streams = set([sensor_info.name for sensor_info in ncdf.variables.values() if sensor_info.name.startswith('sensor')])
+    for stream in streams:
+        if stream != "sensor_spectrum":
+            for members in ncdf.get_variables_by_attributes(sensor=stream):
+                attributes = dict((name, members.getncattr(name)) for name in members.ncattrs())
+                columns["sensors"].append((attributes, members[...]))
+    return columns
+
+def geo_output_path(geo_csv, geo_shards):
+    '''
+    Return the file standing for the geostreams CSV of a day: the CSV, or the index of its shards
+    '''
+    return geo_index_path(geo_csv) if geo_shards else geo_csv
+
+def _open_geo_output(geo_csv, geo_shards, directory):
+    '''
+    Start writing the geostreams CSV geo_csv, as shards if geo_shards, through temporary files in directory
+    '''
+    if geo_shards:
+        return GeoCSVShards(geo_index_path(geo_csv), _TEMP_GEO_CSV.replace(".csv", "_"),
+                            by_sensor=geo_shards["by_sensor"], rows=geo_shards["rows"])
+    return GeoCSVFile(geo_csv, os.path.join(directory, _TEMP_GEO_CSV))
+
+def read_manifest(netcdf_path):
+    '''
+    Return the source files manifest of a full-day netCDF, or None if it was built without one
+    '''
+    with Dataset(netcdf_path, "r") as ncdf:
+        return ela.readManifest(ncdf)
+
+def conversion_in_progress(out_netcdf):
+    '''
+    Whether a full-day conversion into the directory of out_netcdf has started and not finished
+    '''
+    return os.path.exists(os.path.join(os.path.dirname(out_netcdf), _TEMP_FULL))
+
+def remove_temporary_files(out_netcdf):
+    '''
+    Remove what an interrupted conversion into the directory of out_netcdf left behind
+    '''
+    for name in (_TEMP_FULL, _TEMP_SINGLE, _TEMP_GEO_CSV):
+        path = os.path.join(os.path.dirname(out_netcdf), name)
+        if os.path.exists(path):
+            os.remove(path)
+    # Shards of the geostreams CSV being written
+    for path in glob.glob(os.path.join(os.path.dirname(out_netcdf), _TEMP_GEO_CSV.replace(".csv", "_*"))):
+        os.remove(path)
+
+def assemble_day(json_files, out_netcdf, geo_csv, source, timestamp, pack_spectrum=False, prefetch=1,
+                 cache=None, log=None, on_netcdf=None, pyramid=None, geo_shards=None):
+    '''
+    Bring the full-day netCDF and geostreams CSV of a day up to date with its JSON files:
+    insert the files missing from the netCDF manifest if it has one, else convert all of them
+    (unless another conversion of the day is in progress), and write the CSV if it is missing.
+    on_netcdf(out_netcdf) is called as soon as the full-day netCDF is complete, e.g. to start
+    uploading it while the CSV is still being written.
+    With pyramid (a list of band widths, possibly empty), a new full-day netCDF also gets the time
+    means of its spectrum; inserted files are added to them if the day has them.
+    With geo_shards (see geo_csv.parse_geo_shards), the geostreams CSV is written as compressed
+    shards and their index (geo_output_path) instead, and so are the rows of inserted files.
+
+    Returns {"created": <paths of the files written>, "converted": <number of JSON files converted>,
+             "new_geo_csv": <path of a CSV (or shard index) holding only the rows of inserted files, or None>}
+    '''
+    log = log or (lambda message: None)
+    on_netcdf = on_netcdf or (lambda path: None)
+    result = {"created": [], "converted": 0, "new_geo_csv": None}
+    json_files = sorted(json_files)
+    geo_output = geo_output_path(geo_csv, geo_shards)
+
+    # A full-day netCDF with a manifest only needs the JSON files it does not list yet
+    manifest = None
+    if os.path.exists(out_netcdf) and os.path.exists(geo_output):
+        manifest = read_manifest(out_netcdf)
+
+    if manifest is not None:
+        converted = set([entry["file"] for entry in manifest])
+        new_files = [json_file for json_file in json_files if os.path.basename(json_file) not in converted]
+        if new_files:
+            result["new_geo_csv"] = _insert_files(new_files, manifest, out_netcdf, geo_csv, source, timestamp,
+                                                  prefetch, cache, log, geo_shards)
+            result["created"].extend(geo_output_files(result["new_geo_csv"]))
+            result["converted"] = len(new_files)
+        on_netcdf(out_netcdf)
+
+    elif not conversion_in_progress(out_netcdf):
+        result["created"].extend(_convert_files(json_files, out_netcdf, geo_csv, source, timestamp,
+                                                pack_spectrum, prefetch, cache, log, on_netcdf, pyramid, geo_shards))
+        result["converted"] = len(json_files)
+
+    # Write out geostreams.csv for a day converted without it
+    if not os.path.exists(geo_output):
+        if manifest is None and os.path.exists(out_netcdf) and out_netcdf not in result["created"]:
+            on_netcdf(out_netcdf)
+        log("writing geostreams CSV from existing netCDF")
+        geo_writer = _open_geo_output(geo_csv, geo_shards, os.path.dirname(out_netcdf))
+        with Dataset(out_netcdf, "r") as ncdf:
+            geo_writer.write(read_sensor_columns(ncdf), source, timestamp)
+        result["created"].extend(geo_writer.close())
+
+    return result
+
+def _read_new_readings(json_file, json_contents, cache, known_times, log):
+    '''
+    Parse a JSON file and leave out its readings at known_times or repeated in it (see
+    environmental_logger_json2netcdf.dropRepeatedReadings), returning the readings and their manifest entry
+    '''
+    readings = ela.readReadings(json_file, json_contents, cache)
+    times = readings[1]["time"]
+    readings, repeated = ela.dropRepeatedReadings(readings, known_times)
+    if repeated:
+        log("leaving out %s of %s readings of %s already converted" % (repeated, len(times), os.path.basename(json_file)))
+    return readings, ela.manifestEntry(json_file, times, records=len(times) - repeated)
+
+def _convert_files(json_files, out_netcdf, geo_csv, source, timestamp, pack_spectrum, prefetch, cache, log, on_netcdf,
+                   pyramid, geo_shards):
+    '''
+    Convert every JSON file of the day into a new full-day netCDF, and the geostreams CSV if it is missing
+    '''
+    temp_out_full = os.path.join(os.path.dirname(out_netcdf), _TEMP_FULL)
+    temp_out_single = os.path.join(os.path.dirname(out_netcdf), _TEMP_SINGLE)
+    created = []
+
+    # Write out geostreams.csv from the same columns as the netCDF, so it never has to be read back
+    geo_writer = None
+    if not os.path.exists(geo_output_path(geo_csv, geo_shards)):
+        log("writing geostreams CSV while converting")
+        geo_writer = _open_geo_output(geo_csv, geo_shards, os.path.dirname(out_netcdf))
+
+    prefetcher = Prefetcher(json_files, prefetch)
+    manifest = []
+    summary = Summary()
+    pyramids = []
+    # Times of the readings converted so far, sorted
+    known_times = np.zeros(0)
+    for json_file, json_contents in prefetcher:
+        readings, entry = _read_new_readings(json_file, json_contents, cache, known_times, log)
+        manifest.append(entry)
+        if not entry["records"]:
+            continue
+        log("converting %s to netCDF & appending" % os.path.basename(json_file))
+        # The summary and pyramid of the day are written once at the end, not concatenated
+        columns = ela.mainProgramTrigger(json_file, temp_out_single, packSpectrum=pack_spectrum, readings=readings,
+                                         writeSummary=False, pyramid=pyramid)
+        cmd = "ncrcat --record_append %s %s" % (temp_out_single, temp_out_full)
+        subprocess.call([cmd], shell=True)
+        os.remove(temp_out_single)
+        known_times = np.union1d(known_times, columns["time"])
+        summary = summary.merge(columns["summary"])
+        if columns["pyramid"] is not None:
+            pyramids.append(columns["pyramid"])
+        if geo_writer:
+            geo_writer.write(columns, source, timestamp)
+
+    log("inputs: %s" % prefetcher.summary())
+    if cache:
+        log("parsed columns: %s" % cache.summary())
+
+    # Record which files the day was built from, so late files can be inserted later, and the summary of the day
+    with Dataset(temp_out_full, "a") as ncdf:
+        sorted_records = ela.sortRecords(ncdf)
+        if sorted_records:
+            log("sorted %s records of overlapping files by time" % sorted_records)
+        ela.writeManifest(ncdf, manifest)
+        summary.write(ncdf)
+        if pyramids:
+            Pyramid.combine(pyramids).write(ncdf)
+
+    shutil.move(temp_out_full, out_netcdf)
+    created.append(out_netcdf)
+    on_netcdf(out_netcdf)
+    if geo_writer:
+        created.extend(geo_writer.close())
+    return created
+
+def _insert_files(new_files, manifest, out_netcdf, geo_csv, source, timestamp, prefetch, cache, log, geo_shards):
+    '''
+    Convert JSON files missing from the full-day netCDF, insert their records and append their CSV rows.
+    The new rows alone are also written to their own CSV, so only they go to geostreams; its path is returned.
+    With geo_shards, the new rows are written to their own shards instead, which are added to the index of
+    the day; the path of their own index is returned.
+    '''
+    temp_out_single = os.path.join(os.path.dirname(out_netcdf), _TEMP_SINGLE)
+    new_geo_csv = geo_csv.replace("_geo.csv", "_geo_%s.csv" %
+                                  os.path.basename(new_files[0]).replace("_environmentlogger.json", ""))
+
+    geo_writer = _open_geo_output(new_geo_csv, geo_shards, os.path.dirname(out_netcdf))
+    with Dataset(out_netcdf, "a") as ncdf:
+        # Convert the new files the way the day was converted, so the variables match
+        packed = "flx_spc_dwn_cff" in ncdf.variables
+        # Days converted before summaries were written get none, rather than one of the late files only
+        summary = Summary.read(ncdf)
+        pyramid = Pyramid.read(ncdf)
+        pyramids = [pyramid] if pyramid is not None else []
+        known_times = np.unique(ncdf.variables["time"][:])
+        prefetcher = Prefetcher(new_files, prefetch)
+        for json_file, json_contents in prefetcher:
+            readings, entry = _read_new_readings(json_file, json_contents, cache, known_times, log)
+            manifest.append(entry)
+            if not entry["records"]:
+                ela.writeManifest(ncdf, manifest)
+                continue
+            log("converting %s to netCDF & inserting" % os.path.basename(json_file))
+            columns = ela.mainProgramTrigger(json_file, temp_out_single, packSpectrum=packed, readings=readings,
+                                             writeSummary=False,
+                                             pyramid=pyramid.bandWidths if pyramid is not None else None)
+            ela.insertRecords(ncdf, temp_out_single)
+            os.remove(temp_out_single)
+            known_times = np.union1d(known_times, columns["time"])
+            ela.writeManifest(ncdf, manifest)
+            if summary is not None:
+                summary = summary.merge(columns["summary"])
+                summary.write(ncdf)
+            if pyramid is not None:
+                pyramids.append(columns["pyramid"])
+            geo_writer.write(columns, source, timestamp)
+        if pyramids:
+            Pyramid.combine(pyramids).write(ncdf)
+        # Files are appended as blocks, which may belong anywhere among the records of the day
+        sorted_records = ela.sortRecords(ncdf)
+        if sorted_records:
+            log("sorted %s records of late files by time" % sorted_records)
+        log("inputs: %s" % prefetcher.summary())
+        if cache:
+            log("parsed columns: %s" % cache.summary())
+    geo_writer.close()
+
+    if geo_shards:
+        add_to_geo_index(geo_index_path(geo_csv), geo_index_path(new_geo_csv))
+        return geo_index_path(new_geo_csv)
+
+    with open(new_geo_csv, 'r') as new_rows, open(geo_csv, 'a') as geo_file:
+        new_rows.readline()
+        shutil.copyfileobj(new_rows, geo_file)
+    return new_geo_csv
@@ -0,0 +1,176 @@
+'''
+This is the unit test module for environmental_logger_daily.py.
+It writes small environmental logger JSON files, assembles days from them, and
+checks that JSON files added to a day later are inserted the way a conversion of
+the whole day would have placed them, and that readings repeated in overlapping
+files are converted once.
+
+A full-day conversion concatenates files with NCO, so ncrcat has to be on the path,
+or the tests are skipped.
+
+To run the unit test, simply use:
+python environmental_logger_daily_unittest.py
+'''
+
+import datetime
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from distutils.spawn import find_executable
+
+import numpy as np
+from netCDF4 import Dataset
+
+import environmental_logger_json2netcdf as ela
+from environmental_logger_daily import assemble_day, read_manifest
+
+WAVELENGTHS = [337.7 + band * 0.4755 for band in range(1024)]
+
+
+def writeJSON(path, start, count, seed, step=5):
+	'''
+	Write a JSON file of count readings, step seconds apart from start
+	'''
+	generator = random.Random(seed)
+	def reading(low, high, unit):
+		return {"unit": unit, "value": generator.uniform(low, high), "rawValue": 1.0}
+	readings = []
+	for number in range(count):
+		readings.append({
+			"timestamp": (start + datetime.timedelta(seconds=number * step)).strftime("%Y.%m.%d-%H:%M:%S"),
+			"weather_station": {
+				"airPressure": reading(1000, 1001, "hPa"),
+				"brightness": reading(0, 100, "kilo Lux"),
+				"relHumidity": reading(0, 100, "relHumPerCent"),
+				"temperature": reading(20, 30, "DegCelsius"),
+				"windDirection": reading(0, 360, "degrees"),
+				"precipitation": reading(0, 1, "mm/h"),
+				"sunDirection": reading(0, 90, "degrees"),
+				"windVelocity": reading(0, 5, "m/s")},
+			"spectrometer": {"maxFixedIntensity": 16383, "integration time in us": 5000, "wavelength": WAVELENGTHS,
+							 "spectrum": [generator.randint(1500, 16383) for band in WAVELENGTHS]},
+			"sensor par": reading(0, 2000, "umol/(m^2*s)"),
+			"sensor co2": reading(400, 410, "ppm")})
+	with open(path, 'w') as jsonFile:
+		json.dump({"environment_sensor_fixed_infos": {}, "environment_sensor_readings": readings}, jsonFile)
+	return path
+
+
+@unittest.skipIf(not find_executable("ncrcat"), "ncrcat (NCO) is not on the path")
+class environmental_logger_dailyUnitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		start = datetime.datetime(2017, 6, 1, 10, 0, 0)
+		# b falls between a and c, d before all of them; e repeats the times of the last 6 readings of a
+		self.files = dict((name, writeJSON(os.path.join(self.directory, "2017-06-01_%s_environmentlogger.json" % name),
+										   start + datetime.timedelta(seconds=offset), 12, seed))
+						  for name, offset, seed in (("a", 600, 1), ("b", 1200, 2), ("c", 1800, 3), ("d", 0, 4), ("e", 630, 5)))
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def assemble(self, day, names, **options):
+		out = os.path.join(self.directory, day)
+		if not os.path.isdir(out):
+			os.mkdir(out)
+		logs = []
+		result = assemble_day([self.files[name] for name in names], os.path.join(out, "day.nc"),
+							  os.path.join(out, "day_geo.csv"), "source", "2017-06-01", log=logs.append, **options)
+		result["logs"] = logs
+		return result
+
+	def readRecords(self, day):
+		with Dataset(os.path.join(self.directory, day, "day.nc")) as ncdf:
+			return dict((name, np.asarray(variable[:])) for name, variable in ncdf.variables.items()
+						if variable.dimensions and variable.dimensions[0] == "time")
+
+	def readRows(self, path):
+		with open(path) as csvFile:
+			return csvFile.readlines()[1:]
+
+	def test_canInsertLateFilesInTimeOrder(self):
+		'''
+		Files added to a day later, before or between its records, end up where a conversion of the whole day puts them
+		'''
+		self.assemble("late", ["a", "c"])
+		result = self.assemble("late", ["a", "c", "b", "d"])
+		self.assertEqual(result["converted"], 2)
+		self.assertEqual(sorted(entry["file"] for entry in read_manifest(os.path.join(self.directory, "late", "day.nc"))),
+						 sorted(os.path.basename(self.files[name]) for name in "abcd"))
+
+		self.assemble("whole", ["a", "b", "c", "d"])
+		late, whole = self.readRecords("late"), self.readRecords("whole")
+		self.assertTrue(np.all(np.diff(late["time"]) > 0))
+		self.assertEqual(sorted(late), sorted(whole))
+		for name in whole:
+			self.assertTrue(np.array_equal(late[name], whole[name]), name)
+
+	def test_canSendOnlyTheRowsOfLateFiles(self):
+		'''
+		The CSV of the day gets the rows of late files, and so does a CSV of their own, which is all that goes to geostreams
+		'''
+		self.assemble("late", ["a", "c"])
+		before = self.readRows(os.path.join(self.directory, "late", "day_geo.csv"))
+		result = self.assemble("late", ["a", "b", "c"])
+		new = self.readRows(result["new_geo_csv"])
+		self.assertEqual(sorted(self.readRows(os.path.join(self.directory, "late", "day_geo.csv"))), sorted(before + new))
+		self.assemble("whole", ["a", "b", "c"])
+		self.assertEqual(sorted(self.readRows(os.path.join(self.directory, "whole", "day_geo.csv"))), sorted(before + new))
+
+	def assertKeepsTheFirstReadings(self, day):
+		'''
+		The day holds the readings of a, then those of e at later times only, each time once
+		'''
+		records, first = self.readRecords(day), self.readRecords("a")
+		self.assertTrue(np.all(np.diff(records["time"]) > 0))
+		self.assertEqual(len(records["time"]), 18)
+		for name in first:
+			self.assertTrue(np.array_equal(records[name][:12], first[name]), name)
+		manifest = read_manifest(os.path.join(self.directory, day, "day.nc"))
+		self.assertEqual(sorted((entry["file"][11], entry["records"]) for entry in manifest), [("a", 12), ("e", 6)])
+
+	def test_canConvertRepeatedReadingsOnce(self):
+		'''
+		Readings at times an earlier file (by name) already has are left out of the day and its CSV
+		'''
+		self.assemble("a", ["a"])
+		result = self.assemble("overlap", ["e", "a"])
+		self.assertTrue("leaving out 6 of 12 readings of %s already converted" % os.path.basename(self.files["e"])
+						in result["logs"])
+		self.assertKeepsTheFirstReadings("overlap")
+		rows = self.readRows(os.path.join(self.directory, "overlap", "day_geo.csv"))
+		self.assertEqual(len(rows), len(set(rows)))
+		self.assertEqual(len(rows) * 12, len(self.readRows(os.path.join(self.directory, "a", "day_geo.csv"))) * 18)
+
+	def test_canLeaveOutRepeatedReadingsOfLateFiles(self):
+		'''
+		Late files are only inserted with their readings at times the day does not have yet,
+		and a late file holding none of those adds nothing
+		'''
+		self.assemble("a", ["a"])
+		self.assemble("late", ["a"])
+		result = self.assemble("late", ["a", "e"])
+		self.assertKeepsTheFirstReadings("late")
+		self.assertEqual(len(self.readRows(result["new_geo_csv"])) * 12,
+						 len(self.readRows(os.path.join(self.directory, "a", "day_geo.csv"))) * 6)
+
+		repeated = os.path.join(self.directory, "2017-06-01_f_environmentlogger.json")
+		shutil.copy(self.files["a"], repeated)
+		self.files["f"] = repeated
+		self.assemble("late", ["a", "e", "f"])
+		manifest = read_manifest(os.path.join(self.directory, "late", "day.nc"))
+		self.assertEqual([entry["records"] for entry in manifest if entry["file"] == os.path.basename(repeated)], [0])
+		self.assertEqual(len(self.readRecords("late")["time"]), 18)
+
+	def test_canLeaveADayWithoutNewFilesAlone(self):
+		self.assemble("day", ["a", "b"])
+		result = self.assemble("day", ["a", "b"])
+		self.assertEqual((result["converted"], result["new_geo_csv"], result["created"]), (0, None, []))
+
+
+if __name__ == "__main__":
+	unittest.main()
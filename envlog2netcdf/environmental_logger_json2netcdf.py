@@ -75,6 +75,11 @@ import os
 from datetime import date, datetime
 from netCDF4 import Dataset
 from environmental_logger_calculation import *
+from profiling import Profile, add_profiling_arguments
+from column_cache import ColumnCache
+from environmental_logger_chunkstore import CHUNK_STORE, ChunkWriter
+from environmental_logger_summary import Summary
+from environmental_logger_pyramid import Pyramid
 
 
 _UNIT_DICTIONARY = {u'm': {"original":"meter", "SI":"meter", "power":1}, 
@@ -128,10 +133,19 @@ _DESCRIPTIONS = {
 
 _UNIX_BASETIME = date(year=1970, month=1, day=1)
 
-def JSONHandler(fileLocation):
+# Global attribute of full-day files listing the JSON files they were built from
+_MANIFEST_ATTRIBUTE = "source_files"
+
+# Version of the readings returned by parseReadings, bump it when they change so cached readings are not reused
+PARSER_VERSION = 1
+
+def JSONHandler(fileLocation, fileContents=None):
     '''
     Main JSON handler, write JSON file to a Python list with standard JSON module
+    If the contents of the file were already read (e.g. prefetched), they are used instead
     '''
+    if fileContents is not None:
+        return json.loads(fileContents)
     with open(fileLocation, 'r') as fileHandler:
         return json.loads(fileHandler.read())
 
@@ -227,13 +241,96 @@ def translateTime(timeString):
     return (timeSplit.total_seconds() + timeUnpack.tm_hour * 3600.0 + timeUnpack.tm_min * 60.0 + timeUnpack.tm_sec) / (3600.0 * 24.0)
 
 
-def main(JSONArray, outputFileType, outputFileName, wavelength=None, spectrum=None, downwellingSpectralFlux=None, commandLine=None):
+def parseReadings(JSONArray):
+    '''
+    Parse the readings of a JSON file into columns, the expensive step of the conversion,
+    returned as (metadata, arrays) so they can be cached (see column_cache.py):
+    metadata holds the names and units of the weather station and sensor columns, in file order,
+    and arrays holds time, wvl_lgr, spectrum (as 16-bit counts when they fit), maxFixedIntensity
+    and the values and raw values of each weather station and sensor column
+    '''
+    loggerReadings = JSONArray["environment_sensor_readings"]
+    metadata = {"version": PARSER_VERSION,
+                "firstTimestamp": loggerReadings[0]["timestamp"],
+                "integrationTime": float(loggerReadings[0]["spectrometer"]["integration time in us"]),
+                "weatherStation": [],
+                "sensors": []}
+    arrays = {"time": np.array([translateTime(data["timestamp"]) for data in loggerReadings])}
+
+    for data in loggerReadings[0]["weather_station"]:
+        value, unit, rawValue = getListOfWeatherStationValue(loggerReadings, data)
+        metadata["weatherStation"].append([data, unit[0]])
+        arrays["value_" + data], arrays["raw_" + data] = value, np.array(rawValue)
+
+    wvl_lgr, spectrum, maxFixedIntensity = handleSpectrometer(loggerReadings)
+    spectrum = np.array(spectrum)
+    if spectrum.dtype.kind == 'i' and spectrum.min() >= 0 and spectrum.max() <= np.iinfo(np.uint16).max:
+        spectrum = spectrum.astype(np.uint16)
+    arrays["wvl_lgr"], arrays["spectrum"], arrays["maxFixedIntensity"] = np.array(wvl_lgr), spectrum, np.array(maxFixedIntensity)
+
+    for data in loggerReadings[0]:
+        if data.startswith("sensor"): # par sensor or co2 sensor
+            sensorValue, sensorUnit, sensorRaw = sensorVariables(loggerReadings, data)
+            metadata["sensors"].append([data, sensorUnit[0]])
+            arrays["value_" + data], arrays["raw_" + data] = sensorValue, np.array(sensorRaw)
+
+    return metadata, arrays
+
+
+def sensorColumn(variable, values):
+    '''
+    Return the attributes and values of a sensor variable written to the netCDF file,
+    so they can be exported without reading the file back
+    '''
+    return dict((name, variable.getncattr(name)) for name in variable.ncattrs()), np.asarray(values, dtype=variable.dtype)
+
+
+def openOutput(outputFileName, outputFileType, chunkName):
+    '''
+    Open what main writes to: a netCDF file, or with the CHUNKED output type the chunk
+    named chunkName of the chunk store at outputFileName (see environmental_logger_chunkstore.py)
+    '''
+    if outputFileType == CHUNK_STORE:
+        return ChunkWriter(outputFileName, chunkName)
+    return Dataset(outputFileName, 'w', format=outputFileType)
+
+
+def main(JSONArray, outputFileType, outputFileName, wavelength=None, spectrum=None, downwellingSpectralFlux=None, commandLine=None, packSpectrum=False, calibrationName=None, readings=None, chunkName=None, writeSummary=True, pyramid=None):
     '''
     Main netCDF handler, write data to the netCDF file indicated.
+
+    The readings are parsed from JSONArray, unless they were already parsed (see parseReadings)
+    and are given as readings instead.
+
+    With the CHUNKED output type, outputFileName is a chunk store and the variables are written
+    to its chunk chunkName (by default named after the time of the first reading).
+
+    With packSpectrum, the raw spectrum is stored as unsigned 16-bit counts and the downwelling
+    spectral flux is not stored; its per-band coefficients and dark reference are stored instead
+    (see readDownwellingSpectralFlux).
+
+    The spectrometer calibration is the one named calibrationName, or else the one in effect
+    on the date of the first reading.
+
+    Hourly and daily statistics of the sensor variables and of the downwelling flux of each reading
+    are written to the summary group of NETCDF4 outputs (see environmental_logger_summary.py),
+    and with pyramid (a list of band widths, possibly empty), time means of the spectrum and of
+    the downwelling spectral flux to the pyramid group (see environmental_logger_pyramid.py),
+    unless writeSummary is False (e.g. for files that are concatenated into a full-day file later).
+
+    Returns the in-memory columns of the sensor variables (everything but the spectrometer),
+    as {"time": <days since 1970-01-01>, "sensors": [(<variable attributes>, <values>), ...],
+        "summary": <their Summary>, "pyramid": <the Pyramid of the spectrum, or None>}
     '''
-    with Dataset(outputFileName, 'w', format=outputFileType) as netCDFHandler:
-        loggerFixedInfos = JSONArray["environment_sensor_fixed_infos"]
-        loggerReadings   = JSONArray["environment_sensor_readings"]
+    sensorColumns = []
+    summaryColumns = []
+    metadata, arrays = readings or parseReadings(JSONArray)
+    chunkName = chunkName or metadata["firstTimestamp"].replace(".", "-").replace(":", "-")
+    with openOutput(outputFileName, outputFileType, chunkName) as netCDFHandler:
+        if calibrationName:
+            calibration = getCalibration(calibrationName)
+        else:
+            calibration = selectCalibration(datetime.strptime(metadata["firstTimestamp"], "%Y.%m.%d-%H:%M:%S"))
 
         # for infos, atttributes in loggerFixedInfos.items():
         #     # infosGroup = netCDFHandler.createGroup(infos)
@@ -293,14 +390,14 @@ def main(JSONArray, outputFileType, outputFileName, wavelength=None, spectrum=No
             setattr(sensor_par_var, "sensor_par_"+key, value)
 
 
-        for data in loggerReadings[0]["weather_station"]: #writing the data from weather station
-            value, unit, rawValue           = getListOfWeatherStationValue(loggerReadings, data)
+        for data, unit in metadata["weatherStation"]: #writing the data from weather station
+            value, rawValue                 = arrays["value_" + data], arrays["raw_" + data]
             valueVariable, rawValueVariable = netCDFHandler.createVariable(data, "f4", ("time", )),\
                                               netCDFHandler.createVariable("".join(("raw_",data)), "f4", ("time", ))
                 
             valueVariable[:]    = value
             rawValueVariable[:] = rawValue
-            setattr(valueVariable, "units", unit[0])
+            setattr(valueVariable, "units", unit)
 
             setattr(valueVariable, "sensor", 'sensor_weather_station')
             if data in _CF_STANDARDS:
@@ -309,14 +406,19 @@ def main(JSONArray, outputFileType, outputFileName, wavelength=None, spectrum=No
                 setattr(valueVariable, "long_name", _NAMES[data])
             if data in _DESCRIPTIONS:
                 setattr(valueVariable, "description", _DESCRIPTIONS[data])
+            sensorColumns.append(sensorColumn(valueVariable, value))
+            summaryColumns.append((data, unit, value))
 
-        wvl_lgr, spectrum, maxFixedIntensity = handleSpectrometer(loggerReadings) #writing the data from spectrometer
+        #writing the data from spectrometer (counts are widened so subtracting the dark reference cannot wrap around)
+        wvl_lgr, spectrum, maxFixedIntensity = arrays["wvl_lgr"], arrays["spectrum"], arrays["maxFixedIntensity"]
+        if spectrum.dtype.kind == 'u':
+            spectrum = spectrum.astype(np.int64)
 
         netCDFHandler.createDimension("wvl_lgr", len(wvl_lgr))
         wavelengthVariable = netCDFHandler.createVariable("wvl_lgr", "f4", ("wvl_lgr",))
 
         setattr(wavelengthVariable, "sensor", 'sensor_spectrum')
-        spectrumVariable   = netCDFHandler.createVariable("spectrum", "f4", ("time", "wvl_lgr"))
+        spectrumVariable   = netCDFHandler.createVariable("spectrum", "u2" if packSpectrum else "f4", ("time", "wvl_lgr"))
         setattr(spectrumVariable, "sensor", 'sensor_spectrum')
         intensityVariable  = netCDFHandler.createVariable("maxFixedIntensity", "f4", ("time",))
         setattr(intensityVariable, "sensor", 'sensor_spectrum')
@@ -329,6 +431,9 @@ def main(JSONArray, outputFileType, outputFileName, wavelength=None, spectrum=No
         setattr(wavelengthVariable, "long_name", "Wavelengths")
         setattr(wavelengthVariable, "standard_name", "radiation_wavelength")
         setattr(wavelengthVariable, "notes", "these wavelengths are all the same in different collections from the environmental logger. Ranging from 337.7 to 824 nm.")
+        if packSpectrum:
+            if spectrum.min() < 0 or spectrum.max() > np.iinfo(np.uint16).max:
+                raise ValueError("Spectrum counts out of range for packed storage")
         spectrumVariable[:,:] = spectrum
         setattr(spectrumVariable, "units", "meter")
         setattr(spectrumVariable, "long_name", "Spectrum from Hyperspectral Camera Spectrometer")
@@ -339,33 +444,34 @@ def main(JSONArray, outputFileType, outputFileName, wavelength=None, spectrum=No
         setattr(intensityVariable, "notes", "maximum_fix_intensity (always equals to 2^14-1=16383)")
 
         timeVariable = netCDFHandler.createVariable("time", 'f8', ('time',))
-        timeVariable[:] = [translateTime(data["timestamp"]) for data in loggerReadings]
+        times = np.array(arrays["time"])
+        timeVariable[:] = times
         setattr(timeVariable, "units",    "days since 1970-01-01 00:00:00")
         setattr(timeVariable, "long_name", "Time")
         setattr(timeVariable, "calender", "gregorian")
 
-        for data in loggerReadings[0]:
-            if data.startswith("sensor"): # par sensor or co2 sensor
-
-                sensorValue, sensorUnit, sensorRaw = sensorVariables(loggerReadings, data)
-                sensorValueVariable                = netCDFHandler.createVariable(renameTheValue(data),                    "f4", ("time", ))
-                sensorRawValueVariable             = netCDFHandler.createVariable("".join(("raw_", renameTheValue(data))), "f4", ("time", ))
-
-                sensorValueVariable[:]    = sensorValue
-                sensorRawValueVariable[:] = sensorRaw
-                setattr(sensorValueVariable, "units", sensorUnit[0])
-                if data.endswith("co2"):
-                    setattr(sensorValueVariable, "sensor", 'sensor_co2')
-                else:
-                    setattr(sensorValueVariable, "sensor", 'sensor_par')
-
-                if renameTheValue(data) in _CF_STANDARDS:
-                    setattr(sensorValueVariable, "standard_name", _CF_STANDARDS[renameTheValue(data)])
-                
-                if renameTheValue(data) == 'Photosynthetically_Active_Radiation':
-                    setattr(sensorValueVariable, "long_name", "Photosynthetically Active Radiation")
-                else:
-                    setattr(sensorValueVariable, "long_name", "Atmosperic CO2 Concentration")
+        for data, sensorUnit in metadata["sensors"]: # par sensor or co2 sensor
+            sensorValue, sensorRaw = arrays["value_" + data], arrays["raw_" + data]
+            sensorValueVariable    = netCDFHandler.createVariable(renameTheValue(data),                    "f4", ("time", ))
+            sensorRawValueVariable = netCDFHandler.createVariable("".join(("raw_", renameTheValue(data))), "f4", ("time", ))
+
+            sensorValueVariable[:]    = sensorValue
+            sensorRawValueVariable[:] = sensorRaw
+            setattr(sensorValueVariable, "units", sensorUnit)
+            if data.endswith("co2"):
+                setattr(sensorValueVariable, "sensor", 'sensor_co2')
+            else:
+                setattr(sensorValueVariable, "sensor", 'sensor_par')
+
+            if renameTheValue(data) in _CF_STANDARDS:
+                setattr(sensorValueVariable, "standard_name", _CF_STANDARDS[renameTheValue(data)])
+            
+            if renameTheValue(data) == 'Photosynthetically_Active_Radiation':
+                setattr(sensorValueVariable, "long_name", "Photosynthetically Active Radiation")
+            else:
+                setattr(sensorValueVariable, "long_name", "Atmosperic CO2 Concentration")
+            sensorColumns.append(sensorColumn(sensorValueVariable, sensorValue))
+            summaryColumns.append((renameTheValue(data), sensorUnit, sensorValue))
 
         wvl_ntf  = [np.average([wvl_lgr[i], wvl_lgr[i+1]]) for i in range(len(wvl_lgr)-1)]
         delta    = [wvl_ntf[i+1] - wvl_ntf[i] for i in range(len(wvl_ntf) - 1)]
@@ -374,7 +480,10 @@ def main(JSONArray, outputFileType, outputFileName, wavelength=None, spectrum=No
 
         # Downwelling Flux = summation of (delta lambda(_wvl_dlt) * downwellingSpectralFlux)
         # Details in CalculationWorks.py
-        downwellingSpectralFlux, downwellingFlux = calculateDownwellingSpectralFlux(wvl_lgr, spectrum, delta)
+        if packSpectrum:
+            downwellingFlux = calculateDownwellingFlux(spectrum, delta, calibration)
+        else:
+            downwellingSpectralFlux, downwellingFlux = calculateDownwellingSpectralFlux(wvl_lgr, spectrum, delta, calibration)
 
         # Add data from hyperspectral_calibration.nco
         netCDFHandler.createVariable("wvl_dlt", 'f8', ("wvl_lgr",))[:] = delta
@@ -382,15 +491,28 @@ def main(JSONArray, outputFileType, outputFileName, wavelength=None, spectrum=No
         setattr(netCDFHandler.variables['wvl_dlt'], 'notes',"Bandwidth, also called dispersion, is between 0.455-0.495 nm across all channels. Values computed as differences between midpoints of adjacent band-centers.")
         setattr(netCDFHandler.variables['wvl_dlt'], 'long_name', "Bandwidth of environmental sensor")
 
-        netCDFHandler.createVariable("flx_sns", "f4", ("wvl_lgr",))[:] = np.array(FLX_SNS) * 1e-6
+        netCDFHandler.createVariable("flx_sns", "f4", ("wvl_lgr",))[:] = calibration.flx_sns * 1e-6
         setattr(netCDFHandler.variables['flx_sns'],'units', 'watt meter-2 count-1')
         setattr(netCDFHandler.variables['flx_sns'],'long_name','Flux sensitivity of each band (irradiance per count)')
-        setattr(netCDFHandler.variables['flx_sns'], 'provenance', "EnvironmentalLogger calibration information from file S05673_08062015.IrradCal provided by TinoDornbusch and discussed here: https://github.com/terraref/reference-data/issues/30#issuecomment-217518434")
-
-        netCDFHandler.createVariable("flx_spc_dwn", 'f4', ('time','wvl_lgr'))[:,:] = downwellingSpectralFlux
-        setattr(netCDFHandler.variables['flx_spc_dwn'],'units', 'watt meter-2 meter-1')
-        setattr(netCDFHandler.variables['flx_spc_dwn'], 'long_name', 'Downwelling Spectral Irradiance')
-        setattr(netCDFHandler.variables['flx_spc_dwn'], 'standard_name', 'downwelling_spectral_spherical_irradiance_in_air')
+        setattr(netCDFHandler.variables['flx_sns'], 'provenance', calibration.provenance or calibration.name)
+
+        if packSpectrum:
+            # flx_spc_dwn = (spectrum - drk_rfr) * flx_spc_dwn_cff, rebuilt by readers when needed
+            netCDFHandler.createVariable("drk_rfr", "u2", ("wvl_lgr",))[:] = calibration.dark_measurements
+            setattr(netCDFHandler.variables['drk_rfr'], 'units', 'count')
+            setattr(netCDFHandler.variables['drk_rfr'], 'long_name', 'Dark reference of each band')
+
+            netCDFHandler.createVariable("flx_spc_dwn_cff", "f8", ("wvl_lgr",))[:] = calculateDownwellingSpectralFluxCoefficients(delta, calibration)
+            setattr(netCDFHandler.variables['flx_spc_dwn_cff'], 'units', 'watt meter-2 meter-1 count-1')
+            setattr(netCDFHandler.variables['flx_spc_dwn_cff'], 'long_name', 'Downwelling Spectral Irradiance per count above the dark reference')
+            setattr(netCDFHandler.variables['flx_spc_dwn_cff'], 'notes', "flx_sns / (wvl_dlt * area_sensor * integration time of 5000 us). "
+                    "Downwelling Spectral Irradiance (downwelling_spectral_spherical_irradiance_in_air, watt meter-2 meter-1) "
+                    "is (spectrum - drk_rfr) * flx_spc_dwn_cff")
+        else:
+            netCDFHandler.createVariable("flx_spc_dwn", 'f4', ('time','wvl_lgr'))[:,:] = downwellingSpectralFlux
+            setattr(netCDFHandler.variables['flx_spc_dwn'],'units', 'watt meter-2 meter-1')
+            setattr(netCDFHandler.variables['flx_spc_dwn'], 'long_name', 'Downwelling Spectral Irradiance')
+            setattr(netCDFHandler.variables['flx_spc_dwn'], 'standard_name', 'downwelling_spectral_spherical_irradiance_in_air')
 
         # Downwelling Flux = summation of (delta lambda(_wvl_dlt) * downwellingSpectralFlux)
         netCDFHandler.createVariable("flx_dwn", 'f4')[...] = downwellingFlux
@@ -400,7 +522,7 @@ def main(JSONArray, outputFileType, outputFileName, wavelength=None, spectrum=No
 
         # #Other Constants used in calculation
         # #Integration Time
-        netCDFHandler.createVariable("time_integration", 'f4')[...] = float(loggerReadings[0]["spectrometer"]["integration time in us"]) / 1.0e-6
+        netCDFHandler.createVariable("time_integration", 'f4')[...] = metadata["integrationTime"] / 1.0e-6
         setattr(netCDFHandler.variables["time_integration"], "units", "second")
         setattr(netCDFHandler.variables['time_integration'], 'long_name', 'Spectrometer Integration Time')
 
@@ -411,37 +533,195 @@ def main(JSONArray, outputFileType, outputFileName, wavelength=None, spectrum=No
 
         netCDFHandler.history = " ".join((time.strftime("%a %b %d %H:%M:%S %Y",  time.localtime(int(time.time()))), ': python', commandLine))
 
+        # Hourly and daily statistics, from the columns already in memory
+        summary = Summary.fromColumns(times, summaryColumns, calculateDownwellingFluxByReading(spectrum, delta, calibration))
+        if writeSummary:
+            summary.write(netCDFHandler)
+
+        # Time means of the spectrum at coarser resolutions
+        spectrumPyramid = None
+        if pyramid is not None:
+            spectrumPyramid = Pyramid.fromReadings(times, spectrum, calibration.dark_measurements,
+                                                   calculateDownwellingSpectralFluxCoefficients(delta, calibration), pyramid)
+            if writeSummary:
+                spectrumPyramid.write(netCDFHandler)
+
+    return {"time": times, "sensors": sensorColumns, "summary": summary, "pyramid": spectrumPyramid}
+
+
+def readDownwellingSpectralFlux(netCDFHandler, timeSlice=slice(None), bandSlice=slice(None)):
+    '''
+    Return the downwelling spectral flux for the given times and bands from an open netCDF file,
+    rebuilding it from the raw spectrum for files written with packSpectrum
+    '''
+    if "flx_spc_dwn" in netCDFHandler.variables:
+        return netCDFHandler.variables["flx_spc_dwn"][timeSlice, bandSlice]
+
+    spectrum     = netCDFHandler.variables["spectrum"][timeSlice, bandSlice].astype(np.float64)
+    darkRef      = netCDFHandler.variables["drk_rfr"][bandSlice]
+    coefficients = netCDFHandler.variables["flx_spc_dwn_cff"][bandSlice]
+    return ((spectrum - darkRef) * coefficients).astype(np.float32)
+
 
-def mainProgramTrigger(fileInputLocation, fileOutputLocation, fileType="NETCDF4"):
+def readManifest(netCDFHandler):
+    '''
+    Return the source files manifest of a full-day netCDF file, as a list of
+    {"file": <JSON file name>, "start": <first time>, "end": <last time>, "records": <count>}
+    (times in days since 1970-01-01), or None for files written without one
+    '''
+    if _MANIFEST_ATTRIBUTE not in netCDFHandler.ncattrs():
+        return None
+    return json.loads(netCDFHandler.getncattr(_MANIFEST_ATTRIBUTE))
+
+
+def writeManifest(netCDFHandler, manifest):
+    '''
+    Store the source files manifest in a full-day netCDF file, sorted by time
+    '''
+    netCDFHandler.setncattr(_MANIFEST_ATTRIBUTE, json.dumps(sorted(manifest, key=lambda entry: entry["start"])))
+
+
+def manifestEntry(fileName, times, records=None):
+    '''
+    Return the manifest entry for the records converted from one JSON file, whose readings span times
+    (records is their number, unless repeated readings were left out)
+    '''
+    return {"file": os.path.basename(fileName), "start": float(np.min(times)), "end": float(np.max(times)),
+            "records": len(times) if records is None else records}
+
+
+def insertRecords(netCDFHandler, singleFileName):
+    '''
+    Append the records of a single-file netCDF file to a full-day netCDF file opened for appending.
+    Records already in the file are not moved, so when late records belong before them, the time
+    dimension has to be ordered with one sortRecords pass once every file is in.
+
+    Returns the index of the first appended record.
+    '''
+    position = len(netCDFHandler.dimensions["time"])
+    with Dataset(singleFileName, "r") as singleHandler:
+        count = len(singleHandler.dimensions["time"])
+        for name, variable in netCDFHandler.variables.items():
+            if not variable.dimensions or variable.dimensions[0] != "time":
+                continue
+            if name not in singleHandler.variables:
+                raise ValueError("%s has no variable %s to insert (was it converted with the same options?)" % (singleFileName, name))
+            variable[position:position + count] = singleHandler.variables[name][:]
+
+    return position
+
+
+def sortRecords(netCDFHandler):
+    '''
+    Sort the records of a full-day netCDF file opened for appending by time, as one gather over every
+    variable along the time dimension. The sort is stable, and only the span of records out of order
+    (e.g. where JSON files overlap, or behind late appended records) is read and rewritten.
+
+    Returns the number of records in that span (0 if they were already sorted).
+    '''
+    times = netCDFHandler.variables["time"][:]
+    order = np.argsort(times, kind="mergesort")
+    moved = np.flatnonzero(order != np.arange(len(order)))
+    if not len(moved):
+        return 0
+
+    # The records before and after the span stay where they are
+    first, last = moved[0], moved[-1] + 1
+    gather = order[first:last] - first
+    for name, variable in netCDFHandler.variables.items():
+        if variable.dimensions and variable.dimensions[0] == "time":
+            variable[first:last] = variable[first:last][gather]
+    return last - first
+
+
+def readReadings(fileLocation, fileContents=None, cache=None):
+    '''
+    Return the parsed readings of a JSON file (see parseReadings), from the column cache if it has them,
+    else parsing the file and adding them to the cache
+    '''
+    if cache is None:
+        return parseReadings(JSONHandler(fileLocation, fileContents))
+
+    if fileContents is None:
+        with open(fileLocation, 'rb') as fileHandler:
+            fileContents = fileHandler.read()
+    key = cache.key(fileContents, PARSER_VERSION)
+    readings = cache.get(key)
+    if readings is None:
+        readings = parseReadings(JSONHandler(fileLocation, fileContents))
+        cache.put(key, *readings)
+    return readings
+
+
+def dropRepeatedReadings(readings, knownTimes=()):
+    '''
+    Leave out of parsed readings (see parseReadings) those at a time already in knownTimes (e.g. the times
+    converted from earlier files of the day) or repeated in the readings, keeping the first reading at each time.
+
+    Returns the remaining readings, in their order, and the number left out.
+    '''
+    metadata, arrays = readings
+    times, first = np.unique(arrays["time"], return_index=True)
+    keep = np.sort(first[~np.in1d(times, knownTimes)])
+    if len(keep) == len(arrays["time"]):
+        return readings, 0
+    # wvl_lgr is the only column that is not along time
+    kept = dict((name, values if name == "wvl_lgr" else np.asarray(values)[keep]) for name, values in arrays.items())
+    return (metadata, kept), len(arrays["time"]) - len(keep)
+
+
+def mainProgramTrigger(fileInputLocation, fileOutputLocation, fileType="NETCDF4", packSpectrum=False, calibrationName=None, fileContents=None, cache=None, writeSummary=True, pyramid=None, readings=None):
     '''
     This function will trigger the whole script
+    When a single file is converted, the sensor columns returned by main are returned
+    and fileContents can hold the already read contents of that file, or readings its already parsed readings
+    Parsed readings are reused from, and added to, the column cache if one is given
+    writeSummary and pyramid are passed on to main
     '''
+    columns = None
     print fileType
     startPoint = time.clock()
+    if fileType == CHUNK_STORE:
+        # Every JSON file becomes a chunk of the store at fileOutputLocation
+        if os.path.isdir(fileInputLocation):
+            inputFiles = sorted(os.path.join(filePath, members) for filePath, fileDirectory, fileName in os.walk(fileInputLocation)
+                                for members in fileName if members.endswith('.json'))
+        else:
+            inputFiles = [fileInputLocation]
+        for inputFile in inputFiles:
+            print "\nProcessing", "".join((inputFile, '....')),"\n", "-" * (len(inputFile) + 15)
+            readings = readReadings(inputFile, fileContents if inputFile == fileInputLocation else None, cache)
+            columns = main(None, fileType, fileOutputLocation, commandLine=" ".join(sys.argv), packSpectrum=packSpectrum, calibrationName=calibrationName, readings=readings, chunkName=os.path.basename(inputFile), writeSummary=writeSummary, pyramid=pyramid)
+        print "Exported to", fileOutputLocation, "\n", "-" * (len(fileOutputLocation) + 15)
+        print "Done. Execution time: {:.3f} seconds\n".format(time.clock()-startPoint)
+        return columns if len(inputFiles) == 1 else None
+
     if not os.path.exists(fileOutputLocation) and not fileOutputLocation.endswith('.nc'):
         os.mkdir(fileOutputLocation)  # Create folder
 
     if not os.path.isdir(fileInputLocation) or fileOutputLocation.endswith('.nc'):
         print "\nProcessing", "".join((fileInputLocation, '....')),"\n", "-" * (len(fileInputLocation) + 15)
-        tempJSONMasterList = JSONHandler(fileInputLocation)
+        if readings is None:
+            readings = readReadings(fileInputLocation, fileContents, cache)
         if not os.path.isdir(fileOutputLocation):
-            main(tempJSONMasterList, fileType, fileOutputLocation, commandLine=" ".join(sys.argv))
+            columns = main(None, fileType, fileOutputLocation, commandLine=" ".join(sys.argv), packSpectrum=packSpectrum, calibrationName=calibrationName, readings=readings, writeSummary=writeSummary, pyramid=pyramid)
         else:
             outputFileName = os.path.split(fileInputLocation)[-1]
             print "Exported to", fileOutputLocation, "\n", "-" * (len(fileInputLocation) + 15)
-            main(tempJSONMasterList, fileType, os.path.join(fileOutputLocation,  "".join((outputFileName.strip('.json'), '.nc'))),commandLine=" ".join(sys.argv))
+            columns = main(None, fileType, os.path.join(fileOutputLocation,  "".join((outputFileName.strip('.json'), '.nc'))),commandLine=" ".join(sys.argv), packSpectrum=packSpectrum, calibrationName=calibrationName, readings=readings, writeSummary=writeSummary, pyramid=pyramid)
     else:    
         for filePath, fileDirectory, fileName in os.walk(fileInputLocation):
             for members in fileName:
                 if os.path.join(filePath, members).endswith('.json'):
                     print "\nProcessing", "".join((members, '....')),"\n","-" * (len(members) + 15)
                     outputFileName = "".join((members.strip('.json'), '.nc'))
-                    tempJSONMasterList = JSONHandler(os.path.join(filePath, members))
+                    readings = readReadings(os.path.join(filePath, members), cache=cache)
                     print "Exported to", str(os.path.join(fileOutputLocation, outputFileName)), "\n", "-" * (len(fileInputLocation) + 15)
-                    main(tempJSONMasterList, fileType, os.path.join(fileOutputLocation, outputFileName), commandLine=" ".join(sys.argv))
+                    main(None, fileType, os.path.join(fileOutputLocation, outputFileName), commandLine=" ".join(sys.argv), packSpectrum=packSpectrum, calibrationName=calibrationName, readings=readings, writeSummary=writeSummary, pyramid=pyramid)
     
     endPoint = time.clock()
     print "Done. Execution time: {:.3f} seconds\n".format(endPoint-startPoint)
+    return columns
 
 if __name__ == '__main__':
 
@@ -449,9 +729,28 @@ if __name__ == '__main__':
     parser.add_argument('input_file_path', type=str, nargs=1,
                              help='The path to the raw environmental logger records (JSON format)')
     parser.add_argument('netCDF_format', type=str, nargs='?', default="NETCDF4",
-                             help='The format of the output netCDF file (can be NETCDF3_64BIT_DATA or NETCDF4)')
+                             help='The format of the output netCDF file (can be NETCDF3_64BIT_DATA or NETCDF4), or CHUNKED to write to a chunk store directory')
     parser.add_argument('output_file_path', type=str, nargs=1, default=".",
                              help='The path to the environmental logger final outputs you want (netCDF format, Level 1 Data)')
+    parser.add_argument('--packed', action='store_true',
+                             help='Store the raw spectrum as 16-bit counts and the downwelling spectral flux as per-band coefficients')
+    parser.add_argument('--calibration', type=str, default=None,
+                             help='The name of the spectrometer calibration to use (by default, the one in effect on the date of the readings)')
+    parser.add_argument('--cache', type=str, default=None,
+                             help='A directory to cache the parsed JSON columns in, so converting the same files again skips parsing')
+    parser.add_argument('--cachesize', type=float, default=10,
+                             help='The maximum size of the cache in GB')
+    parser.add_argument('--pyramid', type=float, nargs='*', default=None, metavar='WIDTH',
+                             help='Also store time means of the spectrum and flux over 1 min, 10 min and 1 h, and over bands of each WIDTH nm if given')
+    add_profiling_arguments(parser)
     args = parser.parse_args()
-
-    mainProgramTrigger(args.input_file_path[0], args.output_file_path[0], args.netCDF_format)
+    cache = ColumnCache(args.cache, int(args.cachesize * 1024**3)) if args.cache else None
+
+    if args.profile_dir:
+        profileName = "%s_%s" % (os.path.basename(args.input_file_path[0].rstrip(os.sep)), time.strftime("%Y%m%d-%H%M%S"))
+        with Profile(profileName, args.profile_dir, args.profile_top) as profile:
+            mainProgramTrigger(args.input_file_path[0], args.output_file_path[0], args.netCDF_format, args.packed, args.calibration, cache=cache, pyramid=args.pyramid)
+        print "Profile written to", profile.pstats_path, "and", profile.collapsed_path
+        print profile.summary
+    else:
+        mainProgramTrigger(args.input_file_path[0], args.output_file_path[0], args.netCDF_format, args.packed, args.calibration, cache=cache, pyramid=args.pyramid)
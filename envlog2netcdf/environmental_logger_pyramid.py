@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+'''
+environmental_logger_pyramid.py
+
+----------------------------------------------------------------------------------------
+Time means of the spectrum and of the downwelling spectral flux at coarser resolutions
+(a pyramid), stored in a "pyramid" group of the netCDF outputs, so plots and QA tools
+read the level they need instead of the full matrices.
+----------------------------------------------------------------------------------------
+
+Layout (NETCDF4 outputs only, groups do not exist in the other formats):
+
+  pyramid/<level>/time                 -> start of each period with readings (days since 1970-01-01)
+  pyramid/<level>/count                -> number of readings in each period
+  pyramid/<level>/spectrum             -> mean spectrum of each period, (time, wvl_lgr)
+  pyramid/<level>/flx_spc_dwn          -> mean downwelling spectral flux of each period, (time, wvl_lgr)
+  pyramid/<level>/wvl_<width>nm        -> with band widths, the centers of bands of that width,
+  pyramid/<level>/spectrum_<width>nm      and the means over them, weighted by the bandwidth of
+  pyramid/<level>/flx_spc_dwn_<width>nm   each wavelength (wvl_dlt), (time, wvl_<width>nm)
+
+for the levels 1min, 10min and 1h. The sums of each level are block reductions of the
+level below, starting from the readings of each JSON file; the sums of a day's files are
+combined, so the full-day file is never read back. The flux of each reading is linear in
+its counts, so its sums come from the spectrum sums and the calibration of each file.
+----------------------------------------------------------------------------------------
+'''
+
+import collections
+
+import numpy as np
+
+
+PYRAMID_GROUP = "pyramid"
+
+# (name, seconds), finest first
+LEVELS = (("1min", 60), ("10min", 600), ("1h", 3600))
+
+_TIME_ATTRIBUTES = {"units": "days since 1970-01-01 00:00:00", "calendar": "gregorian"}
+
+
+def _reduceByPeriod(periods, counts, sums):
+    '''
+    Add up the counts and sums (rows by period) of equal periods. Returns (periods, counts, sums), sorted by period
+    '''
+    unique, bins = np.unique(periods, return_inverse=True)
+    order = np.argsort(bins, kind="mergesort")
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(bins[order]) != 0)))
+    return unique, np.add.reduceat(counts[order], starts), \
+        dict((name, np.add.reduceat(values[order], starts, axis=0)) for name, values in sums.items())
+
+
+def _bandBins(wavelengths, bandwidths, width):
+    '''
+    Return (first wavelength index of each band of the given width, bandwidth-weighted band centers)
+    '''
+    bands = np.floor(np.asarray(wavelengths, dtype=np.float64) / width).astype(np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(bands) != 0)))
+    weights = np.add.reduceat(bandwidths, starts)
+    return starts, np.add.reduceat(wavelengths * bandwidths, starts) / weights
+
+
+class Pyramid(object):
+    '''
+    The number of readings and the sums of their spectrum and downwelling spectral flux,
+    by period of each level
+    '''
+
+    def __init__(self, levels=None, bandWidths=()):
+        # level name -> {"periods": periods since 1970-01-01, sorted, "count": readings by period,
+        #                "spectrum": sums (period, band), "flx_spc_dwn": sums (period, band)}
+        self.levels = levels if levels is not None else collections.OrderedDict()
+        # Widths of the bands to also write means over (in the units of wvl_lgr)
+        self.bandWidths = tuple(bandWidths)
+
+    @classmethod
+    def fromReadings(cls, times, spectrum, darkReference, coefficients, bandWidths=()):
+        '''
+        Build the pyramid of readings: times in days since 1970-01-01, spectrum in counts (time, band),
+        and the dark reference and flux coefficients of the calibration they were converted with
+        '''
+        periods = np.floor(np.asarray(times, dtype=np.float64) * 86400.0 / LEVELS[0][1]).astype(np.int64)
+        counts = np.ones(len(periods), dtype=np.int64)
+        sums = {"spectrum": np.asarray(spectrum, dtype=np.float64)}
+        pyramid = cls(bandWidths=bandWidths)
+        previous = LEVELS[0][1]
+        for name, seconds in LEVELS:
+            # Each level is a block reduction of the one below
+            periods, counts, sums = _reduceByPeriod(periods * previous // seconds, counts, sums)
+            previous = seconds
+            pyramid.levels[name] = {"periods": periods, "count": counts, "spectrum": sums["spectrum"],
+                                    "flx_spc_dwn": (sums["spectrum"] - counts[:, np.newaxis] * darkReference) * coefficients}
+        return pyramid
+
+    @classmethod
+    def combine(cls, pyramids):
+        '''
+        Return the pyramid of the readings of all the pyramids, with the band widths of the first
+        '''
+        combined = cls(bandWidths=pyramids[0].bandWidths if pyramids else ())
+        for name, seconds in LEVELS:
+            levels = [pyramid.levels[name] for pyramid in pyramids if name in pyramid.levels]
+            if not levels:
+                continue
+            periods, counts, sums = _reduceByPeriod(
+                np.concatenate([level["periods"] for level in levels]), np.concatenate([level["count"] for level in levels]),
+                dict((statistic, np.concatenate([level[statistic] for level in levels])) for statistic in ("spectrum", "flx_spc_dwn")))
+            combined.levels[name] = dict(sums, periods=periods, count=counts)
+        return combined
+
+    @classmethod
+    def read(cls, netCDFHandler):
+        '''
+        Read the pyramid back from an open netCDF file, or return None if it has none
+        '''
+        if PYRAMID_GROUP not in getattr(netCDFHandler, "groups", {}):
+            return None
+        pyramid = cls(bandWidths=sorted(float(dimension[len("wvl_"):-len("nm")]) for dimension in
+                                        netCDFHandler.groups[PYRAMID_GROUP].groups[LEVELS[0][0]].dimensions
+                                        if dimension.startswith("wvl_") and dimension.endswith("nm")))
+        for name, seconds in LEVELS:
+            group = netCDFHandler.groups[PYRAMID_GROUP].groups[name]
+            counts = np.ma.filled(group.variables["count"][:], 0).astype(np.int64)
+            pyramid.levels[name] = {"periods": np.round(group.variables["time"][:] * 86400.0 / seconds).astype(np.int64),
+                                    "count": counts}
+            for statistic in ("spectrum", "flx_spc_dwn"):
+                pyramid.levels[name][statistic] = np.ma.filled(group.variables[statistic][:], 0.0).astype(np.float64) * counts[:, np.newaxis]
+        return pyramid
+
+    def write(self, netCDFHandler):
+        '''
+        Write (or rewrite) the pyramid group of an open netCDF file. Returns whether the file
+        can hold one (NETCDF4 files only)
+        '''
+        if getattr(netCDFHandler, "data_model", None) != "NETCDF4":
+            return False
+        wavelengths = np.asarray(netCDFHandler.variables["wvl_lgr"][:], dtype=np.float64)
+        bandwidths = np.asarray(netCDFHandler.variables["wvl_dlt"][:], dtype=np.float64)
+        bands = [(width, _bandBins(wavelengths, bandwidths, width)) for width in self.bandWidths]
+        spectrumUnits = getattr(netCDFHandler.variables["spectrum"], "units", "count")
+
+        pyramidGroup = netCDFHandler.createGroup(PYRAMID_GROUP)
+        pyramidGroup.description = "Time means of spectrum and flx_spc_dwn over each period of each level"
+        for name, seconds in LEVELS:
+            level = self.levels[name]
+            group = pyramidGroup.groups.get(name) or pyramidGroup.createGroup(name)
+            if "time" not in group.dimensions:
+                group.createDimension("time", None)
+                group.createDimension("wvl_lgr", len(wavelengths))
+            _writeVariable(group, "time", "f8", ("time",), level["periods"] * seconds / 86400.0,
+                           dict(_TIME_ATTRIBUTES, long_name="Start of the period"))
+            _writeVariable(group, "count", "i4", ("time",), level["count"],
+                           {"units": "1", "long_name": "Number of readings in the period"})
+
+            means = {}
+            for statistic, units in (("spectrum", spectrumUnits), ("flx_spc_dwn", "watt meter-2 meter-1")):
+                means[statistic] = level[statistic] / np.maximum(level["count"], 1)[:, np.newaxis]
+                _writeVariable(group, statistic, "f4", ("time", "wvl_lgr"), means[statistic],
+                               {"units": units, "long_name": "Mean %s over %s" % (statistic, name)})
+
+            for width, (starts, centers) in bands:
+                suffix = "%gnm" % width
+                if "wvl_" + suffix not in group.dimensions:
+                    group.createDimension("wvl_" + suffix, len(centers))
+                _writeVariable(group, "wvl_" + suffix, "f4", ("wvl_" + suffix,), centers,
+                               {"units": "nanometer", "long_name": "Bandwidth-weighted center of each %g nm band" % width})
+                weights = np.add.reduceat(bandwidths, starts)
+                for statistic in ("spectrum", "flx_spc_dwn"):
+                    binned = np.add.reduceat(means[statistic] * bandwidths, starts, axis=1) / weights
+                    _writeVariable(group, "%s_%s" % (statistic, suffix), "f4", ("time", "wvl_" + suffix), binned,
+                                   {"units": group.variables[statistic].units,
+                                    "long_name": "Mean %s over %s and %g nm bands, weighted by wvl_dlt" % (statistic, name, width)})
+        return True
+
+
+def _writeVariable(group, name, dtype, dimensions, values, attributes):
+    '''
+    Write values to a variable of group along its first dimension, creating it if needed
+    '''
+    if name in group.variables:
+        variable = group.variables[name]
+    else:
+        variable = group.createVariable(name, dtype, dimensions)
+        for attribute, value in attributes.items():
+            variable.setncattr(attribute, value)
+    variable[:len(values)] = values
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+'''
+environmental_logger_query.py
+
+----------------------------------------------------------------------------------------
+Reads time ranges and band subsets out of the full-day environmental logger netCDF
+files, without reading whole files.
+----------------------------------------------------------------------------------------
+
+The full-day files under a directory are indexed by the date in their name. Queries
+find the records of a time range by binary search on the (sorted) time variable of
+each day, and read only that hyperslab of the variable, and only the requested bands
+of spectrum/flx_spc_dwn. The most recently used files are kept open between queries.
+
+Usage:
+
+python environmental_logger_query.py out_dir PAR --start 2017-06-01T10:00:00 --end 2017-06-01T14:00:00
+python environmental_logger_query.py out_dir flx_spc_dwn --start 2017-06-01T12:00:00 --end 2017-06-01T12:10:00 --bands 650 670 --format npz --output red.npz
+python environmental_logger_query.py out_dir --serve 8000
+
+where PAR is short for Photosynthetically_Active_Radiation (any variable with a time
+dimension can be queried), and --bands selects the bands between two wavelengths.
+In --serve mode the same queries are answered over HTTP, e.g.
+
+GET /flx_spc_dwn?start=2017-06-01T12:00:00&end=2017-06-01T12:10:00&bands=650,670&format=json
+----------------------------------------------------------------------------------------
+'''
+
+import argparse
+import collections
+import json
+import os
+import re
+import sys
+import urlparse
+from datetime import datetime, timedelta
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from StringIO import StringIO
+
+import numpy as np
+from netCDF4 import Dataset
+
+from environmental_logger_json2netcdf import readDownwellingSpectralFlux
+
+
+_DAILY_FILE = re.compile(r"(\d{4}-\d{2}-\d{2})\.nc$")
+_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+_EPOCH = datetime(1970, 1, 1)
+
+_ALIASES = {"PAR": "Photosynthetically_Active_Radiation",
+            "CO2": "Atmosperic_CO2_Concentration"}
+
+# Variables along (time, wvl_lgr), which can be subset by band
+_SPECTRAL_VARIABLES = ("spectrum", "flx_spc_dwn")
+
+
+def toDays(when):
+    '''
+    Convert a datetime to the time unit of the netCDF files (days since 1970-01-01)
+    '''
+    return (when - _EPOCH).total_seconds() / 86400.0
+
+
+def fromDays(days):
+    '''
+    Convert a netCDF time (days since 1970-01-01) to a datetime, to the second
+    '''
+    return _EPOCH + timedelta(seconds=int(round(float(days) * 86400.0)))
+
+
+class EnvlogQuery(object):
+    '''
+    Answers time range and band queries over the full-day netCDF files under a directory.
+    '''
+
+    def __init__(self, directory, maxOpen=8):
+        self.directory = directory
+        self.maxOpen = maxOpen
+        self.index = {}
+        # date -> (Dataset, time values), most recently used last
+        self._open = collections.OrderedDict()
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Index the full-day files by date again, e.g. after new days were written
+        '''
+        self.index = {}
+        for filePath, fileDirectory, fileNames in os.walk(self.directory):
+            for name in fileNames:
+                match = _DAILY_FILE.search(name)
+                if match:
+                    self.index[match.group(1)] = os.path.join(filePath, name)
+
+    def close(self):
+        while self._open:
+            self._open.popitem(last=False)[1][0].close()
+
+    def dates(self):
+        return sorted(self.index)
+
+    def variables(self, date):
+        '''
+        Return the names of the variables of a day that can be queried by time
+        '''
+        netCDFHandler, times = self._dataset(date)
+        return [name for name, variable in netCDFHandler.variables.items()
+                if variable.dimensions and variable.dimensions[0] == "time"]
+
+    def query(self, variable, start, end, bands=None):
+        '''
+        Return the values of variable between start and end (datetimes, inclusive) as
+        {"variable", "units", "time": <days since 1970-01-01>, "values", "wavelengths"},
+        where bands=(low, high) keeps only the bands with wavelengths between low and high
+        (spectral variables only, "wavelengths" is None for the others)
+        '''
+        variable = _ALIASES.get(variable, variable)
+        startDays, endDays = toDays(start), toDays(end)
+        times, values, wavelengths, units = [], [], None, None
+
+        date = start.date()
+        while date <= end.date():
+            day = date.strftime("%Y-%m-%d")
+            date += timedelta(days=1)
+            if day in self.index:
+                netCDFHandler, dayTimes = self._dataset(day)
+                # flx_spc_dwn is rebuilt from the spectrum in files written with packSpectrum
+                if variable not in netCDFHandler.variables and \
+                        not (variable == "flx_spc_dwn" and "flx_spc_dwn_cff" in netCDFHandler.variables):
+                    raise KeyError("No variable %s in %s" % (variable, self.index[day]))
+
+                # Binary search for the records of the range
+                first = int(np.searchsorted(dayTimes, startDays, side="left"))
+                last  = int(np.searchsorted(dayTimes, endDays, side="right"))
+                if last > first:
+                    timeSlice = slice(first, last)
+                    bandSlice = slice(None)
+                    if variable in _SPECTRAL_VARIABLES:
+                        bandWavelengths = netCDFHandler.variables["wvl_lgr"][:]
+                        if bands is not None:
+                            bandSlice = _bandSlice(bandWavelengths, bands)
+                        wavelengths = np.asarray(bandWavelengths[bandSlice])
+
+                    if variable == "flx_spc_dwn":
+                        dayValues = readDownwellingSpectralFlux(netCDFHandler, timeSlice, bandSlice)
+                        units = "watt meter-2 meter-1"
+                    else:
+                        ncVariable = netCDFHandler.variables[variable]
+                        dayValues = ncVariable[timeSlice, bandSlice] if variable in _SPECTRAL_VARIABLES else ncVariable[timeSlice]
+                        units = getattr(ncVariable, "units", None)
+                    times.append(dayTimes[timeSlice])
+                    values.append(np.ma.filled(np.ma.asarray(dayValues, dtype=np.float64), np.nan))
+
+        return {"variable": variable,
+                "units": units,
+                "time": np.concatenate(times) if times else np.zeros(0),
+                "values": np.concatenate(values) if values else np.zeros(0),
+                "wavelengths": wavelengths}
+
+    def _dataset(self, date):
+        '''
+        Return the open Dataset of a day and its time values, opening it if it is not open yet
+        and closing the least recently used one if too many are open
+        '''
+        if date in self._open:
+            entry = self._open.pop(date)
+        else:
+            if date not in self.index:
+                raise KeyError("No full-day file for %s under %s" % (date, self.directory))
+            netCDFHandler = Dataset(self.index[date], "r")
+            entry = (netCDFHandler, np.asarray(netCDFHandler.variables["time"][:]))
+            while len(self._open) >= self.maxOpen:
+                self._open.popitem(last=False)[1][0].close()
+        self._open[date] = entry
+        return entry
+
+
+def _bandSlice(wavelengths, bands):
+    '''
+    Return the slice of the bands with wavelengths between bands[0] and bands[1]
+    '''
+    low, high = min(bands), max(bands)
+    selected = np.nonzero((wavelengths >= low) & (wavelengths <= high))[0]
+    if len(selected) == 0:
+        raise ValueError("No band between %s and %s" % (low, high))
+    return slice(int(selected[0]), int(selected[-1]) + 1)
+
+
+def toJSON(result):
+    '''
+    Encode a query result as JSON, with times as ISO strings and missing values as null
+    '''
+    values = result["values"].astype(object)
+    values[np.isnan(result["values"])] = None
+    return json.dumps({"variable": result["variable"],
+                       "units": result["units"],
+                       "time": [fromDays(days).strftime(_TIME_FORMAT) for days in result["time"]],
+                       "wavelengths": None if result["wavelengths"] is None else result["wavelengths"].tolist(),
+                       "values": values.tolist()})
+
+
+def toNumPy(result):
+    '''
+    Encode a query result as a NumPy .npz archive (time in days since 1970-01-01)
+    '''
+    arrays = {"time": result["time"], "values": result["values"]}
+    if result["wavelengths"] is not None:
+        arrays["wavelengths"] = result["wavelengths"]
+    buffer = StringIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _parseTime(value):
+    for timeFormat in (_TIME_FORMAT, "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, timeFormat)
+        except ValueError:
+            pass
+    raise ValueError("Unrecognized time %s (expected YYYY-MM-DDTHH:MM:SS)" % value)
+
+
+def serve(query, port):
+    '''
+    Answer queries over HTTP: GET /<variable>?start=...&end=...[&bands=low,high][&format=json|npz]
+    '''
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse.urlparse(self.path)
+            parameters = dict((key, values[-1]) for key, values in urlparse.parse_qs(url.query).items())
+            try:
+                variable = url.path.strip("/")
+                if not variable:
+                    body, contentType = json.dumps({"dates": query.dates()}), "application/json"
+                else:
+                    bands = [float(band) for band in parameters["bands"].split(",")] if "bands" in parameters else None
+                    result = query.query(variable, _parseTime(parameters["start"]), _parseTime(parameters["end"]), bands)
+                    if parameters.get("format") == "npz":
+                        body, contentType = toNumPy(result), "application/octet-stream"
+                    else:
+                        body, contentType = toJSON(result), "application/json"
+            except (KeyError, ValueError) as error:
+                self.send_error(404 if isinstance(error, KeyError) else 400, str(error))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", contentType)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = HTTPServer(("", port), QueryHandler)
+    print "Serving queries over", len(query.index), "days on port", port
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        query.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Query time ranges and bands of the full-day environmental logger netCDF files")
+    parser.add_argument('directory', type=str,
+                        help='The directory holding the full-day netCDF files (searched recursively)')
+    parser.add_argument('variable', type=str, nargs='?', default=None,
+                        help='The variable to read (e.g. PAR, CO2, temperature, spectrum, flx_spc_dwn)')
+    parser.add_argument('--start', type=str, help='The start of the time range (YYYY-MM-DDTHH:MM:SS)')
+    parser.add_argument('--end', type=str, help='The end of the time range (YYYY-MM-DDTHH:MM:SS)')
+    parser.add_argument('--bands', type=float, nargs=2, default=None,
+                        help='Only the bands between these two wavelengths (spectrum and flx_spc_dwn)')
+    parser.add_argument('--format', choices=["json", "npz"], default="json",
+                        help='The output format')
+    parser.add_argument('--output', type=str, default=None,
+                        help='The file to write the result to (standard output by default)')
+    parser.add_argument('--serve', type=int, default=None, metavar="PORT",
+                        help='Answer queries over HTTP on this port instead')
+    parser.add_argument('--maxopen', type=int, default=8,
+                        help='The number of files to keep open between queries')
+    args = parser.parse_args()
+
+    query = EnvlogQuery(args.directory, args.maxopen)
+    if args.serve:
+        serve(query, args.serve)
+    else:
+        if not (args.variable and args.start and args.end):
+            parser.error("a variable, --start and --end are needed unless serving")
+        result = query.query(args.variable, _parseTime(args.start), _parseTime(args.end), args.bands)
+        body = toNumPy(result) if args.format == "npz" else toJSON(result)
+        if args.output:
+            with open(args.output, "wb") as outputFile:
+                outputFile.write(body)
+        else:
+            sys.stdout.write(body)
+        query.close()
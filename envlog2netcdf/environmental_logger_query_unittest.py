@@ -0,0 +1,95 @@
+'''
+This is the unit test module for environmental_logger_query.py.
+It writes two small full-day netCDF files, one record a minute, and checks that
+queries read the records of a time range, across days, and the bands asked for.
+
+To run the unit test, simply use:
+python environmental_logger_query_unittest.py
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+from netCDF4 import Dataset
+
+from environmental_logger_query import EnvlogQuery, _bandSlice, toDays
+
+WAVELENGTHS = np.linspace(337.7, 824.3, 1024)
+
+
+class environmental_logger_queryUnitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.times, self.par, self.spectrum = [], [], []
+		for day in ("2017-06-01", "2017-06-02"):
+			start = datetime.strptime(day, "%Y-%m-%d")
+			times = np.array([toDays(start + timedelta(minutes=minute)) for minute in range(24 * 60)])
+			par = np.arange(len(times), dtype=np.float64) + len(self.par) * 10000
+			spectrum = np.outer(par, np.ones(len(WAVELENGTHS))) + np.arange(len(WAVELENGTHS))
+			with Dataset(os.path.join(self.directory, "envlog_netcdf_L1_ua-mac_%s.nc" % day), "w") as netCDFHandler:
+				netCDFHandler.createDimension("time", None)
+				netCDFHandler.createDimension("wvl_lgr", len(WAVELENGTHS))
+				netCDFHandler.createVariable("time", "f8", ("time",))[:] = times
+				netCDFHandler.createVariable("wvl_lgr", "f4", ("wvl_lgr",))[:] = WAVELENGTHS
+				parVariable = netCDFHandler.createVariable("Photosynthetically_Active_Radiation", "f4", ("time",))
+				parVariable.units = "umol m-2 s-1"
+				parVariable[:] = par
+				netCDFHandler.createVariable("spectrum", "f4", ("time", "wvl_lgr"))[:] = spectrum
+			self.times.append(times)
+			self.par.append(par)
+			self.spectrum.append(spectrum)
+		self.times, self.par, self.spectrum = map(np.concatenate, (self.times, self.par, self.spectrum))
+		self.query = EnvlogQuery(self.directory, maxOpen=1)
+
+	def tearDown(self):
+		self.query.close()
+		shutil.rmtree(self.directory)
+
+	def test_canSelectTheBandsBetweenTwoWavelengths(self):
+		'''
+		Bands at either wavelength are included, in whichever order the wavelengths are given
+		'''
+		self.assertEqual(_bandSlice(np.array([400.0, 500.0, 600.0, 700.0]), (500, 600)), slice(1, 3))
+		self.assertEqual(_bandSlice(np.array([400.0, 500.0, 600.0, 700.0]), (650, 450)), slice(1, 3))
+		self.assertEqual(_bandSlice(np.array([400.0, 500.0, 600.0, 700.0]), (0, 1000)), slice(0, 4))
+		self.assertRaises(ValueError, _bandSlice, np.array([400.0, 500.0, 600.0, 700.0]), (510, 590))
+
+	def test_canQueryARangeAcrossDays(self):
+		'''
+		The records from start to end (both included) are found in each day they span, in time order
+		'''
+		start, end = datetime(2017, 6, 1, 23, 50), datetime(2017, 6, 2, 0, 10)
+		result = self.query.query("PAR", start, end)
+		selected = (self.times >= toDays(start)) & (self.times <= toDays(end))
+		self.assertEqual(selected.sum(), 21)
+		self.assertTrue(np.array_equal(result["time"], self.times[selected]))
+		self.assertTrue(np.array_equal(result["values"], self.par[selected]))
+		self.assertEqual((result["variable"], result["units"]), ("Photosynthetically_Active_Radiation", "umol m-2 s-1"))
+
+	def test_canQueryBetweenRecords(self):
+		'''
+		A range between two records, or past the last day, finds nothing
+		'''
+		result = self.query.query("PAR", datetime(2017, 6, 1, 12, 0, 10), datetime(2017, 6, 1, 12, 0, 50))
+		self.assertEqual(len(result["time"]), 0)
+		self.assertEqual(len(self.query.query("PAR", datetime(2017, 6, 5), datetime(2017, 6, 6))["values"]), 0)
+
+	def test_canQueryABandSubset(self):
+		start, end = datetime(2017, 6, 1, 23, 58), datetime(2017, 6, 2, 0, 2)
+		result = self.query.query("spectrum", start, end, bands=(650, 670))
+		selected = (self.times >= toDays(start)) & (self.times <= toDays(end))
+		bands = (WAVELENGTHS.astype(np.float32) >= 650) & (WAVELENGTHS.astype(np.float32) <= 670)
+		self.assertTrue(np.array_equal(result["wavelengths"], WAVELENGTHS.astype(np.float32)[bands]))
+		self.assertTrue(np.array_equal(result["values"], self.spectrum[selected][:, bands]))
+
+	def test_canRefuseUnknownVariables(self):
+		self.assertRaises(KeyError, self.query.query, "nothing", datetime(2017, 6, 1), datetime(2017, 6, 2))
+
+
+if __name__ == "__main__":
+	unittest.main()
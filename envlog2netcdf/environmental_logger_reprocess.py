@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+'''
+environmental_logger_reprocess.py
+
+----------------------------------------------------------------------------------------
+Reprocesses days of environmental logger data straight from the raw_data tree,
+without Clowder, using the same daily assembly as the extractor.
+----------------------------------------------------------------------------------------
+
+Usage:
+
+python environmental_logger_reprocess.py raw_dir out_dir --start 2017-04-01 --end 2017-09-30 --workers 16 --memory 4
+
+where raw_dir holds one YYYY-MM-DD directory of _environmentlogger.json files per day
+(e.g. /projects/arpae/terraref/sites/ua-mac/raw_data/EnvironmentLogger), and each day is
+written to out_dir/YYYY-MM-DD/envlog_netcdf_L1_ua-mac_YYYY-MM-DD.nc with its _geo.csv
+(or, with --geoshards, the compressed shards of the CSV and their _geo_index.json).
+
+Whole days are scheduled across a pool of worker processes, biggest days first so the
+pool is not left waiting on one long day at the end. Each worker can be given a memory
+cap (its address space, in GB); a day that exceeds it fails on its own without taking
+the node down.
+
+Every finished day is recorded in a ledger (JSON lines, out_dir/reprocess_ledger.jsonl
+by default). Running the same command again skips the days the ledger lists as done,
+unless their JSON files changed, and retries the days that failed.
+----------------------------------------------------------------------------------------
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import traceback
+from datetime import datetime
+
+from column_cache import ColumnCache
+from environmental_logger_daily import assemble_day, geo_output_path, remove_temporary_files
+from geo_csv import geo_output_files, parse_geo_shards
+
+
+_DATE_FORMAT = "%Y-%m-%d"
+
+
+def find_days(raw_directory, start=None, end=None):
+    '''
+    Return a job for each YYYY-MM-DD directory of raw_directory between start and end (inclusive),
+    as {"date", "files", "bytes"}, biggest days first
+    '''
+    jobs = []
+    for name in os.listdir(raw_directory):
+        try:
+            datetime.strptime(name, _DATE_FORMAT)
+        except ValueError:
+            continue
+        if (start and name < start) or (end and name > end):
+            continue
+
+        day_directory = os.path.join(raw_directory, name)
+        files = sorted(os.path.join(day_directory, f) for f in os.listdir(day_directory)
+                       if f.endswith("_environmentlogger.json"))
+        if files:
+            jobs.append({"date": name, "files": files, "bytes": sum(os.path.getsize(f) for f in files)})
+
+    return sorted(jobs, key=lambda job: (-job["bytes"], job["date"]))
+
+
+def read_ledger(ledger_path):
+    '''
+    Return the last ledger entry of each day, by date
+    '''
+    entries = {}
+    if os.path.exists(ledger_path):
+        with open(ledger_path, 'r') as ledger:
+            for line in ledger:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line of a run that was killed while writing it.
+                    continue
+                entries[entry["date"]] = entry
+    return entries
+
+
+def is_done(job, entry):
+    '''
+    Whether a ledger entry shows the day was reprocessed from the same files it has now
+    '''
+    return entry is not None and entry["status"] == "done" and \
+        entry["files"] == len(job["files"]) and entry["bytes"] == job["bytes"]
+
+
+def reprocess_day(job):
+    '''
+    Assemble the full-day netCDF and geostreams CSV of one day, returning its ledger entry
+    '''
+    started = time.time()
+    entry = {"date": job["date"], "files": len(job["files"]), "bytes": job["bytes"], "pid": os.getpid()}
+    try:
+        out_netcdf = os.path.join(job["output"], job["date"], job["name"] % job["date"])
+        geo_csv = out_netcdf.replace(".nc", "_geo.csv")
+        geo_output = geo_output_path(geo_csv, job.get("geo_shards"))
+        if not os.path.isdir(os.path.dirname(out_netcdf)):
+            os.makedirs(os.path.dirname(out_netcdf))
+        # Days are only ever given to one worker, so anything left over is from an interrupted run
+        remove_temporary_files(out_netcdf)
+        if job["rebuild"]:
+            if os.path.exists(out_netcdf):
+                os.remove(out_netcdf)
+            if os.path.exists(geo_output):
+                for path in geo_output_files(geo_output):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        cache = ColumnCache(job["cachedir"], job["cachesize"]) if job["cachedir"] else None
+        assembled = assemble_day(job["files"], out_netcdf, geo_csv, job["source"] % job["date"], job["date"],
+                                 pack_spectrum=job["pack_spectrum"], prefetch=job["prefetch"], cache=cache,
+                                 pyramid=job.get("pyramid"), geo_shards=job.get("geo_shards"))
+        entry.update(status="done", converted=assembled["converted"], output=out_netcdf)
+    except MemoryError:
+        entry.update(status="failed", error="exceeded the memory cap of the worker")
+    except Exception as error:
+        entry.update(status="failed", error="%s: %s" % (type(error).__name__, error),
+                     traceback=traceback.format_exc())
+
+    entry["seconds"] = round(time.time() - started, 3)
+    return entry
+
+
+def _start_worker(memory_bytes, quiet):
+    '''
+    Set up a worker process: cap its memory, and silence the conversion messages
+    '''
+    if memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+
+
+def _format_bytes(count):
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024.0:
+            return "%.1f %s" % (count, unit)
+        count /= 1024.0
+    return "%.1f TB" % count
+
+
+def _format_seconds(seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+class ProgressReport(object):
+    '''
+    Reports each finished day with the overall throughput and the time left
+    '''
+
+    def __init__(self, jobs, stream=sys.stderr):
+        self.total_days = len(jobs)
+        self.total_bytes = sum(job["bytes"] for job in jobs)
+        self.stream = stream
+        self.started = time.time()
+        self.days = 0
+        self.bytes = 0
+        self.failed = []
+
+    def finished(self, entry):
+        self.days += 1
+        self.bytes += entry["bytes"]
+        if entry["status"] != "done":
+            self.failed.append(entry["date"])
+
+        elapsed = max(time.time() - self.started, 1e-6)
+        throughput = self.bytes / elapsed
+        remaining = (self.total_bytes - self.bytes) / throughput if throughput else 0
+        self.stream.write("[%s/%s] %s %s in %.1fs (%s files, %s)%s | %s of %s, %s/s, %.1f days/h, %s left\n" % (
+            self.days, self.total_days, entry["date"], entry["status"], entry["seconds"], entry["files"],
+            _format_bytes(entry["bytes"]), ": " + entry["error"] if "error" in entry else "",
+            _format_bytes(self.bytes), _format_bytes(self.total_bytes), _format_bytes(throughput),
+            self.days * 3600.0 / elapsed, _format_seconds(remaining)))
+        self.stream.flush()
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        return "%s days (%s) in %s, %s/s, %s failed%s" % (
+            self.days, _format_bytes(self.bytes), _format_seconds(elapsed),
+            _format_bytes(self.bytes / max(elapsed, 1e-6)), len(self.failed),
+            ": " + " ".join(sorted(self.failed)) if self.failed else "")
+
+
+def reprocess(jobs, ledger_path, workers, memory_bytes=None, quiet=True):
+    '''
+    Run the jobs across a pool of worker processes, appending each finished day to the ledger.
+    Returns the ProgressReport
+    '''
+    report = ProgressReport(jobs)
+    if not jobs:
+        return report
+
+    # One process per day, so the memory of a big day is given back before the next one
+    pool = multiprocessing.Pool(min(workers, len(jobs)), _start_worker, (memory_bytes, quiet), maxtasksperchild=1)
+    try:
+        with open(ledger_path, 'a') as ledger:
+            for entry in pool.imap_unordered(reprocess_day, jobs):
+                ledger.write(json.dumps(entry) + '\n')
+                ledger.flush()
+                os.fsync(ledger.fileno())
+                report.finished(entry)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return report
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Reprocess days of environmental logger JSON files into full-day netCDF files")
+    parser.add_argument('raw_directory', type=str,
+                        help='The raw_data/EnvironmentLogger directory, holding one YYYY-MM-DD directory per day')
+    parser.add_argument('output_directory', type=str,
+                        help='The directory to write one YYYY-MM-DD directory of outputs per day to')
+    parser.add_argument('--start', type=str, default=None, help='The first day to reprocess (YYYY-MM-DD)')
+    parser.add_argument('--end', type=str, default=None, help='The last day to reprocess (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='The number of days to reprocess at a time')
+    parser.add_argument('--memory', type=float, default=None,
+                        help='The memory cap of each worker in GB (no cap by default)')
+    parser.add_argument('--ledger', type=str, default=None,
+                        help='The job ledger (by default reprocess_ledger.jsonl in the output directory)')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild the outputs of every day, including the days the ledger lists as done')
+    parser.add_argument('--name', type=str, default="envlog_netcdf_L1_ua-mac_%s.nc",
+                        help='The name of the full-day netCDF file, %%s is replaced by the date')
+    parser.add_argument('--source', type=str, default=None,
+                        help='The source written in the geostreams CSV, %%s is replaced by the date (by default the raw day directory)')
+    parser.add_argument('--packed', action='store_true',
+                        help='Store the raw spectrum as 16-bit counts and the downwelling spectral flux as per-band coefficients')
+    parser.add_argument('--pyramid', type=float, nargs='*', default=None, metavar='WIDTH',
+                        help='Also store time means of the spectrum and flux over 1 min, 10 min and 1 h, and over bands of each WIDTH nm if given')
+    parser.add_argument('--geoshards', type=parse_geo_shards, default=None, metavar='SHARDS',
+                        help='Write the geostreams CSV as gzip-compressed shards and an index: one shard per sensor ("sensor"), '
+                             'every N rows ("N"), or both ("sensor,N")')
+    parser.add_argument('--prefetch', type=int, default=1,
+                        help='The number of JSON files each worker reads ahead (0 to disable)')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='A directory to cache the parsed JSON columns in, shared by the workers')
+    parser.add_argument('--cachesize', type=float, default=10,
+                        help='The maximum size of the cache in GB')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Show the conversion messages of the workers')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.output_directory):
+        os.makedirs(args.output_directory)
+    ledger_path = args.ledger or os.path.join(args.output_directory, "reprocess_ledger.jsonl")
+    source = args.source or os.path.join(os.path.abspath(args.raw_directory), "%s")
+
+    jobs = find_days(args.raw_directory, args.start, args.end)
+    ledger = read_ledger(ledger_path)
+    pending = [job for job in jobs if args.force or not is_done(job, ledger.get(job["date"]))]
+    for job in pending:
+        job.update(output=args.output_directory, name=args.name, rebuild=args.force, source=source, pack_spectrum=args.packed,
+                   pyramid=args.pyramid, geo_shards=args.geoshards, prefetch=args.prefetch, cachedir=args.cache, cachesize=int(args.cachesize * 1024**3))
+
+    sys.stderr.write("%s days found, %s already done, reprocessing %s (%s) with %s workers\n" % (
+        len(jobs), len(jobs) - len(pending), len(pending), _format_bytes(sum(job["bytes"] for job in pending)),
+        min(args.workers, len(pending))))
+    report = reprocess(pending, ledger_path, args.workers,
+                       int(args.memory * 1024**3) if args.memory else None, not args.verbose)
+    sys.stderr.write("Done. %s\n" % report.summary())
+    sys.exit(1 if report.failed else 0)
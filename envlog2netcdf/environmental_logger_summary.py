@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+'''
+environmental_logger_summary.py
+
+----------------------------------------------------------------------------------------
+Hourly and daily summaries of the environmental logger variables, stored in a "summary"
+group of the netCDF outputs, so quick-look readers (dashboards, QA plots) read a few KB
+instead of the whole day.
+----------------------------------------------------------------------------------------
+
+Layout (NETCDF4 outputs only, groups do not exist in the other formats):
+
+  summary/hourly/time                -> start of each hour with readings (days since 1970-01-01)
+  summary/hourly/<variable>_mean     -> mean, min and max of the readings of each weather station
+  summary/hourly/<variable>_min         variable, of CO2 and PAR, and of the downwelling irradiance
+  summary/hourly/<variable>_max         of each reading (flx_dwn), and the number of readings
+  summary/hourly/<variable>_count
+  summary/hourly/flx_dwn_integral    -> downwelling irradiance integrated over time
+  summary/daily/...                  -> the same by day
+
+The summaries are computed by hour from the columns in memory while each JSON file is
+converted, and merged, so the full-day file is never read back and a file inserted later
+just adds its hours. flx_dwn is integrated with the rectangle rule: each reading stands
+for the time until the next reading of its file (at most _MAX_INTERVAL seconds, so gaps
+in the records do not count), and the last one for the median interval of its file.
+----------------------------------------------------------------------------------------
+'''
+
+import collections
+
+import numpy as np
+
+
+SUMMARY_GROUP = "summary"
+
+# Longest time in seconds a single reading counts for in the flx_dwn integral
+_MAX_INTERVAL = 60.0
+
+_TIME_ATTRIBUTES = {"units": "days since 1970-01-01 00:00:00", "calendar": "gregorian"}
+
+
+def _reduce(bins, values, count):
+    '''
+    Return the number, sum, min and max of the finite values in each of count bins
+    (bins holds the bin of each value), with NaN min and max for empty bins
+    '''
+    finite = np.isfinite(values)
+    bins, values = bins[finite], values[finite]
+    number = np.bincount(bins, minlength=count)
+    total = np.bincount(bins, weights=values, minlength=count)
+    low, high = np.full(count, np.nan), np.full(count, np.nan)
+    if len(bins):
+        # Sort the values by bin so each bin is one run for reduceat
+        order = np.argsort(bins, kind="mergesort")
+        present = np.flatnonzero(number)
+        starts = np.concatenate(([0], np.cumsum(number[present])[:-1]))
+        low[present] = np.minimum.reduceat(values[order], starts)
+        high[present] = np.maximum.reduceat(values[order], starts)
+    return number, total, low, high
+
+
+def _intervals(seconds):
+    '''
+    Return the time in seconds each reading stands for: until the next reading, at most _MAX_INTERVAL
+    '''
+    order = np.argsort(seconds, kind="mergesort")
+    gaps = np.diff(seconds[order])
+    last = np.median(gaps) if len(gaps) else 0.0
+    intervals = np.empty(len(seconds))
+    intervals[order] = np.clip(np.append(gaps, last), 0.0, _MAX_INTERVAL)
+    return intervals
+
+
+class Summary(object):
+    '''
+    The number, sum, min and max of each variable by hour, and the flx_dwn integral,
+    which can be merged with the summary of other readings of the same day
+    '''
+
+    def __init__(self, hours=None, variables=None):
+        # Hours since 1970-01-01, sorted
+        self.hours = np.zeros(0, np.int64) if hours is None else hours
+        # name -> {"units", "count", "sum", "min", "max"[, "integral"]}, each an array by hour
+        self.variables = variables if variables is not None else collections.OrderedDict()
+
+    @classmethod
+    def fromColumns(cls, times, columns, recordFlux=None):
+        '''
+        Summarize readings: times in days since 1970-01-01, columns as [(name, units, values), ...],
+        and recordFlux the downwelling irradiance of each reading (summarized as flx_dwn)
+        '''
+        times = np.asarray(times, dtype=np.float64)
+        hours, bins = np.unique(np.floor(times * 24).astype(np.int64), return_inverse=True)
+        summary = cls(hours)
+        for name, units, values in columns:
+            number, total, low, high = _reduce(bins, np.asarray(values, dtype=np.float64), len(hours))
+            summary.variables[name] = {"units": units, "count": number, "sum": total, "min": low, "max": high}
+
+        if recordFlux is not None:
+            recordFlux = np.asarray(recordFlux, dtype=np.float64)
+            number, total, low, high = _reduce(bins, recordFlux, len(hours))
+            energy = recordFlux * _intervals(times * 86400.0)
+            finite = np.isfinite(energy)
+            summary.variables["flx_dwn"] = {"units": "watt meter-2", "count": number, "sum": total, "min": low, "max": high,
+                                            "integral": np.bincount(bins[finite], weights=energy[finite], minlength=len(hours))}
+        return summary
+
+    @classmethod
+    def read(cls, netCDFHandler):
+        '''
+        Read the hourly summary back from an open netCDF file, or return None if it has none
+        '''
+        if SUMMARY_GROUP not in getattr(netCDFHandler, "groups", {}):
+            return None
+        hourly = netCDFHandler.groups[SUMMARY_GROUP].groups["hourly"]
+        summary = cls(np.round(hourly.variables["time"][:] * 24).astype(np.int64))
+        for countName in [name for name in hourly.variables if name.endswith("_count")]:
+            name = countName[:-len("_count")]
+            number = np.ma.filled(hourly.variables[countName][:], 0).astype(np.int64)
+            mean = np.ma.filled(hourly.variables[name + "_mean"][:], np.nan)
+            entry = {"units": hourly.variables[name + "_mean"].units, "count": number,
+                     "sum": np.where(number > 0, mean * number, 0.0),
+                     "min": np.ma.filled(hourly.variables[name + "_min"][:], np.nan),
+                     "max": np.ma.filled(hourly.variables[name + "_max"][:], np.nan)}
+            if name + "_integral" in hourly.variables:
+                entry["integral"] = np.ma.filled(hourly.variables[name + "_integral"][:], 0.0)
+            summary.variables[name] = entry
+        return summary
+
+    def merge(self, other):
+        '''
+        Return the summary of the readings of both summaries
+        '''
+        hours = np.union1d(self.hours, other.hours)
+        positions = [(np.searchsorted(hours, self.hours), self.variables),
+                     (np.searchsorted(hours, other.hours), other.variables)]
+        merged = Summary(hours)
+        for name in list(self.variables) + [name for name in other.variables if name not in self.variables]:
+            entry = {"units": (self.variables.get(name) or other.variables[name])["units"]}
+            for statistic, fill, combine in (("count", 0, np.add), ("sum", 0.0, np.add), ("integral", 0.0, np.add),
+                                             ("min", np.nan, np.fmin), ("max", np.nan, np.fmax)):
+                parts = [(position, variables[name][statistic]) for position, variables in positions
+                         if name in variables and statistic in variables[name]]
+                if not parts:
+                    continue
+                values = np.full(len(hours), fill, dtype=parts[0][1].dtype)
+                for position, part in parts:
+                    values[position] = combine(values[position], part)
+                entry[statistic] = values
+            merged.variables[name] = entry
+        return merged
+
+    def daily(self):
+        '''
+        Return (days since 1970-01-01, variables) with the hourly statistics combined by day
+        '''
+        days, starts = np.unique(self.hours // 24, return_index=True)
+        bins = np.searchsorted(days, self.hours // 24)
+        variables = collections.OrderedDict()
+        for name, entry in self.variables.items():
+            daily = {"units": entry["units"]}
+            for statistic in ("count", "sum", "integral"):
+                if statistic in entry:
+                    daily[statistic] = np.bincount(bins, weights=entry[statistic], minlength=len(days))
+            daily["count"] = daily["count"].astype(np.int64)
+            # The hours of a day are one run, as hours are sorted; fmin and fmax skip empty hours
+            daily["min"] = np.fmin.reduceat(entry["min"], starts) if len(starts) else entry["min"]
+            daily["max"] = np.fmax.reduceat(entry["max"], starts) if len(starts) else entry["max"]
+            variables[name] = daily
+        return days.astype(np.float64), variables
+
+    def write(self, netCDFHandler):
+        '''
+        Write (or rewrite) the summary group of an open netCDF file. Returns whether the file
+        can hold one (NETCDF4 files only)
+        '''
+        if getattr(netCDFHandler, "data_model", None) != "NETCDF4":
+            return False
+        summaryGroup = netCDFHandler.createGroup(SUMMARY_GROUP)
+        summaryGroup.description = "Hourly and daily statistics of the readings of the weather station, CO2 and PAR sensors, " \
+                                   "and of the downwelling irradiance of each reading"
+        for resolution, (starts, variables) in (("hourly", (self.hours / 24.0, self.variables)), ("daily", self.daily())):
+            group = summaryGroup.groups.get(resolution) or summaryGroup.createGroup(resolution)
+            if "time" not in group.dimensions:
+                group.createDimension("time", None)
+            period = "hour" if resolution == "hourly" else "day"
+            _writeVariable(group, "time", "f8", starts, dict(_TIME_ATTRIBUTES, long_name="Start of the %s" % period))
+            for name, entry in variables.items():
+                number = entry["count"]
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    mean = np.where(number > 0, entry["sum"] / number, np.nan)
+                for statistic, values in (("mean", mean), ("min", entry["min"]), ("max", entry["max"])):
+                    _writeVariable(group, "%s_%s" % (name, statistic), "f8", values,
+                                   {"units": entry["units"], "long_name": "%s %s of %s" % (resolution.capitalize(), statistic, name)})
+                _writeVariable(group, name + "_count", "i4", number,
+                               {"units": "1", "long_name": "Number of readings of %s in the %s" % (name, period)})
+                if "integral" in entry:
+                    _writeVariable(group, name + "_integral", "f8", entry["integral"],
+                                   {"units": "joule meter-2", "long_name": "%s over the %s, integrated over time" % (name, period)})
+        return True
+
+
+def _writeVariable(group, name, dtype, values, attributes):
+    '''
+    Write values to a variable along the time dimension of group, creating it if needed
+    '''
+    if name in group.variables:
+        variable = group.variables[name]
+    else:
+        variable = group.createVariable(name, dtype, ("time",))
+        for attribute, value in attributes.items():
+            variable.setncattr(attribute, value)
+    variable[:len(values)] = values
@@ -0,0 +1,202 @@
+'''
+geo_csv.py
+
+Writes the geostreams CSV of a day of environmental logger data (one row per datapoint),
+either as one CSV file or as gzip-compressed shards of it, one per sensor and/or every
+N rows, with an index of the shards, so several geostreams workers can ingest a day in
+parallel and far fewer bytes are stored and moved.
+
+Sharded outputs, for the CSV <name>_geo.csv:
+
+  <name>_geo_index.json            -> {"header": [...], "compression": "gzip",
+                                       "shards": [{"file", "sensors", "rows", "start", "end", "bytes"}, ...]}
+  <name>_geo_<sensor>_000.csv.gz   -> one shard, a complete CSV with its header
+  <name>_geo_000.csv.gz               (without sharding by sensor)
+
+where start and end are the first and last dp_time of the rows of each shard. The index
+is written last, so a day whose index exists has all its shards.
+'''
+
+import datetime
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+
+
+GEO_CSV_HEADER = ['site', 'trait', 'lat', 'lon', 'dp_time', 'source', 'value', 'timestamp']
+
+_INDEX_SUFFIX = "_index.json"
+
+# Stands in for the value when the datapoint object of a column is encoded (json.dumps escapes it)
+_VALUE = "\0"
+
+_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S-07:00"
+
+
+def parse_geo_shards(spec):
+    '''
+    Parse how to shard the geostreams CSV: "sensor", a number of rows, or both ("sensor,50000")
+    '''
+    shards = {"by_sensor": False, "rows": None}
+    for part in spec.split(","):
+        if part.strip() == "sensor":
+            shards["by_sensor"] = True
+        elif int(part) > 0:
+            shards["rows"] = int(part)
+        else:
+            raise ValueError("shards need at least one row: %s" % spec)
+    return shards
+
+def geo_index_path(geo_csv):
+    '''
+    Return the path of the shard index standing for the CSV geo_csv
+    '''
+    return geo_csv[:-len(".csv")] + _INDEX_SUFFIX
+
+def read_geo_index(index_path):
+    with open(index_path, 'r') as index_file:
+        return json.load(index_file)
+
+def geo_output_files(path):
+    '''
+    Return the files of a geostreams CSV output: the CSV itself, or the shards listed in an index and the index
+    '''
+    if not path.endswith(_INDEX_SUFFIX):
+        return [path]
+    directory = os.path.dirname(path)
+    return [os.path.join(directory, shard["file"]) for shard in read_geo_index(path)["shards"]] + [path]
+
+def add_to_geo_index(index_path, other_index_path):
+    '''
+    Add the shards of another index (e.g. of the rows of files inserted later) to an index
+    '''
+    index = read_geo_index(index_path)
+    index["shards"].extend(read_geo_index(other_index_path)["shards"])
+    _write_json(index_path, index)
+
+def encode_geo_csv_rows(columns, source, timestamp):
+    '''
+    Yield (stream, dp_times, rows) for each sensor column of columns (as returned by
+    environmental_logger_json2netcdf.main), with one row per value. The rows of a column only
+    differ in their time and value, so the rest of them is encoded once per column.
+    '''
+    time_points = [(datetime.datetime(year=1970, month=1, day=1) +
+                    datetime.timedelta(days=float(days))).strftime(_TIME_FORMAT) for days in columns["time"]]
+
+    for attributes, values in columns["sensors"]:
+        stream = attributes["sensor"]
+        # The datapoint object of the column, JSON-encoded with its quotes doubled for the CSV
+        dp_obj = dict(attributes)
+        dp_obj["value"] = _VALUE
+        before, after = json.dumps(dp_obj).replace('"', '""').split(json.dumps(_VALUE)[1:-1])
+        head = ','.join(["Full Field - Environmental Logger", "(EL) %s" % stream, str(33.075576), str(-111.974304)]) + ','
+        tail = '",%s\n' % timestamp
+        middle = ',%s,"%s' % (source, before)
+        rows = [head + time_points[index] + middle + str(values[index]) + after + tail for index in range(len(values))]
+        yield stream, time_points[:len(values)], rows
+
+
+class GeoCSVFile(object):
+    '''
+    Writes the geostreams CSV as one file, which only appears at path when it is closed
+    '''
+
+    def __init__(self, path, temporary_path):
+        self.path = path
+        self._temporary_path = temporary_path
+        self._file = open(temporary_path, 'w')
+        self._file.write(','.join(GEO_CSV_HEADER) + '\n')
+
+    def write(self, columns, source, timestamp):
+        for stream, dp_times, rows in encode_geo_csv_rows(columns, source, timestamp):
+            self._file.writelines(rows)
+
+    def close(self):
+        '''
+        Finish the CSV, returning the paths written
+        '''
+        self._file.close()
+        shutil.move(self._temporary_path, self.path)
+        return [self.path]
+
+
+class GeoCSVShards(object):
+    '''
+    Writes the geostreams CSV as gzip-compressed shards, one per sensor (by_sensor) and/or
+    every rows rows, and their index at index_path when it is closed. Shards are compressed
+    as they are written, under a temporary name (temporary_prefix + their name) until they are full.
+    '''
+
+    def __init__(self, index_path, temporary_prefix, by_sensor=False, rows=None, compresslevel=6):
+        self.index_path = index_path
+        self._base = index_path[:-len(_INDEX_SUFFIX)]
+        self._temporary_prefix = temporary_prefix
+        self.by_sensor = by_sensor
+        self.rows = rows
+        self.compresslevel = compresslevel
+        # key (the sensor, or None) -> the shard being written
+        self._open = {}
+        # key -> number of shards started
+        self._started = {}
+        self.shards = []
+
+    def write(self, columns, source, timestamp):
+        for stream, dp_times, rows in encode_geo_csv_rows(columns, source, timestamp):
+            key = stream if self.by_sensor else None
+            first = 0
+            while first < len(rows):
+                shard = self._open.get(key) or self._start(key)
+                last = len(rows) if self.rows is None else min(len(rows), first + self.rows - shard["rows"])
+                shard["file"].write("".join(rows[first:last]))
+                shard["rows"] += last - first
+                shard["sensors"].add(stream)
+                start, end = min(dp_times[first:last]), max(dp_times[first:last])
+                shard["start"] = start if shard["start"] is None else min(shard["start"], start)
+                shard["end"] = end if shard["end"] is None else max(shard["end"], end)
+                if self.rows is not None and shard["rows"] >= self.rows:
+                    self._finish(key)
+                first = last
+
+    def close(self):
+        '''
+        Finish the open shards and write the index, returning the paths written
+        '''
+        for key in list(self._open):
+            self._finish(key)
+        _write_json(self.index_path, {"header": GEO_CSV_HEADER, "compression": "gzip",
+                                      "shards": sorted(self.shards, key=lambda shard: shard["file"])})
+        directory = os.path.dirname(self.index_path)
+        return [os.path.join(directory, shard["file"]) for shard in self.shards] + [self.index_path]
+
+    def _start(self, key):
+        number = self._started.get(key, 0)
+        self._started[key] = number + 1
+        path = "%s_%s%03d.csv.gz" % (self._base, "" if key is None else re.sub(r'[^\w.-]', '_', key) + "_", number)
+        temporary_path = os.path.join(os.path.dirname(path), self._temporary_prefix + os.path.basename(path))
+        raw = open(temporary_path, 'wb')
+        shard = {"path": path, "temporary_path": temporary_path, "raw": raw, "rows": 0, "sensors": set(),
+                 "start": None, "end": None,
+                 "file": gzip.GzipFile(os.path.basename(path)[:-len(".gz")], 'wb', self.compresslevel, raw)}
+        shard["file"].write(','.join(GEO_CSV_HEADER) + '\n')
+        self._open[key] = shard
+        return shard
+
+    def _finish(self, key):
+        shard = self._open.pop(key)
+        shard["file"].close()
+        shard["raw"].close()
+        shutil.move(shard["temporary_path"], shard["path"])
+        self.shards.append({"file": os.path.basename(shard["path"]), "sensors": sorted(shard["sensors"]),
+                            "rows": shard["rows"], "start": shard["start"], "end": shard["end"],
+                            "bytes": os.path.getsize(shard["path"])})
+
+
+def _write_json(path, contents):
+    # Write next to the file and rename it, so readers never see half of it
+    descriptor, temporary_path = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path) or ".")
+    with os.fdopen(descriptor, 'w') as json_file:
+        json.dump(contents, json_file, indent=1)
+    os.rename(temporary_path, path)
@@ -0,0 +1,109 @@
+'''
+prefetch.py
+
+Reads input files ahead of the code consuming them, on a background thread,
+so the I/O latency of the shared filesystem overlaps with the CPU-bound
+conversion of the previous file.
+
+At most `depth` files are held in memory ahead of the consumer. With a depth
+of 0 the files are read synchronously, as they are requested.
+'''
+
+import threading
+import time
+import Queue
+
+
+class Prefetcher(object):
+    '''
+    Iterates over (path, contents) for the given paths, in order.
+    '''
+
+    def __init__(self, paths, depth=1):
+        self.paths = list(paths)
+        self.depth = depth
+        # Instrumentation: files and bytes read, time spent reading them and time the consumer waited.
+        self.files = 0
+        self.bytes = 0
+        self.read_seconds = 0.0
+        self.wait_seconds = 0.0
+
+        self._stopped = threading.Event()
+        self._queue = None
+        self._thread = None
+
+    def __iter__(self):
+        if self.depth <= 0:
+            for path in self.paths:
+                started = time.time()
+                contents = self._read(path)
+                self.wait_seconds += time.time() - started
+                yield path, contents
+            return
+
+        self._queue = Queue.Queue(maxsize=self.depth)
+        self._thread = threading.Thread(target=self._run, name="prefetch")
+        self._thread.daemon = True
+        self._thread.start()
+        try:
+            for path in self.paths:
+                started = time.time()
+                contents = self._queue.get()
+                self.wait_seconds += time.time() - started
+                if isinstance(contents, _ReadError):
+                    raise contents.error
+                yield path, contents
+        finally:
+            self.close()
+
+    def close(self):
+        '''
+        Stop reading ahead, e.g. when the consumer gives up before the last file.
+        '''
+        self._stopped.set()
+        if self._thread is not None:
+            # Unblock the reader if it is waiting for room in the queue.
+            while self._thread.is_alive():
+                try:
+                    self._queue.get_nowait()
+                except Queue.Empty:
+                    self._thread.join(0.1)
+            self._thread = None
+
+    def summary(self):
+        '''
+        One line describing the reads, for the logs.
+        '''
+        return "read %s files (%s bytes) in %.2fs, waited %.2fs for them (read-ahead %s)" % (
+            self.files, self.bytes, self.read_seconds, self.wait_seconds, self.depth)
+
+    def _read(self, path):
+        started = time.time()
+        with open(path, 'rb') as fileHandler:
+            contents = fileHandler.read()
+        self.read_seconds += time.time() - started
+        self.files += 1
+        self.bytes += len(contents)
+        return contents
+
+    def _run(self):
+        for path in self.paths:
+            if self._stopped.is_set():
+                return
+            try:
+                contents = self._read(path)
+            except (IOError, OSError) as error:
+                contents = _ReadError(error)
+            while not self._stopped.is_set():
+                try:
+                    self._queue.put(contents, timeout=0.1)
+                    break
+                except Queue.Full:
+                    pass
+            if isinstance(contents, _ReadError):
+                return
+
+
+class _ReadError(object):
+    def __init__(self, error):
+        self.error = error
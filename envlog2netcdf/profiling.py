@@ -0,0 +1,119 @@
+'''
+profiling.py
+
+Opt-in profiling of extractor messages and command line runs.
+
+Profiling is switched on by setting the EXTRACTOR_PROFILE environment variable,
+or the --profile argument, to the directory the profiles should go to. Each
+profiled message (or run) then writes two files named after the resource id:
+
+  <name>.pstats     -> cProfile statistics, readable with the pstats module or snakeviz
+  <name>.collapsed  -> sampled call stacks in collapsed format, for flamegraph.pl/speedscope
+
+and the top functions by cumulative time are added to the log.
+'''
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from StringIO import StringIO
+
+
+PROFILE_ENVIRONMENT_VARIABLE = "EXTRACTOR_PROFILE"
+PROFILE_TOP_ENVIRONMENT_VARIABLE = "EXTRACTOR_PROFILE_TOP"
+
+
+def add_profiling_arguments(parser):
+    '''
+    Add the profiling arguments to an extractor's (or script's) parser.
+    '''
+    parser.add_argument('--profile', dest="profile_dir", type=str,
+                        default=os.environ.get(PROFILE_ENVIRONMENT_VARIABLE, None),
+                        help="directory to write a cProfile and a sampled stack profile of each message to "
+                             "(also set by $%s)" % PROFILE_ENVIRONMENT_VARIABLE)
+    parser.add_argument('--profiletop', dest="profile_top", type=int,
+                        default=int(os.environ.get(PROFILE_TOP_ENVIRONMENT_VARIABLE, 25)),
+                        help="number of functions to include in the logged profile summary")
+
+
+class Profile(object):
+    '''
+    Profiles the code run inside a with block, with cProfile and a stack sampler.
+    '''
+
+    def __init__(self, name, directory, top=25, interval=0.005):
+        self.name = name
+        self.directory = directory
+        self.top = top
+        self.interval = interval
+        self.summary = None
+        self.pstats_path = os.path.join(directory, name + ".pstats")
+        self.collapsed_path = os.path.join(directory, name + ".collapsed")
+
+        self._profile = cProfile.Profile()
+        self._stacks = {}
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def __enter__(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        self._sampler = threading.Thread(target=self._sample, args=(threading.current_thread().ident,),
+                                         name="profile-sampler")
+        self._sampler.daemon = True
+        self._sampler.start()
+        self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._profile.disable()
+        self._stopped.set()
+        self._sampler.join()
+
+        self._profile.dump_stats(self.pstats_path)
+        with open(self.collapsed_path, 'w') as collapsed:
+            for stack, count in sorted(self._stacks.items()):
+                collapsed.write("%s %s\n" % (stack, count))
+
+        report = StringIO()
+        pstats.Stats(self._profile, stream=report).sort_stats("cumulative").print_stats(self.top)
+        self.summary = report.getvalue()
+        return False
+
+    def _sample(self, thread_id):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s:%s:%s" % (os.path.basename(code.co_filename), code.co_name, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+
+
+def profile_messages(extractor):
+    '''
+    Wrap the process_message of an extractor in a Profile if profiling was asked for,
+    naming the profiles after the resource id of each message.
+    '''
+    directory = extractor.args.profile_dir
+    if not directory:
+        return
+
+    process_message = extractor.process_message
+
+    def profiled_process_message(connector, host, secret_key, resource, parameters):
+        name = "%s_%s" % (resource['id'], time.strftime("%Y%m%d-%H%M%S"))
+        with Profile(name, directory, extractor.args.profile_top) as profile:
+            result = process_message(connector, host, secret_key, resource, parameters)
+        extractor.log_info(resource, "profile written to %s and %s\n%s" % (
+            profile.pstats_path, profile.collapsed_path, profile.summary))
+        return result
+
+    extractor.process_message = profiled_process_message
@@ -1,35 +1,54 @@
 #!/usr/bin/env python
 
-import datetime
 import os
-import shutil
-import subprocess
-import json
-from netCDF4 import Dataset
 
 from pyclowder.utils import CheckMessage
 from pyclowder.datasets import get_info, get_file_list, download_metadata, upload_metadata
-from pyclowder.files import upload_to_dataset, submit_extraction
+from pyclowder.files import submit_extraction
 from terrautils.extractors import TerrarefExtractor, build_dataset_hierarchy_crawl, build_metadata, \
     is_latest_file, file_exists, contains_required_files
 from terrautils.metadata import get_extractor_metadata
 
-import environmental_logger_json2netcdf as ela
+from environmental_logger_daily import assemble_day, geo_output_path, read_manifest
+from geo_csv import geo_output_files, parse_geo_shards
+from profiling import add_profiling_arguments, profile_messages
+from concurrency import add_concurrency_arguments, pool_messages, start_extractor
+from column_cache import ColumnCache
+from chunked_upload import ChunkedUpload, UploadPool, delete_file
+from clowder_cache import ClowderCache
 
 
 def add_local_arguments(parser):
     # add any additional arguments to parser
     parser.add_argument('--batchsize', type=int, default=3000,
                         help="max number of datapoints to submit at a time")
-
-def _produce_attr_dict(netCDF_variable_obj):
-    '''
-    Produce a list of dictionary with attributes and value (Each dictionary is one datapoint)
-    '''
-    attributes = [attr for attr in dir(netCDF_variable_obj) if isinstance(attr, unicode)]
-    result     = {name:getattr(netCDF_variable_obj, name) for name in attributes}
-
-    return [dict(result.items()+ {"value":str(data)}.items()) for data in netCDF_variable_obj[...]]
+    parser.add_argument('--prefetch', type=int, default=1,
+                        help="number of JSON files to read ahead in the background while converting (0 to disable)")
+    parser.add_argument('--packspectrum', action='store_true',
+                        help="store the raw spectrum as 16-bit counts and the downwelling spectral flux as per-band coefficients")
+    parser.add_argument('--pyramid', type=float, nargs='*', default=None, metavar='WIDTH',
+                        help="also store time means of the spectrum and flux over 1 min, 10 min and 1 h, and over bands of each WIDTH nm if given")
+    parser.add_argument('--geoshards', type=parse_geo_shards, default=None, metavar='SHARDS',
+                        help="write the geostreams CSV as gzip-compressed shards and an index: one shard per sensor (\"sensor\"), "
+                             "every N rows (\"N\"), or both (\"sensor,N\"), uploaded for parallel ingestion instead of a geostreams extraction")
+    parser.add_argument('--cachedir', type=str, default=os.environ.get('ENVLOG_CACHE_DIR', None),
+                        help="directory to cache the columns parsed from each JSON file in, for reprocessing")
+    parser.add_argument('--cachesize', type=float, default=float(os.environ.get('ENVLOG_CACHE_GB', 10)),
+                        help="max size in GB of the parsed columns cache")
+    parser.add_argument('--uploadchunk', type=float, default=8,
+                        help="MB of the outputs to send per request when uploading them in chunks")
+    parser.add_argument('--uploadretries', type=int, default=5,
+                        help="number of times to retry (or resume) an upload after a failure")
+    parser.add_argument('--uploadworkers', type=int, default=3,
+                        help="max number of outputs to upload at a time, across all the messages being processed")
+    parser.add_argument('--resumableuploads', action='store_true',
+                        help="use tus resumable uploads where the server offers them at api/uploads (Clowder itself does not)")
+    parser.add_argument('--clowderttl', type=float, default=float(os.environ.get('CLOWDER_CACHE_TTL', 3600)),
+                        help="seconds to cache the dataset ids of the collection hierarchy and the dataset file listings for")
+    parser.add_argument('--clowdercache', type=str, default=os.environ.get('CLOWDER_CACHE_DIR', None),
+                        help="directory to share the dataset ids and file listings cache in, between extractors")
+    add_profiling_arguments(parser)
+    add_concurrency_arguments(parser)
 
 class EnvironmentLoggerJSON2NetCDF(TerrarefExtractor):
     def __init__(self):
@@ -42,6 +61,20 @@ class EnvironmentLoggerJSON2NetCDF(TerrarefExtractor):
         self.setup(sensor='envlog_netcdf')
 
         self.batchsize = self.args.batchsize
+        self.pack_spectrum = self.args.packspectrum
+        self.pyramid = self.args.pyramid
+        self.geo_shards = self.args.geoshards
+        self.prefetch = self.args.prefetch
+        self.column_cache = ColumnCache(self.args.cachedir, int(self.args.cachesize * 1024**3)) \
+            if self.args.cachedir else None
+        self.clowder_cache = ClowderCache(self.args.clowderttl, self.args.clowdercache)
+        self.upload_pool = UploadPool(self.args.uploadworkers)
+
+        # profile each message if asked to
+        profile_messages(self)
+
+        # process several messages at a time if asked to
+        pool_messages(self)
 
     def check_message(self, connector, host, secret_key, resource, parameters):
         if "rulechecked" in parameters and parameters["rulechecked"]:
@@ -56,10 +89,14 @@ class EnvironmentLoggerJSON2NetCDF(TerrarefExtractor):
             if get_extractor_metadata(md, self.extractor_info['name'], self.extractor_info['version']):
                 timestamp = resource['name'].split(" - ")[1]
                 out_fullday_netcdf = self.sensors.create_sensor_path(timestamp)
-                out_fullday_csv = out_fullday_netcdf.replace(".nc", "_geo.csv")
+                out_fullday_csv = geo_output_path(out_fullday_netcdf.replace(".nc", "_geo.csv"), self.geo_shards)
                 if file_exists(out_fullday_netcdf) and file_exists(out_fullday_csv):
-                    self.log_skip(resource, "metadata v%s and outputs already exist" % self.extractor_info['version'])
-                    return CheckMessage.ignore
+                    manifest = read_manifest(out_fullday_netcdf)
+                    converted = set([entry["file"] for entry in manifest]) if manifest is not None else None
+                    if converted is None or all(f['filename'] in converted for f in resource['files']
+                                                if f['filename'].endswith("_environmentlogger.json")):
+                        self.log_skip(resource, "metadata v%s and outputs already exist" % self.extractor_info['version'])
+                        return CheckMessage.ignore
             return CheckMessage.download
         else:
             self.log_skip(resource, "found less than 23 files")
@@ -81,73 +118,91 @@ class EnvironmentLoggerJSON2NetCDF(TerrarefExtractor):
         # Determine full output path
         timestamp = resource['name'].split(" - ")[1]
         out_fullday_netcdf = self.sensors.create_sensor_path(timestamp)
-        temp_out_full = os.path.join(os.path.dirname(out_fullday_netcdf), "temp_full.nc")
-        temp_out_single = temp_out_full.replace("_full.nc", "_single.nc")
         geo_csv = out_fullday_netcdf.replace(".nc", "_geo.csv")
-
-        if not file_exists(temp_out_full):
-            for json_file in json_files:
-                self.log_info(resource, "converting %s to netCDF & appending" % os.path.basename(json_file))
-                ela.mainProgramTrigger(json_file, temp_out_single)
-                cmd = "ncrcat --record_append %s %s" % (temp_out_single, temp_out_full)
-                subprocess.call([cmd], shell=True)
-                os.remove(temp_out_single)
-
-            shutil.move(temp_out_full, out_fullday_netcdf)
-            self.created += 1
-            self.bytes += os.path.getsize(out_fullday_netcdf)
-
-        # Write out geostreams.csv
-        if not file_exists(geo_csv):
-            self.log_info(resource, "writing geostreams CSV")
-            geo_file = open(geo_csv, 'w')
-            geo_file.write(','.join(['site', 'trait', 'lat', 'lon', 'dp_time', 'source', 'value', 'timestamp']) + '\n')
-            with Dataset(out_fullday_netcdf, "r") as ncdf:
-                streams = set([sensor_info.name for sensor_info in ncdf.variables.values() if sensor_info.name.startswith('sensor')])
-                for stream in streams:
-                    if stream != "sensor_spectrum":
-                        try:
-                            memberlist = ncdf.get_variables_by_attributes(sensor=stream)
-                            for members in memberlist:
-                                data_points = _produce_attr_dict(members)
-                                for index in range(len(data_points)):
-                                    dp_obj = data_points[index]
-                                    if dp_obj["sensor"] == stream:
-                                        time_format = "%Y-%m-%dT%H:%M:%S-07:00"
-                                        time_point = (datetime.datetime(year=1970, month=1, day=1) + \
-                                                      datetime.timedelta(days=ncdf.variables["time"][index])).strftime(time_format)
-
-                                        geo_file.write(','.join(["Full Field - Environmental Logger",
-                                                                 "(EL) %s" % stream,
-                                                                 str(33.075576),
-                                                                 str(-111.974304),
-                                                                 time_point,
-                                                                 host + ("" if host.endswith("/") else "/") + "datasets/" + resource['id'],
-                                                                 '"%s"' % json.dumps(dp_obj).replace('"', '""'),
-                                                                 timestamp]) + '\n')
-
-                        except:
-                            self.log_error(resource, "NetCDF attribute not found: %s" % stream)
-
-        # Fetch dataset ID by dataset name if not provided
-        target_dsid = build_dataset_hierarchy_crawl(host, secret_key, self.clowder_user, self.clowder_pass, self.clowderspace,
-                                                    None, None, self.sensors.get_display_name(),
-                                                    timestamp[:4], timestamp[5:7], timestamp[8:10],
-                                                    leaf_ds_name=self.sensors.get_display_name() + ' - ' + timestamp)
-        ds_files = get_file_list(connector, host, secret_key, target_dsid)
-        found_full = False
-        found_csv  = False
+        geo_output = geo_output_path(geo_csv, self.geo_shards)
+        source = host + ("" if host.endswith("/") else "/") + "datasets/" + resource['id']
+
+        # Fetch dataset ID by dataset name if not provided, unless it was seen recently
+        hierarchy = (host, str(self.clowderspace), self.sensors.get_display_name(),
+                     timestamp[:4], timestamp[5:7], timestamp[8:10], self.sensors.get_display_name() + ' - ' + timestamp)
+        target_dsid = self.clowder_cache.dataset_id(hierarchy, lambda: build_dataset_hierarchy_crawl(
+            host, secret_key, self.clowder_user, self.clowder_pass, self.clowderspace,
+            None, None, self.sensors.get_display_name(), timestamp[:4], timestamp[5:7], timestamp[8:10],
+            leaf_ds_name=self.sensors.get_display_name() + ' - ' + timestamp))
+        ds_files = self.clowder_cache.file_list(target_dsid, lambda: get_file_list(connector, host, secret_key, target_dsid))
+        # Ids of the outputs the dataset already has
+        found_full = None
+        found_csv  = None
         for f in ds_files:
             if f['filename'] == os.path.basename(out_fullday_netcdf):
-                found_full = True
-            if f['filename'] == os.path.basename(geo_csv):
-                found_csv = True
+                found_full = f['id']
+            if f['filename'] == os.path.basename(geo_output):
+                found_csv = f['id']
+
+        # Start uploading the full-day netCDF as soon as it is complete, while the CSV is finished
+        uploads = []
+        def upload_netcdf(path):
+            if not found_full and not uploads:
+                uploads.append(self.start_upload(connector, host, secret_key, target_dsid, path, resource))
+
+        try:
+            assembled = assemble_day(json_files, out_fullday_netcdf, geo_csv, source, timestamp,
+                                     pack_spectrum=self.pack_spectrum, pyramid=self.pyramid, geo_shards=self.geo_shards,
+                                     prefetch=self.prefetch, cache=self.column_cache,
+                                     log=lambda message: self.log_info(resource, message), on_netcdf=upload_netcdf)
+        except Exception:
+            # The complete full-day netCDF may already be uploading; wait for it before failing the message,
+            # so no upload outlives it and the dataset's cached file list knows about the file
+            for upload in uploads:
+                try:
+                    self.clowder_cache.add_file(target_dsid, upload.result(), os.path.basename(upload.upload.path))
+                    self.log_info(resource, "uploaded %s" % upload.upload.summary())
+                except Exception as error:
+                    self.clowder_cache.invalidate("files", target_dsid)
+                    self.log_info(resource, "uploading %s failed too: %s" % (os.path.basename(upload.upload.path), error))
+            raise
+        for created in assembled["created"]:
+            self.created += 1
+            self.bytes += os.path.getsize(created)
+        new_geo_files = geo_output_files(assembled["new_geo_csv"]) if assembled["new_geo_csv"] else []
+        if self.geo_shards and new_geo_files:
+            # The shards of late files are added to the index of the day, which replaces its older copy below,
+            # so their own index is not uploaded next to it
+            new_geo_files.remove(assembled["new_geo_csv"])
+
         if not found_full:
-            upload_to_dataset(connector, host, secret_key, target_dsid, out_fullday_netcdf)
-        if not found_csv:
-            geoid = upload_to_dataset(connector, host, secret_key, target_dsid, geo_csv)
-            self.log_info(resource, "triggering geostreams extractor on %s" % geoid)
-            submit_extraction(connector, host, secret_key, geoid, "terra.geostreams")
+            upload_netcdf(out_fullday_netcdf)
+        # The CSV, or its shards and their index
+        for path in (geo_output_files(geo_output) if not found_csv else new_geo_files):
+            uploads.append(self.start_upload(connector, host, secret_key, target_dsid, path, resource))
+
+        # Late files were inserted into the full-day netCDF and CSV (or the _geo_index.json of its shards) of the day,
+        # so the dataset's copies are replaced by new ones; only the rows of the late files go to geostreams
+        replaced = {}
+        if new_geo_files:
+            for path, file_id in ((out_fullday_netcdf, found_full), (geo_output, found_csv)):
+                if file_id:
+                    replaced[path] = file_id
+                    uploads.append(self.start_upload(connector, host, secret_key, target_dsid, path, resource))
+        for upload in uploads:
+            try:
+                file_id = upload.result()
+            except Exception:
+                # The cached dataset may be gone, look it up again next time
+                self.clowder_cache.invalidate("dataset", hierarchy)
+                self.clowder_cache.invalidate("files", target_dsid)
+                raise
+            self.clowder_cache.add_file(target_dsid, file_id, os.path.basename(upload.upload.path))
+            self.log_info(resource, "uploaded %s" % upload.upload.summary())
+            # terra.geostreams reads plain CSV files, so shards (.csv.gz) and their index are only uploaded
+            if upload.upload.path not in replaced and upload.upload.path.endswith(".csv"):
+                self.log_info(resource, "triggering geostreams extractor on %s%s" % (
+                    "new rows " if upload.upload.path in new_geo_files else "", file_id))
+                submit_extraction(connector, host, secret_key, file_id, "terra.geostreams")
+        # Only once every replacement is in, so the dataset never lacks the netCDF or CSV of the day
+        for path, file_id in replaced.items():
+            delete_file(connector, host, secret_key, file_id)
+            self.log_info(resource, "replaced older copy %s of %s" % (file_id, os.path.basename(path)))
 
         # Tell Clowder this is completed so subsequent file updates don't daisy-chain
         ext_meta = build_metadata(host, self.extractor_info, resource['id'], {
@@ -155,8 +210,16 @@ class EnvironmentLoggerJSON2NetCDF(TerrarefExtractor):
         }, 'dataset')
         upload_metadata(connector, host, secret_key, resource['id'], ext_meta)
 
+        self.log_info(resource, "clowder lookups: %s" % self.clowder_cache.summary())
         self.end_message(resource)
 
+    def start_upload(self, connector, host, secret_key, dataset_id, path, resource):
+        upload = ChunkedUpload(connector, host, secret_key, dataset_id, path,
+                               chunk_size=int(self.args.uploadchunk * 1024**2), retries=self.args.uploadretries,
+                               log=lambda message: self.log_info(resource, message),
+                               allow_resumable=self.args.resumableuploads)
+        return self.upload_pool.start(upload)
+
 if __name__ == "__main__":
     extractor = EnvironmentLoggerJSON2NetCDF()
-    extractor.start()
+    start_extractor(extractor)
@@ -10,9 +10,13 @@ def gallon2liter(value):
                              Units('liter / second'), inplace=True)
     return 0.0
 
-# Parse CSV file
-def parse_file(filepath, main_coords):
-    results = []
+# Parse CSV file into columns
+# Returns the start times, end times and a dictionary of property columns.
+# Given a watermark.HighWaterMark, rows the stream already has are skipped before they are converted.
+def parse_file_columns(filepath, mark=None):
+    start_times = []
+    end_times = []
+    transport = []
 
     with open(filepath) as csvfile:
         header = []
@@ -29,21 +33,36 @@ def parse_file(filepath, main_coords):
 
         for row in reader:
             try:
-                start_time = datetime.datetime.strptime(row['Date Time'], '%m/%d/%Y %H:%M').isoformat() + utc_offset.tzname(None)
-                end_time = (datetime.datetime.strptime(row['Date Time'], '%m/%d/%Y %H:%M')+datetime.timedelta(0,0,0,0,59,23)).isoformat() + utc_offset.tzname(None)
+                row_time = datetime.datetime.strptime(row['Date Time'], '%m/%d/%Y %H:%M')
             except:
                 continue
 
             if 'Actual' in row and row['Actual'] != '':
-                results.append({
-                    'start_time': start_time,
-                    'end_time': end_time,
-                    'properties' : {'irrigation_transport':gallon2liter(row['Actual'])},
-                    'type': 'Feature',
-                    'geometry': {
-                        'type': 'Point',
-                        'coordinates': main_coords
-                    }
-                })
-
-        return results
+                if mark is not None and not mark.accept(row_time, row['Actual']):
+                    continue
+                start_time = row_time.isoformat() + utc_offset.tzname(None)
+                end_time = (row_time+datetime.timedelta(0,0,0,0,59,23)).isoformat() + utc_offset.tzname(None)
+                start_times.append(start_time)
+                end_times.append(end_time)
+                transport.append(gallon2liter(row['Actual']))
+
+    return start_times, end_times, {'irrigation_transport': transport}
+
+# Parse CSV file
+def parse_file(filepath, main_coords):
+    start_times, end_times, columns = parse_file_columns(filepath)
+
+    results = []
+    for index in range(len(start_times)):
+        results.append({
+            'start_time': start_times[index],
+            'end_time': end_times[index],
+            'properties' : {'irrigation_transport': columns['irrigation_transport'][index]},
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': main_coords
+            }
+        })
+
+    return results
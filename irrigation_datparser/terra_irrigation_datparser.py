@@ -1,21 +1,35 @@
 #!/usr/bin/env python
 
+import datetime
 import logging
 import os
 
 from pyclowder.utils import CheckMessage
 from pyclowder.files import upload_metadata
 from terrautils.extractors import TerrarefExtractor, build_metadata
-from terrautils.geostreams import create_datapoints, create_sensor, create_stream, \
-    get_stream_by_name, get_sensor_by_name
+from terrautils.geostreams import create_sensor, create_stream, get_stream_by_name, get_sensor_by_name
 
 from parser import *
+from datapoints import DatapointEncoder, post_datapoints, add_batch_arguments, batch_policy_from_args
+from profiling import add_profiling_arguments, profile_messages
+from concurrency import add_concurrency_arguments, pool_messages, start_extractor
+from watermark import HighWaterMark, stream_lock
 
 
+logger = logging.getLogger(__name__)
+
 def add_local_arguments(parser):
     # add any additional arguments to parser
-    parser.add_argument('--batchsize', type=int, default=3000,
-                        help="max number of datapoints to submit at a time")
+    parser.add_argument('--statedir', type=str, default=os.environ.get('IRRIGATION_STATE_DIR', None),
+                        help="directory to keep the high-water mark of each stream in (required); it must be on "
+                             "persistent storage, e.g. a volume mounted into the container, or every row is posted again")
+    parser.add_argument('--markwindow', type=float, default=float(os.environ.get('IRRIGATION_MARK_WINDOW', 24)),
+                        help="hours before the high-water mark in which rows are checked against those posted, instead of skipped")
+    parser.add_argument('--ignoremark', action='store_true',
+                        help="post every row of each file, as if nothing was posted before")
+    add_batch_arguments(parser)
+    add_profiling_arguments(parser)
+    add_concurrency_arguments(parser)
 
 class IrrigationFileParser(TerrarefExtractor):
     def __init__(self):
@@ -26,7 +40,18 @@ class IrrigationFileParser(TerrarefExtractor):
 
         self.setup(sensor='irrigation_datparser')
 
-        self.batchsize = self.args.batchsize
+        self.gzip = self.args.gzip
+
+        # Without a kept high-water mark, every row of every file would be posted again after a restart
+        if not self.args.statedir:
+            raise ValueError("A state directory on persistent storage is needed for the high-water marks "
+                             "(--statedir or IRRIGATION_STATE_DIR).")
+
+        # profile each message if asked to
+        profile_messages(self)
+
+        # process several messages at a time if asked to
+        pool_messages(self)
 
     def check_message(self, connector, host, secret_key, resource, parameters):
         # TODO: Eventually make this more robust by checking contents
@@ -65,34 +90,38 @@ class IrrigationFileParser(TerrarefExtractor):
         else:
             stream_id = stream_data['id']
 
-        # Process records in file
-        records = parse_file(resource["local_paths"][0], main_coords)
-        total_dp = 0
-        datapoint_list = []
-        for record in records:
-            record['properties']['source_file'] = resource['id']
-            datapoint_list.append({
-                "start_time": record['start_time'],
-                "end_time": record['end_time'],
-                "type": "Point",
-                "geometry": record['geometry'],
-                "properties": record['properties']
-            })
-            if len(datapoint_list) > self.batchsize:
-                create_datapoints(connector, host, secret_key, stream_id, datapoint_list)
-                total_dp += len(datapoint_list)
-                datapoint_list = []
-        if len(datapoint_list) > 0:
-            create_datapoints(connector, host, secret_key, stream_id, datapoint_list)
-            total_dp += len(datapoint_list)
+        # Process records in file, skipping those the stream already has. Messages (one per dataset) run
+        # concurrently, but take turns at the mark of their stream until it is moved
+        with stream_lock(self.args.statedir, stream_id):
+            mark = HighWaterMark.for_stream(self.args.statedir, stream_id, datetime.timedelta(hours=self.args.markwindow))
+            if self.args.ignoremark:
+                mark.reset()
+            elif not mark.found:
+                message = "WARNING: no high-water mark at %s, posting every row; unless this is the first file of the " \
+                          "stream, the state directory is not on persistent storage" % mark.path
+                logger.warning(message)
+                self.log_info(resource, message)
+            start_times, end_times, columns = parse_file_columns(resource["local_paths"][0], mark)
+            self.log_info(resource, "high-water mark: %s" % mark.summary())
+            encoder = DatapointEncoder(stream_id, geom, compress=self.gzip)
+            encoder.set_constants([('source_file', resource['id'])])
+            encoder.add_columns(start_times, end_times, columns)
+            batch_policy = batch_policy_from_args(self.args)
+            total_dp = post_datapoints(connector, host, secret_key, encoder, batch_policy)
+            self.log_info(resource, "geostreams: %s" % batch_policy.summary())
+
+            # Only move the mark once the rows are posted
+            mark.commit()
+            mark.save()
 
         # Mark dataset as processed
         metadata = build_metadata(host, self.extractor_info, resource['id'], {
-            "datapoints_created": len(records)}, 'file')
+            "datapoints_created": total_dp,
+            "rows_skipped": mark.skipped}, 'file')
         upload_metadata(connector, host, secret_key, resource['id'], metadata)
 
         self.end_message(resource)
 
 if __name__ == "__main__":
     extractor = IrrigationFileParser()
-    extractor.start()
+    start_extractor(extractor)
@@ -0,0 +1,138 @@
+'''
+watermark.py
+
+The high-water mark of a geostreams stream: the latest time posted to it, plus a
+compact index of the (time, value) rows posted in the boundary window before that
+time. Flowmeter exports overlap heavily with earlier ones, so rows up to the mark
+are skipped while parsing, and only the rows of the boundary window are checked
+against the index (a row there is posted only if it was not posted before, e.g.
+the revised total of the last day of an earlier export).
+
+The state of each stream is a small JSON file, <state directory>/<stream id>.json:
+
+  {"mark": "2017-06-01T00:00:00", "boundary": {"2017-06-01T00:00:00": ["<hash>", ...]}}
+
+Messages for the same stream hold its stream_lock from loading the mark until it is
+saved, so they do not accept the same rows or overwrite each other's mark.
+'''
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+
+_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Lock of each state file, by path
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def stream_lock(directory, stream_id):
+    '''
+    Return the lock of the high-water mark of a stream in this process
+    '''
+    path = os.path.abspath(os.path.join(directory, "%s.json" % stream_id))
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def row_hash(when, value):
+    '''
+    Return the 64-bit hash (as hex) of a row time and its raw value
+    '''
+    return hashlib.sha1("%s|%s" % (when.strftime(_TIME_FORMAT), value.strip())).hexdigest()[:16]
+
+
+class HighWaterMark(object):
+    '''
+    Decides which rows of a file are new to a stream while it is parsed (see accept),
+    and moves the mark past them once they are posted (see commit).
+    '''
+
+    def __init__(self, path, window=datetime.timedelta(0)):
+        self.path = path
+        self.window = window
+        self.mark = None
+        self.boundary = {}
+        # Rows accepted since the last commit, as (time, hash)
+        self.pending = []
+        # Instrumentation: rows skipped at or before the mark
+        self.skipped = 0
+        # Whether the state was saved before (else every row is accepted)
+        self.found = os.path.exists(path)
+
+        if self.found:
+            with open(path, 'r') as state_file:
+                state = json.load(state_file)
+            if state.get("mark"):
+                self.mark = datetime.datetime.strptime(state["mark"], _TIME_FORMAT)
+            self.boundary = dict((datetime.datetime.strptime(when, _TIME_FORMAT), set(hashes))
+                                 for when, hashes in state.get("boundary", {}).items())
+
+    @classmethod
+    def for_stream(cls, directory, stream_id, window=datetime.timedelta(0)):
+        return cls(os.path.join(directory, "%s.json" % stream_id), window)
+
+    def reset(self):
+        '''
+        Forget what was posted, so every row is accepted
+        '''
+        self.mark = None
+        self.boundary = {}
+
+    def accept(self, when, value):
+        '''
+        Whether the row (time, raw value) is new to the stream; new rows are remembered until commit
+        '''
+        if self.mark is not None and when <= self.mark:
+            if when < self.mark - self.window:
+                self.skipped += 1
+                return False
+            digest = row_hash(when, value)
+            if digest in self.boundary.get(when, ()):
+                self.skipped += 1
+                return False
+        else:
+            digest = row_hash(when, value)
+
+        self.pending.append((when, digest))
+        return True
+
+    def commit(self):
+        '''
+        Move the mark past the rows accepted since the last commit, once they are posted,
+        and keep only the hashes of the rows in the boundary window before it
+        '''
+        for when, digest in self.pending:
+            self.boundary.setdefault(when, set()).add(digest)
+            if self.mark is None or when > self.mark:
+                self.mark = when
+        self.pending = []
+
+        if self.mark is not None:
+            self.boundary = dict((when, hashes) for when, hashes in self.boundary.items()
+                                 if when >= self.mark - self.window)
+
+    def save(self):
+        '''
+        Write the state next to its file and rename it, so an interrupted write leaves the previous state
+        '''
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, 'w') as state_file:
+            json.dump({"mark": self.mark.strftime(_TIME_FORMAT) if self.mark else None,
+                       "boundary": dict((when.strftime(_TIME_FORMAT), sorted(hashes))
+                                        for when, hashes in self.boundary.items())}, state_file)
+        os.rename(temporary_path, self.path)
+
+    def summary(self):
+        '''
+        One line describing the mark, for the logs.
+        '''
+        return "%s rows skipped, mark at %s" % (self.skipped, self.mark.strftime(_TIME_FORMAT) if self.mark else "none")
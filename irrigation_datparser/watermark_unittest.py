@@ -0,0 +1,93 @@
+'''
+This is the unit test module for watermark.py.
+It keeps the high-water mark of a stream in a temporary state directory and
+checks which rows of overlapping exports are accepted as new.
+
+To run the unit test, simply use:
+python watermark_unittest.py
+'''
+
+import datetime
+import shutil
+import tempfile
+import unittest
+
+from watermark import HighWaterMark, stream_lock
+
+WINDOW = datetime.timedelta(hours=24)
+
+
+def day(number):
+	return datetime.datetime(2017, 3, number)
+
+
+class watermarkUnitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def post(self, rows):
+		'''
+		Accept rows (time, value) against the saved mark as a message does, then move and save the mark.
+		Returns the rows accepted.
+		'''
+		mark = HighWaterMark.for_stream(self.directory, "1", WINDOW)
+		accepted = [(when, value) for when, value in rows if mark.accept(when, value)]
+		mark.commit()
+		mark.save()
+		return accepted
+
+	def test_canAcceptEveryRowWithoutAMark(self):
+		mark = HighWaterMark.for_stream(self.directory, "1", WINDOW)
+		self.assertFalse(mark.found)
+		self.assertTrue(all(mark.accept(day(number), "10") for number in range(1, 5)))
+		self.assertEqual(mark.skipped, 0)
+
+	def test_canSkipRowsOfOverlappingExports(self):
+		'''
+		Rows before the boundary window are skipped, rows in it only if that (time, value) was posted,
+		so a revised total of the last day is posted again
+		'''
+		self.post([(day(number), "%s0" % number) for number in range(1, 6)])
+		mark = HighWaterMark.for_stream(self.directory, "1", WINDOW)
+		self.assertTrue(mark.found)
+		self.assertEqual(mark.mark, day(5))
+		accepted = [(day(number), value) for number, value in ((3, "30"), (4, "40"), (5, "50"), (5, "55 "), (6, "60"))
+					if mark.accept(day(number), value)]
+		self.assertEqual(accepted, [(day(5), "55 "), (day(6), "60")])
+		self.assertEqual(mark.skipped, 3)
+		# Values are compared stripped
+		self.assertFalse(mark.accept(day(5), " 50"))
+
+	def test_canKeepTheMarkUntilRowsArePosted(self):
+		'''
+		Rows accepted but never committed (e.g. the post failed) are accepted again next time
+		'''
+		self.post([(day(1), "10")])
+		mark = HighWaterMark.for_stream(self.directory, "1", WINDOW)
+		self.assertTrue(mark.accept(day(2), "20"))
+		mark.save()
+		self.assertEqual(self.post([(day(1), "10"), (day(2), "20")]), [(day(2), "20")])
+		self.assertEqual(self.post([(day(1), "10"), (day(2), "20")]), [])
+
+	def test_canForgetHashesBeforeTheWindow(self):
+		self.post([(day(number), "%s0" % number) for number in range(1, 6)])
+		mark = HighWaterMark.for_stream(self.directory, "1", WINDOW)
+		self.assertEqual(sorted(mark.boundary), [day(4), day(5)])
+
+	def test_canResetTheMark(self):
+		self.post([(day(1), "10")])
+		mark = HighWaterMark.for_stream(self.directory, "1", WINDOW)
+		mark.reset()
+		self.assertTrue(mark.accept(day(1), "10"))
+
+	def test_canLockEachStream(self):
+		self.assertTrue(stream_lock(self.directory, "1") is stream_lock(self.directory + "/", "1"))
+		self.assertFalse(stream_lock(self.directory, "1") is stream_lock(self.directory, "2"))
+
+
+if __name__ == "__main__":
+	unittest.main()
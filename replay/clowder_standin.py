@@ -0,0 +1,327 @@
+'''
+clowder_standin.py
+
+A local HTTP stand-in for the parts of the Clowder and geostreams APIs the extractors
+use, so they can be run end to end without a live Clowder: dataset and file metadata,
+dataset file lists, uploads, extraction requests, geostreams sensors and streams, and
+datapoints. Everything is kept in memory.
+
+Every request waits for a configurable latency before it is answered (a fixed time,
+plus a time per datapoint posted and per byte uploaded), and the time spent answering
+is recorded, so a replay can tell how much of its time went to waiting on the server.
+
+Requests for anything else are answered leniently: GETs with an empty list, and other
+methods with a new id, which is enough for the collection and dataset creation calls of
+terrautils.extractors.build_dataset_hierarchy_crawl.
+
+Uploads are received in blocks, never whole. With resumable=True the stand-in also
+offers the tus resumable upload protocol at api/uploads (see
+envlog2netcdf/chunked_upload.py). A failure_rate makes that fraction of the upload
+requests fail, half of them with a 503 and half by dropping the connection halfway
+through the body (keeping what was received, for resumable uploads).
+'''
+
+import base64
+import collections
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import urlparse
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+_FILENAME = re.compile(r'filename="([^"]+)"')
+
+_ROUTES = [
+    ("metadata", re.compile(r"^api/(files|datasets)/([^/]+)/metadata\.jsonld$")),
+    ("file_list", re.compile(r"^api/datasets/([^/]+)/files$")),
+    ("dataset_info", re.compile(r"^api/datasets/([^/]+)$")),
+    ("upload", re.compile(r"^api/uploadToDataset/([^/]+)$")),
+    ("extraction", re.compile(r"^api/files/([^/]+)/extractions$")),
+    ("file", re.compile(r"^api/files/([^/]+)$")),
+    ("sensors", re.compile(r"^api/geostreams/sensors$")),
+    ("streams", re.compile(r"^api/geostreams/streams$")),
+    ("datapoints", re.compile(r"^api/geostreams/datapoints(/bulk)?$")),
+    ("resumable", re.compile(r"^api/uploads(?:/([^/]+))?$")),
+]
+
+# Routes whose request bodies are files
+_UPLOAD_ROUTES = ("upload", "resumable")
+_BLOCK_SIZE = 1024 * 1024
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ClowderStandIn(object):
+    '''
+    Serves the stand-in API on localhost in a background thread (see start and url).
+    '''
+
+    def __init__(self, port=0, latency=0.0, per_datapoint=0.0, bandwidth=None, resumable=False,
+                 failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.per_datapoint = per_datapoint
+        # Bytes per second for request bodies, or None for no limit
+        self.bandwidth = bandwidth
+        self.resumable = resumable
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.metadata = collections.defaultdict(list)
+        self.dataset_files = collections.defaultdict(list)
+        self.sensors = []
+        self.streams = []
+        self.extractions = []
+        # Resumable uploads by id: {"length", "offset", "sha1", "filename", "dataset"}
+        self.uploads = {}
+
+        # Instrumentation: requests by route, failures injected, datapoints posted, body bytes
+        # received and seconds spent answering (including the simulated latency)
+        self.requests = collections.Counter()
+        self.failures = 0
+        self.datapoints = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+        self._server = _Server(("127.0.0.1", port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%s/" % self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="clowder-standin")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def new_id(self):
+        with self._lock:
+            return "%024x" % next(self._ids)
+
+    def snapshot(self):
+        '''
+        Return the instrumentation so far, to subtract from a later snapshot
+        '''
+        with self._lock:
+            return {"requests": sum(self.requests.values()), "routes": dict(self.requests),
+                    "datapoints": self.datapoints, "bytes": self.bytes, "seconds": self.seconds}
+
+    def route(self, method, path):
+        '''
+        Return the route of a request and the match of its path
+        '''
+        for route, pattern in _ROUTES:
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            return "other", None
+        if route in ("file_list", "dataset_info") and method != "GET":
+            # e.g. POST api/datasets/createempty
+            return "other", None
+        if route == "resumable" and not self.resumable:
+            return "other", None
+        return route, match
+
+    def failure(self):
+        '''
+        Decide whether to fail an upload request: None, "error" (a 503) or "drop" (a dropped connection)
+        '''
+        with self._lock:
+            if self.failure_rate <= 0 or self._random.random() >= self.failure_rate:
+                return None
+            self.failures += 1
+            return self._random.choice(("error", "drop"))
+
+    def receive(self, method, route, match, stream, length, failure):
+        '''
+        Read the body of an upload request in blocks, stopping halfway for a dropped connection.
+        Returns (the first block, the number of bytes read)
+        '''
+        upload = self.uploads.get(match.group(1)) if route == "resumable" and method == "PATCH" else None
+        limit = length // 2 if failure == "drop" else length
+        first, received = "", 0
+        while received < limit:
+            block = stream.read(min(_BLOCK_SIZE, limit - received))
+            if not block:
+                break
+            if not first:
+                first = block[:4096]
+            if upload is not None and failure != "error":
+                upload["sha1"].update(block)
+                upload["offset"] += len(block)
+            received += len(block)
+        return first, received
+
+    def answer(self, method, route, match, query, body, headers, length):
+        '''
+        Return (status, response, headers, delay) for a request, where response is encoded as JSON
+        (unless it is None) and delay is the simulated latency in seconds
+        '''
+        datapoints = 0
+        response_headers = {}
+        status = 200
+        if route == "metadata":
+            key = match.group(2)
+            if method == "GET":
+                response = self.metadata[key]
+            elif method == "POST":
+                self.metadata[key].append(json.loads(body))
+                response = {"status": "ok"}
+            else:
+                extractor = query.get("extractor")
+                self.metadata[key] = [entry for entry in self.metadata[key] if extractor and
+                                      not entry.get("agent", {}).get("name", "").endswith(extractor)]
+                response = []
+        elif route == "file_list":
+            response = self.dataset_files[match.group(1)]
+        elif route == "dataset_info":
+            response = {"id": match.group(1), "name": match.group(1), "files": len(self.dataset_files[match.group(1)])}
+        elif route == "upload":
+            filename = _FILENAME.search(body)
+            response = {"id": self.new_id()}
+            self.dataset_files[match.group(1)].append({"id": response["id"],
+                                                       "filename": filename.group(1) if filename else response["id"],
+                                                       "size": length})
+        elif route == "resumable":
+            status, response, response_headers = self._answer_resumable(method, match, headers)
+        elif route == "file" and method == "DELETE":
+            for files in self.dataset_files.values():
+                files[:] = [entry for entry in files if entry["id"] != match.group(1)]
+            response = {"status": "success"}
+        elif route == "extraction":
+            self.extractions.append((match.group(1), json.loads(body).get("extractor") if body else None))
+            response = {"status": "OK"}
+        elif route in ("sensors", "streams"):
+            entries = self.sensors if route == "sensors" else self.streams
+            if method == "GET":
+                name = query.get("sensor_name" if route == "sensors" else "stream_name")
+                response = [entry for entry in entries if name is None or entry.get("name") == name]
+            else:
+                entry = json.loads(body)
+                entry["id"] = len(entries) + 1
+                entries.append(entry)
+                response = {"id": entry["id"]}
+        elif route == "datapoints":
+            if headers.get("Content-Encoding") == "gzip":
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            posted = json.loads(body)
+            datapoints = len(posted) if isinstance(posted, list) else 1
+            response = {"status": "ok", "count": datapoints}
+        else:
+            response = [] if method == "GET" else {"id": self.new_id()}
+
+        with self._lock:
+            self.datapoints += datapoints
+        return status, response, response_headers, self.latency + self.per_datapoint * datapoints + \
+            (length / float(self.bandwidth) if self.bandwidth else 0.0)
+
+    def _answer_resumable(self, method, match, headers):
+        tus = {"Tus-Resumable": "1.0.0"}
+        if method == "OPTIONS":
+            return 204, None, dict(tus, **{"Tus-Version": "1.0.0"})
+        if method == "POST":
+            metadata = dict(item.split(" ", 1) for item in headers.get("Upload-Metadata", "").split(",") if " " in item)
+            upload_id = self.new_id()
+            self.uploads[upload_id] = {"length": int(headers["Upload-Length"]), "offset": 0, "sha1": hashlib.sha1(),
+                                       "filename": base64.b64decode(metadata.get("filename", "")),
+                                       "dataset": base64.b64decode(metadata.get("dataset", ""))}
+            return 201, None, dict(tus, Location="/api/uploads/%s" % upload_id)
+
+        upload = self.uploads.get(match.group(1))
+        if upload is None:
+            return 404, {"error": "no such upload"}, tus
+        offset_headers = dict(tus, **{"Upload-Offset": str(upload["offset"]), "Upload-Length": str(upload["length"])})
+        if method == "HEAD":
+            return 200, None, offset_headers
+        # PATCH, whose body receive already added
+        if upload["offset"] < upload["length"]:
+            return 204, None, offset_headers
+        upload["id"] = self.new_id()
+        self.dataset_files[upload["dataset"]].append({"id": upload["id"], "filename": upload["filename"],
+                                                      "size": upload["length"], "sha1": upload["sha1"].hexdigest()})
+        return 200, {"id": upload["id"]}, offset_headers
+
+    def _handler(self):
+        standin = self
+
+        class StandInHandler(BaseHTTPRequestHandler):
+            # Keep-alive, as Clowder's server does
+            protocol_version = "HTTP/1.1"
+
+            def _answer(self):
+                started = time.time()
+                url = urlparse.urlparse(self.path)
+                query = dict((key, values[-1]) for key, values in urlparse.parse_qs(url.query).items())
+                length = int(self.headers.get("Content-Length") or 0)
+                route, match = standin.route(self.command, url.path.lstrip("/"))
+                with standin._lock:
+                    standin.requests[route] += 1
+
+                failure = None
+                if route in _UPLOAD_ROUTES and length > 0:
+                    failure = standin.failure()
+                    body, received = standin.receive(self.command, route, match, self.rfile, length, failure)
+                else:
+                    body = self.rfile.read(length)
+                    received = len(body)
+
+                if failure == "drop":
+                    # Answer nothing and close the connection, as if the network failed
+                    self.close_connection = 1
+                    status = None
+                elif failure == "error":
+                    status, response, headers, delay = 503, {"error": "injected failure"}, {}, standin.latency
+                else:
+                    try:
+                        status, response, headers, delay = standin.answer(self.command, route, match, query, body,
+                                                                          self.headers, length)
+                    except ValueError as error:
+                        status, response, headers, delay = 400, {"error": str(error)}, {}, standin.latency
+
+                if status is not None:
+                    time.sleep(delay)
+                    encoded = "" if response is None else json.dumps(response)
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    if response is not None:
+                        self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(encoded)))
+                    self.end_headers()
+                    if self.command != "HEAD":
+                        self.wfile.write(encoded)
+                with standin._lock:
+                    standin.bytes += received
+                    standin.seconds += time.time() - started
+
+            do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = do_HEAD = do_OPTIONS = _answer
+
+            def log_message(self, format, *args):
+                pass
+
+        return StandInHandler
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+'''
+replay.py
+
+----------------------------------------------------------------------------------------
+Replays dataset and file messages through the extractors in-process, against a local
+stand-in for Clowder and geostreams (see clowder_standin.py), to measure their
+throughput end to end without a live Clowder, RabbitMQ or geostreams.
+----------------------------------------------------------------------------------------
+
+Usage:
+
+python replay.py --synthetic weather:/data/weather/2017-06-01 envlog:/data/EnvironmentLogger/2017-06-01 \
+                 irrigation:/data/flowmetertotals_March-2017.csv energyfarm:"/data/WeatherNE_Avg15.dat" \
+                 --latency 0.05 --perdatapoint 0.0001 --repeat 3
+python replay.py --messages recorded.jsonl --latency 0.2 -- --output /tmp/replay_sites
+
+where a synthetic message is built for each extractor:path pair (a dataset of the files
+of a directory, or a single file), and a recorded message file holds one JSON object per
+line, {"extractor": "weather", "resource": {...}, "parameters": {...}}, with the resource
+as given to process_message (including its local paths). Arguments after -- are passed
+on to the extractors.
+
+Each message is run through check_message and, if it asks for the files, process_message.
+The time of each message is split between the simulated server (the time the stand-in
+spent answering, including its latency) and the client (everything else), and the run
+is summarized in messages/s and datapoints/s. With --workers N, N messages are replayed
+at a time through the extractors' own message pool (see concurrency.py), and the split is
+only given for the whole run.
+----------------------------------------------------------------------------------------
+'''
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from clowder_standin import ClowderStandIn
+
+
+_REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# extractor -> (directory, module, class)
+EXTRACTORS = {
+    "weather": ("weather_datparser", "terra_weather_datparser", "MetDATFileParser"),
+    "energyfarm": ("energyfarm_datparser", "terra_energyfarm_datparser", "MetDATFileParser"),
+    "irrigation": ("irrigation_datparser", "terra_irrigation_datparser", "IrrigationFileParser"),
+    "envlog": ("envlog2netcdf", "terra_envlog2netcdf", "EnvironmentLoggerJSON2NetCDF"),
+}
+
+
+class ReplayConnector(object):
+    '''
+    Takes the place of the pyclowder connector passed to check_message and process_message
+    '''
+    ssl_verify = True
+    # Nothing is on a file system shared with the stand-in, so every output is sent
+    mounted_paths = {}
+
+    def __init__(self):
+        self.updates = []
+
+    def status_update(self, *args, **kwargs):
+        self.updates.append(args)
+
+
+def load_extractor(name, arguments):
+    '''
+    Import an extractor from its directory and create it with the given command line arguments.
+    The extractors share module names (parser, datapoints, profiling), so the modules of the
+    previously loaded extractor are forgotten first; its instance keeps its own.
+    '''
+    directory, module_name, class_name = EXTRACTORS[name]
+    directory = os.path.join(_REPOSITORY, directory)
+    for local_module in [f[:-3] for f in os.listdir(directory) if f.endswith(".py")]:
+        sys.modules.pop(local_module, None)
+
+    previous = (list(sys.argv), os.getcwd())
+    sys.path.insert(0, directory)
+    try:
+        # pyclowder reads extractor_info.json from the working directory
+        os.chdir(directory)
+        sys.argv = [os.path.join(directory, module_name + ".py")] + list(arguments)
+        module = importlib.import_module(module_name)
+        return getattr(module, class_name)()
+    finally:
+        sys.argv, working_directory = previous
+        os.chdir(working_directory)
+        sys.path.remove(directory)
+
+
+def synthetic_message(name, path, standin):
+    '''
+    Build the message of an extractor for a local directory (a dataset of its files) or file
+    '''
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        files = []
+        for filename in sorted(os.listdir(path)):
+            if os.path.isfile(os.path.join(path, filename)):
+                files.append({"id": standin.new_id(), "filename": filename,
+                              "filepath": os.path.join(path, filename)})
+        # Dataset names end with the date, e.g. "EnvironmentLogger netCDFs - 2017-06-01"
+        resource = {"type": "dataset", "id": standin.new_id(),
+                    "name": "%s - %s" % (name, os.path.basename(path)),
+                    "files": files, "local_paths": [f["filepath"] for f in files]}
+    else:
+        resource = {"type": "file", "id": standin.new_id(), "name": os.path.basename(path),
+                    "local_paths": [path]}
+    return {"extractor": name, "resource": resource, "parameters": {}}
+
+
+def replay_message(extractor, connector, host, key, message, standin, concurrent=False):
+    '''
+    Run one message through an extractor. Returns its report, as
+    {"extractor", "resource", "status", "seconds", "server_seconds", "client_seconds", "requests", "datapoints"},
+    where the stand-in counts are left out (None) if other messages run at the same time
+    '''
+    from pyclowder.utils import CheckMessage
+
+    resource, parameters = message["resource"], message.get("parameters", {})
+    before = standin.snapshot()
+    started = time.time()
+    try:
+        check = extractor.check_message(connector, host, key, resource, parameters)
+        if check in (CheckMessage.download, CheckMessage.bypass):
+            extractor.process_message(connector, host, key, resource, parameters)
+            status = "processed"
+        else:
+            status = "ignored"
+    except Exception as error:
+        status = "failed: %s: %s" % (type(error).__name__, error)
+        traceback.print_exc()
+    seconds = time.time() - started
+    after = standin.snapshot()
+
+    report = {"extractor": message["extractor"], "resource": resource.get("name", resource["id"]),
+              "status": status, "seconds": seconds,
+              "server_seconds": None, "client_seconds": None, "requests": None, "datapoints": None}
+    if not concurrent:
+        server_seconds = after["seconds"] - before["seconds"]
+        report.update(server_seconds=server_seconds, client_seconds=max(seconds - server_seconds, 0.0),
+                      requests=after["requests"] - before["requests"],
+                      datapoints=after["datapoints"] - before["datapoints"])
+    return report
+
+
+def summarize(reports, seconds, standin, totals):
+    '''
+    Describe a replay run: throughput, and the split of its time between client and server,
+    where totals is the difference between the stand-in snapshots after and before the run
+    '''
+    processed = [report for report in reports if report["status"] == "processed"]
+    # Summed over the messages, so with several workers the time can exceed the run's
+    server = totals["seconds"]
+    client = max(sum(report["seconds"] for report in reports) - server, 0.0)
+    datapoints = totals["datapoints"]
+    lines = ["%s messages (%s processed, %s failed) in %.2fs: %.2f messages/s, %s datapoints, %.1f datapoints/s" % (
+                 len(reports), len(processed), len([r for r in reports if r["status"].startswith("failed")]),
+                 seconds, len(reports) / max(seconds, 1e-6), datapoints, datapoints / max(seconds, 1e-6)),
+             "time split: client %.2fs (%.0f%%), server wait %.2fs (%.0f%%)" % (
+                 client, 100.0 * client / max(client + server, 1e-6), server, 100.0 * server / max(client + server, 1e-6)),
+             "requests: %s" % ", ".join("%s %s" % (route, count) for route, count in sorted(standin.requests.items()))]
+
+    if any(report["server_seconds"] is None for report in reports):
+        return "\n".join(lines)
+    for name in sorted(set(report["extractor"] for report in reports)):
+        own = [report for report in reports if report["extractor"] == name]
+        own_seconds = sum(report["seconds"] for report in own)
+        lines.append("  %-10s %s messages, %.2f messages/s, %.1f datapoints/s, client %.2fs, server wait %.2fs" % (
+            name, len(own), len(own) / max(own_seconds, 1e-6),
+            sum(report["datapoints"] for report in own) / max(own_seconds, 1e-6),
+            sum(report["client_seconds"] for report in own), sum(report["server_seconds"] for report in own)))
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+
+    if "--" in sys.argv:
+        split = sys.argv.index("--")
+        replay_arguments, extractor_arguments = sys.argv[1:split], sys.argv[split + 1:]
+    else:
+        replay_arguments, extractor_arguments = sys.argv[1:], []
+
+    parser = argparse.ArgumentParser(description="Replay messages through the extractors against a local Clowder stand-in")
+    parser.add_argument('--messages', type=str, default=None,
+                        help='A file of recorded messages, one JSON object per line')
+    parser.add_argument('--synthetic', type=str, nargs='*', default=[], metavar="EXTRACTOR:PATH",
+                        help='Build a message for each extractor (%s) and directory or file' % ", ".join(sorted(EXTRACTORS)))
+    parser.add_argument('--workers', type=int, default=1,
+                        help='The number of messages to replay at a time (also passed on to the extractors)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='The number of times to replay the messages')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='The seconds the stand-in waits before answering each request')
+    parser.add_argument('--perdatapoint', type=float, default=0.0,
+                        help='The seconds the stand-in waits for each datapoint posted')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='The MB/s the stand-in receives request bodies at (no limit by default)')
+    parser.add_argument('--resumable', action='store_true',
+                        help='Offer resumable (tus) uploads, which the envlog extractor uses when given --resumableuploads')
+    parser.add_argument('--failures', type=float, default=0.0,
+                        help='The fraction of upload requests the stand-in fails')
+    parser.add_argument('--port', type=int, default=0,
+                        help='The port of the stand-in (any free port by default)')
+    parser.add_argument('--key', type=str, default="replay",
+                        help='The Clowder key passed to the extractors')
+    parser.add_argument('--report', type=str, default=None,
+                        help='A file to write the report of each message to, as JSON lines')
+    args = parser.parse_args(replay_arguments)
+
+    with ClowderStandIn(args.port, args.latency, args.perdatapoint,
+                        args.bandwidth * 1024**2 if args.bandwidth else None,
+                        resumable=args.resumable, failure_rate=args.failures) as standin:
+        messages = []
+        if args.messages:
+            with open(args.messages, 'r') as recorded:
+                messages.extend(json.loads(line) for line in recorded if line.strip())
+        for synthetic in args.synthetic:
+            name, path = synthetic.split(":", 1)
+            messages.append(synthetic_message(name, path, standin))
+        if not messages:
+            parser.error("no messages to replay (use --messages or --synthetic)")
+
+        if args.workers > 1:
+            extractor_arguments = ["--workers", str(args.workers)] + extractor_arguments
+        # The irrigation extractor needs a directory for its high-water marks; a replay starts without any
+        os.environ.setdefault("IRRIGATION_STATE_DIR", tempfile.mkdtemp(prefix="replay_irrigation_state_"))
+        extractors = {}
+        for name in sorted(set(message["extractor"] for message in messages)):
+            extractors[name] = load_extractor(name, extractor_arguments)
+
+        connector = ReplayConnector()
+        concurrent = args.workers > 1
+
+        def replay(message):
+            report = replay_message(extractors[message["extractor"]], connector, standin.url, args.key,
+                                    message, standin, concurrent)
+            if concurrent:
+                sys.stderr.write("%-10s %s %s in %.2fs\n" % (
+                    report["extractor"], report["resource"], report["status"], report["seconds"]))
+            else:
+                sys.stderr.write("%-10s %s %s in %.2fs (client %.2fs, server wait %.2fs, %s requests, %s datapoints)\n" % (
+                    report["extractor"], report["resource"], report["status"], report["seconds"],
+                    report["client_seconds"], report["server_seconds"], report["requests"], report["datapoints"]))
+            return report
+
+        before = standin.snapshot()
+        started = time.time()
+        if concurrent:
+            pool = ThreadPool(args.workers)
+            reports = pool.map(replay, messages * args.repeat, chunksize=1)
+            pool.close()
+            pool.join()
+        else:
+            reports = [replay(message) for message in messages * args.repeat]
+        seconds = time.time() - started
+        after = standin.snapshot()
+        totals = {"seconds": after["seconds"] - before["seconds"], "datapoints": after["datapoints"] - before["datapoints"]}
+
+        if args.report:
+            with open(args.report, 'w') as report_file:
+                for report in reports:
+                    report_file.write(json.dumps(report) + "\n")
+        print summarize(reports, seconds, standin, totals)
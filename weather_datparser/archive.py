@@ -0,0 +1,343 @@
+'''
+archive.py
+
+A columnar archive of the parsed, unit-converted weather station records, one file per
+(local) day, so a new aggregation (a new cutoff, a new statistic) can run straight from
+the archives instead of parsing every raw TOA5 file again.
+
+Each file holds a JSON header and one column per variable, as raw little-endian arrays
+read through a memory map:
+
+  <archive directory>/<YYYY-MM-DD>_weather.cols
+    "WXCOLS01"                           -> magic
+    header length (uint64)
+    {"day", "utc_offset", "records", "columns": [{"name", "dtype", "units", "offset"}, ...]}
+    time (<i8, seconds since 1970-01-01, strictly increasing)
+    <property> (<f8, NaN where a record does not have the property), for each property
+
+The extractor writes the archives of the days it parses with --archivedir; records of a
+day already archived replace those with the same time. The archives can also be built
+from the raw_data tree, and aggregated, from the command line:
+
+python archive.py build /projects/arpae/terraref/sites/ua-mac/raw_data/weather ~/weather_archive --start 2017-04-01
+python archive.py aggregate ~/weather_archive packages.jsonl --start 2017-04-01 --end 2017-04-30 --aggregation 300 \
+    --rollups 3600 86400 --statistics min max
+
+where each aggregated package is written as one JSON object per line, with the bin size
+of its stream as "cutoff".
+'''
+
+import argparse
+import array
+import datetime
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+import dateutil.tz
+
+from parser import PROP_UNITS, STATISTICS, aggregateTimed, checkRollupCutoffs, merge_files, rollup
+
+
+MAGIC = b"WXCOLS01"
+
+# Weather station local time, which archive days follow
+STATION_TZ = dateutil.tz.tzoffset("-07:00", -7 * 60 * 60)
+
+_SUFFIX = "_weather.cols"
+
+# array typecode of each column dtype; time is float64 where C longs are not 64 bits
+_TYPECODES = {"<f8": 'd'}
+if array.array('l').itemsize == 8:
+    _TYPECODES["<i8"] = 'l'
+_TIME_DTYPE = "<i8" if "<i8" in _TYPECODES else "<f8"
+
+
+def archive_path(directory, day):
+    return os.path.join(directory, day + _SUFFIX)
+
+def archive_days(directory, start=None, end=None):
+    '''
+    Return the days (YYYY-MM-DD) archived in directory between start and end (inclusive), in order
+    '''
+    days = [name[:-len(_SUFFIX)] for name in os.listdir(directory) if name.endswith(_SUFFIX)]
+    return sorted(day for day in days if (not start or day >= start) and (not end or day <= end))
+
+
+class Archive(object):
+    '''
+    An archive file, memory mapped; columns are read as arrays
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as archive_file:
+            self._map = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError("%s is not a weather archive" % path)
+        length, = struct.unpack("<Q", self._map[len(MAGIC):len(MAGIC) + 8])
+        self.header = json.loads(self._map[len(MAGIC) + 8:len(MAGIC) + 8 + length])
+        self.records = self.header["records"]
+        self.columns = dict((column["name"], column) for column in self.header["columns"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def properties(self):
+        return [column["name"] for column in self.header["columns"] if column["name"] != "time"]
+
+    def column(self, name, first=0, last=None):
+        '''
+        Return the values of a column for records first to last (exclusive)
+        '''
+        column = self.columns[name]
+        last = self.records if last is None else last
+        values = array.array(_TYPECODES[column["dtype"]])
+        offset = column["offset"] + first * values.itemsize
+        values.fromstring(self._map[offset:offset + (last - first) * values.itemsize])
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values
+
+    def timed_records(self, start=None, end=None):
+        '''
+        Return the records between start and end (seconds since 1970-01-01, end exclusive) as
+        (startTime, endTime, properties) tuples, as taken by parser.aggregateTimed
+        '''
+        times = self.column("time")
+        first = 0 if start is None else _bisect(times, start)
+        last = len(times) if end is None else _bisect(times, end)
+        names = self.properties()
+        columns = [self.column(name, first, last) for name in names]
+        records = []
+        for index in range(last - first):
+            properties = {}
+            for name, values in zip(names, columns):
+                if not math.isnan(values[index]):
+                    properties[name] = values[index]
+            records.append((times[first + index], times[first + index], properties))
+        return records
+
+
+def write_archive(path, day, times, columns):
+    '''
+    Write an archive from times (seconds since 1970-01-01, strictly increasing) and columns,
+    a dict of property name -> values (NaN where missing)
+    '''
+    names = sorted(columns)
+    header = {"day": day, "utc_offset": int(STATION_TZ.utcoffset(None).total_seconds()), "records": len(times),
+              "columns": [{"name": "time", "dtype": _TIME_DTYPE, "units": "seconds since 1970-01-01 00:00:00 UTC"}] +
+                         [{"name": name, "dtype": "<f8", "units": PROP_UNITS.get(name, "")} for name in names]}
+    # The columns start after the header, aligned to 8 bytes (the header holds their offsets, so
+    # find where it ends once they are in it)
+    start = 0
+    while True:
+        for index, column in enumerate(header["columns"]):
+            column["offset"] = start + index * 8 * len(times)
+        encoded = json.dumps(header)
+        end = len(MAGIC) + 8 + len(encoded)
+        end += -end % 8
+        if end == start:
+            break
+        start = end
+    encoded += " " * (start - len(MAGIC) - 8 - len(encoded))
+
+    descriptor, temporary_path = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path) or ".")
+    with os.fdopen(descriptor, 'wb') as archive_file:
+        archive_file.write(MAGIC + struct.pack("<Q", len(encoded)) + encoded)
+        for column in header["columns"]:
+            values = array.array(_TYPECODES[column["dtype"]], times if column["name"] == "time" else columns[column["name"]])
+            if sys.byteorder != "little":
+                values.byteswap()
+            values.tofile(archive_file)
+    os.chmod(temporary_path, 0o644)
+    os.rename(temporary_path, path)
+
+
+class ArchiveWriter(object):
+    '''
+    Collects parsed records (fed in time order, e.g. from parser.merge_files) into the archive of their day
+    in directory, writing each day's archive when the records move on to the next day, and the last on close
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._offset = int(STATION_TZ.utcoffset(None).total_seconds())
+        self._day = None
+        self._times = array.array(_TYPECODES[_TIME_DTYPE])
+        self._columns = {}
+        # Instrumentation: records and days archived
+        self.records = 0
+        self.written = []
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def add(self, timestamp, record):
+        day = (timestamp + self._offset) // 86400
+        if day != self._day:
+            self._flush()
+            self._day = day
+        index = len(self._times)
+        self._times.append(timestamp)
+        for name, value in record['properties'].items():
+            if name.startswith('_'):
+                continue
+            if name not in self._columns:
+                self._columns[name] = array.array('d', [float('nan')]) * index
+            self._columns[name].append(value)
+        for values in self._columns.values():
+            if len(values) == index:
+                values.append(float('nan'))
+        self.records += 1
+
+    def close(self):
+        '''
+        Write the archive of the last day, returning the paths of the archives written
+        '''
+        self._flush()
+        return self.written
+
+    def summary(self):
+        '''
+        One line describing what was archived, for the logs.
+        '''
+        return "%s records in %s days (%s)" % (self.records, len(self.written),
+                                               ", ".join(os.path.basename(path) for path in self.written))
+
+    def _flush(self):
+        if not len(self._times):
+            return
+        day = datetime.datetime.utcfromtimestamp(self._day * 86400).strftime("%Y-%m-%d")
+        path = archive_path(self.directory, day)
+        times, columns = self._times, self._columns
+        if os.path.exists(path):
+            times, columns = _merge(path, times, columns)
+        write_archive(path, day, times, columns)
+        self.written.append(path)
+        self._times = array.array(_TYPECODES[_TIME_DTYPE])
+        self._columns = {}
+
+
+def _merge(path, times, columns):
+    '''
+    Merge records with those archived in path; new records replace archived ones with the same time
+    '''
+    with Archive(path) as archive:
+        archived_times = archive.column("time")
+        archived = dict((name, archive.column(name)) for name in archive.properties())
+    new = dict((time, index) for index, time in enumerate(times))
+    kept = [index for index, time in enumerate(archived_times) if time not in new]
+    rows = sorted([(archived_times[index], False, index) for index in kept] +
+                  [(time, True, index) for index, time in enumerate(times)])
+
+    nan = float('nan')
+    merged_columns = {}
+    for name in set(archived) | set(columns):
+        old, fresh = archived.get(name), columns.get(name)
+        merged_columns[name] = array.array('d', [(fresh[index] if fresh is not None else nan) if is_new else
+                                                 (old[index] if old is not None else nan)
+                                                 for time, is_new, index in rows])
+    return array.array(_TYPECODES[_TIME_DTYPE], [time for time, is_new, index in rows]), merged_columns
+
+def _bisect(times, value):
+    low, high = 0, len(times)
+    while low < high:
+        middle = (low + high) // 2
+        if times[middle] < value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def build_archives(raw_directory, archive_directory, start=None, end=None, prefetch=1):
+    '''
+    Archive the records of the .dat files of each YYYY-MM-DD directory of raw_directory between start and end
+    '''
+    writer = ArchiveWriter(archive_directory)
+    for day in sorted(os.listdir(raw_directory)):
+        if (start and day < start) or (end and day > end) or not os.path.isdir(os.path.join(raw_directory, day)):
+            continue
+        filepaths = sorted(os.path.join(raw_directory, day, name) for name in os.listdir(os.path.join(raw_directory, day))
+                           if name.endswith(".dat"))
+        for timestamp, fileIndex, record in merge_files(filepaths, utc_offset=STATION_TZ, prefetchDepth=prefetch):
+            writer.add(timestamp, record)
+    writer.close()
+    return writer
+
+def aggregate_archives(archive_directory, cutoff, rollups=(), statistics=(), start=None, end=None):
+    '''
+    Aggregate the archived records of the days between start and end, and roll them up into each
+    coarser cutoff of rollups, yielding (cutoff, package) as the packages are completed
+    '''
+    checkRollupCutoffs(cutoff, rollups, STATION_TZ)
+    cutoffs = [cutoff] + sorted(rollups)
+    states = [None] * len(cutoffs)
+    for day in archive_days(archive_directory, start, end) + [None]:
+        if day is None:
+            records = None
+        else:
+            with Archive(archive_path(archive_directory, day)) as archive:
+                records = archive.timed_records()
+        results = [aggregateTimed(cutoff, STATION_TZ, records, states[0], statistics)]
+        for level, rollup_cutoff in enumerate(cutoffs[1:], 1):
+            result = rollup(rollup_cutoff, STATION_TZ, results[-1]['packages'], states[level], statistics)
+            if records is None:
+                ending = rollup(rollup_cutoff, STATION_TZ, None, result['state'], statistics)
+                result = {'packages': result['packages'] + ending['packages'], 'state': ending['state']}
+            results.append(result)
+        states = [aggregated['state'] for aggregated in results]
+        for level_cutoff, result in zip(cutoffs, results):
+            for package in result['packages']:
+                yield level_cutoff, package
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Build and aggregate columnar archives of weather station records")
+    commands = parser.add_subparsers(dest="command")
+    build = commands.add_parser("build", help="Archive the records of the raw .dat files of each day")
+    build.add_argument('raw_directory', type=str, help='The raw_data/weather directory, holding one YYYY-MM-DD directory per day')
+    build.add_argument('archive_directory', type=str, help='The directory to write one archive per day to')
+    build.add_argument('--prefetch', type=int, default=1, help='The number of .dat files to read ahead (0 to disable)')
+    aggregation = commands.add_parser("aggregate", help="Aggregate archived records into JSON lines of packages")
+    aggregation.add_argument('archive_directory', type=str, help='The directory of the archives')
+    aggregation.add_argument('--aggregation', type=int, default=300, help='The bin size in seconds')
+    aggregation.add_argument('--rollups', type=int, nargs='*', default=[],
+                             help='Coarser bin sizes in seconds to roll the aggregation up into')
+    aggregation.add_argument('--statistics', type=str, nargs='*', default=[], choices=STATISTICS,
+                             help="Statistics to add besides each property's mean (sum for precipitation)")
+    aggregation.add_argument('output', type=str, help='The file to write the packages to')
+    for command in (build, aggregation):
+        command.add_argument('--start', type=str, default=None, help='The first day (YYYY-MM-DD)')
+        command.add_argument('--end', type=str, default=None, help='The last day (YYYY-MM-DD)')
+    args = parser.parse_args()
+
+    if args.command == "build":
+        writer = build_archives(args.raw_directory, args.archive_directory, args.start, args.end, args.prefetch)
+        sys.stderr.write("Archived %s\n" % writer.summary())
+    else:
+        count = 0
+        with open(args.output, 'w') as output:
+            for cutoff, package in aggregate_archives(args.archive_directory, args.aggregation, args.rollups,
+                                                      args.statistics, args.start, args.end):
+                output.write(json.dumps({"cutoff": cutoff, "start_time": package['start_time'],
+                                         "end_time": package['end_time'], "properties": package['properties']}) + "\n")
+                count += 1
+        sys.stderr.write("%s packages\n" % count)
@@ -0,0 +1,146 @@
+'''
+This is the unit test module for archive.py.
+It writes weather station DAT files around local midnight, archives their records,
+and checks that the archives hold the parsed records, one file per local day, and
+aggregate to the same packages as the parsed records do.
+
+To run the unit test, simply use:
+python archive_unittest.py
+'''
+
+import datetime
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+import parser
+from parser import merge_files, aggregate, rollup
+from archive import STATION_TZ, Archive, ArchiveWriter, aggregate_archives, archive_days, archive_path, build_archives
+
+parser.debug_log = lambda message: None
+
+HEADER = ('"TOA5","MAC","CR1000","1","OS","CPU:x","1","Table"\n'
+		  '"TIMESTAMP","RECORD","AirTC","RH","Pyro","PAR_ref","WindDir","WS_ms","Rain_mm_Tot"\n'
+		  '"TS","RN","Deg C","%","W/m^2","umol/s/m^2","degrees","meters/second","mm"\n'
+		  '"","","Smp","Smp","Smp","Smp","Smp","Smp","Tot"\n')
+
+
+class archiveUnitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.raw = os.path.join(self.directory, "raw")
+		self.archives = os.path.join(self.directory, "archives")
+		# A row a minute from 21:00 to 03:00 local time, an hour a file, in the directory of its day
+		self.files = []
+		start = datetime.datetime(2017, 6, 1, 21, 0, 0)
+		for hour in range(6):
+			fileStart = start + datetime.timedelta(hours=hour)
+			dayDirectory = os.path.join(self.raw, fileStart.strftime("%Y-%m-%d"))
+			if not os.path.isdir(dayDirectory):
+				os.makedirs(dayDirectory)
+			path = os.path.join(dayDirectory, "WeatherStation_SecData_%s.dat" % fileStart.strftime("%H"))
+			with open(path, 'w') as datFile:
+				datFile.write(HEADER)
+				for minute in range(60):
+					number = hour * 60 + minute
+					datFile.write('"%s",%d,%s,%s,%s,%s,%s,%s,%s\n' % (
+						(fileStart + datetime.timedelta(minutes=minute)).strftime("%Y-%m-%d %H:%M:%S"), number,
+						20 + number % 7 * 0.25, 40 + number % 11, number % 13 * 10.5, number % 17 * 20.0,
+						number % 360, 1 + number % 5 * 0.5, 0.1 if number % 19 == 0 else 0))
+			self.files.append(path)
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def parsedRecords(self):
+		return [record for timestamp, fileIndex, record in merge_files(self.files, STATION_TZ)]
+
+	def test_canArchiveRecordsByLocalDay(self):
+		'''
+		Records are archived in the file of their local day, with the properties they were parsed with
+		'''
+		writer = build_archives(self.raw, self.archives)
+		self.assertEqual(writer.records, 360)
+		self.assertEqual(archive_days(self.archives), ["2017-06-01", "2017-06-02"])
+		self.assertEqual(archive_days(self.archives, start="2017-06-02"), ["2017-06-02"])
+
+		archived = []
+		for day in archive_days(self.archives):
+			with Archive(archive_path(self.archives, day)) as archive:
+				archived.extend(archive.timed_records())
+		self.assertEqual(len(archived), 360)
+		self.assertEqual(len([startTime for startTime, endTime, properties in archived if startTime < 1496386800]), 180)
+		for (startTime, endTime, properties), record in zip(archived, self.parsedRecords()):
+			self.assertEqual(properties, dict((name, value) for name, value in record['properties'].items()
+											   if not name.startswith('_')))
+
+	def test_canReplaceArchivedRecords(self):
+		'''
+		Records archived again replace those at the same time, properties they lack are missing (NaN)
+		'''
+		first = ArchiveWriter(self.archives)
+		first.add(1496340000, {'properties': {'a': 1.0, 'b': 2.0}})
+		first.add(1496340060, {'properties': {'a': 3.0, 'b': 4.0}})
+		first.close()
+		second = ArchiveWriter(self.archives)
+		second.add(1496340060, {'properties': {'a': 5.0, '_internal': 0}})
+		second.add(1496340120, {'properties': {'a': 6.0}})
+		second.close()
+
+		with Archive(archive_path(self.archives, "2017-06-01")) as archive:
+			self.assertEqual(list(archive.column("time")), [1496340000, 1496340060, 1496340120])
+			self.assertEqual(list(archive.column("a")), [1.0, 5.0, 6.0])
+			self.assertTrue(math.isnan(archive.column("b")[1]))
+			self.assertEqual([properties for startTime, endTime, properties in archive.timed_records(start=1496340060)],
+							 [{'a': 5.0}, {'a': 6.0}])
+
+	def aggregateParsed(self, cutoffs, statistics):
+		'''
+		Aggregate and roll up the parsed records directly, as the extractor does
+		'''
+		packages = []
+		states = [None] * len(cutoffs)
+		for records in (self.parsedRecords(), None):
+			results = [aggregate(cutoffs[0], STATION_TZ, records, states[0], statistics)]
+			for level, cutoff in enumerate(cutoffs[1:], 1):
+				result = rollup(cutoff, STATION_TZ, results[-1]['packages'], states[level], statistics)
+				if records is None:
+					ending = rollup(cutoff, STATION_TZ, None, result['state'], statistics)
+					result = {'packages': result['packages'] + ending['packages'], 'state': ending['state']}
+				results.append(result)
+			states = [result['state'] for result in results]
+			for cutoff, result in zip(cutoffs, results):
+				packages.extend((cutoff, package) for package in result['packages'])
+		return packages
+
+	def assertSamePackages(self, packages, expected):
+		key = lambda (cutoff, package): (cutoff, package['start_time'])
+		self.assertEqual(len(packages), len(expected))
+		for (cutoff, package), (expectedCutoff, expectedPackage) in zip(sorted(packages, key=key), sorted(expected, key=key)):
+			self.assertEqual((cutoff, package['start_time'], package['end_time']),
+							 (expectedCutoff, expectedPackage['start_time'], expectedPackage['end_time']))
+			self.assertEqual(sorted(package['properties']), sorted(expectedPackage['properties']))
+			for name, value in expectedPackage['properties'].items():
+				self.assertAlmostEqual(package['properties'][name], value, places=9)
+
+	def test_canAggregateLikeTheParsedRecords(self):
+		'''
+		Aggregating the archives across the day boundary gives the packages of the parsed records
+		'''
+		build_archives(self.raw, self.archives)
+		statistics = ['max', 'variance']
+		packages = list(aggregate_archives(self.archives, 300, [3600, 86400], statistics))
+		self.assertEqual(len([cutoff for cutoff, package in packages if cutoff == 86400]), 2)
+		self.assertSamePackages(packages, self.aggregateParsed([300, 3600, 86400], statistics))
+
+	def test_canRejectCutoffsStraddlingLocalDays(self):
+		build_archives(self.raw, self.archives)
+		self.assertRaises(ValueError, list, aggregate_archives(self.archives, 2 * 3600, [86400]))
+		self.assertRaises(ValueError, list, aggregate_archives(self.archives, 300, [1000]))
+
+
+if __name__ == "__main__":
+	unittest.main()
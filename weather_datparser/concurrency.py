@@ -0,0 +1,205 @@
+'''
+concurrency.py
+
+Runs several messages of an extractor at once within one container.
+
+With --workers N (or $EXTRACTOR_WORKERS), the extractor consumes its queue through N
+RabbitMQ consumers in one process, each taking one message at a time, so messages
+waiting on geostreams or the file system overlap with each other. Two messages for the
+same dataset never run at the same time: each takes a lock on its dataset first (or on
+the key returned by the extractor's message_lock_key method, if it has one).
+
+On SIGTERM or SIGINT the consumers stop starting messages, the messages in flight are
+given --draintimeout seconds to finish, and then the connections are closed. Messages
+that were received but not started are not acknowledged, so RabbitMQ requeues them.
+'''
+
+import json
+import logging
+import os
+import re
+import signal
+import threading
+import time
+
+
+WORKERS_ENVIRONMENT_VARIABLE = "EXTRACTOR_WORKERS"
+
+
+class ShuttingDown(Exception):
+    '''
+    Raised for a message received after the extractor started shutting down
+    '''
+    pass
+
+
+def add_concurrency_arguments(parser):
+    '''
+    Add the concurrency arguments to an extractor's parser.
+    '''
+    parser.add_argument('--workers', dest="message_workers", type=int,
+                        default=int(os.environ.get(WORKERS_ENVIRONMENT_VARIABLE, 1)),
+                        help="number of messages to process at a time (also set by $%s)" % WORKERS_ENVIRONMENT_VARIABLE)
+    parser.add_argument('--draintimeout', dest="drain_timeout", type=float, default=3600,
+                        help="seconds to let the messages in flight finish when shutting down")
+
+
+def dataset_lock_key(resource):
+    '''
+    The dataset of a message: the resource itself, or the dataset a file was added to
+    '''
+    if resource.get('type') == 'file' and resource.get('parent', {}).get('id'):
+        return resource['parent']['id']
+    return resource['id']
+
+
+class MessagePool(object):
+    '''
+    Keeps track of the messages in flight and of a lock per dataset.
+    '''
+
+    def __init__(self, workers, lock_key=dataset_lock_key):
+        self.workers = workers
+        self.lock_key = lock_key
+        self.draining = threading.Event()
+        self.stopped = threading.Event()
+        self.in_flight = 0
+
+        self._guard = threading.Condition()
+        # key -> [lock, number of messages holding or waiting for it]
+        self._locks = {}
+        # Instrumentation: check_message and process_message calls, and seconds spent waiting on dataset locks
+        self.calls = 0
+        self.waited = 0.0
+
+    def run(self, resource, function, *args):
+        '''
+        Call function(*args) holding the lock of the dataset of resource
+        '''
+        if self.draining.is_set():
+            # Hold the message unacknowledged until the connections close, so it is requeued
+            self.stopped.wait()
+            raise ShuttingDown("not starting %s while shutting down" % resource['id'])
+
+        key = self.lock_key(resource)
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+            self.in_flight += 1
+        try:
+            started = time.time()
+            with entry[0]:
+                waited = time.time() - started
+                return function(*args)
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+                self.in_flight -= 1
+                self.calls += 1
+                self.waited += waited
+                self._guard.notify_all()
+
+    def drain(self, timeout=None):
+        '''
+        Stop starting messages and wait for those in flight. Returns whether they all finished
+        '''
+        self.draining.set()
+        deadline = None if timeout is None else time.time() + timeout
+        with self._guard:
+            while self.in_flight > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._guard.wait(remaining if remaining is not None else 1.0)
+            return self.in_flight == 0
+
+    def summary(self):
+        '''
+        One line describing the messages run so far, for the logs.
+        '''
+        return "%s calls with %s workers, %.2fs waiting on dataset locks, %s in flight" % (
+            self.calls, self.workers, self.waited, self.in_flight)
+
+
+def pool_messages(extractor):
+    '''
+    Run the check_message and process_message of an extractor under the lock of their dataset,
+    if it was asked to process several messages at a time (see start_extractor).
+    '''
+    if extractor.args.message_workers <= 1:
+        extractor.message_pool = None
+        return
+
+    pool = MessagePool(extractor.args.message_workers, getattr(extractor, "message_lock_key", dataset_lock_key))
+    check_message = extractor.check_message
+    process_message = extractor.process_message
+
+    def pooled_check_message(connector, host, secret_key, resource, parameters):
+        return pool.run(resource, check_message, connector, host, secret_key, resource, parameters)
+
+    def pooled_process_message(connector, host, secret_key, resource, parameters):
+        return pool.run(resource, process_message, connector, host, secret_key, resource, parameters)
+
+    extractor.message_pool = pool
+    extractor.check_message = pooled_check_message
+    extractor.process_message = pooled_process_message
+
+
+def _routing_keys(extractor_info):
+    '''
+    The routing keys of the messages an extractor processes, as pyclowder binds them
+    '''
+    keys = []
+    for resource_type, events in extractor_info['process'].items():
+        for event in events:
+            keys.append("*.%s.%s" % (resource_type, re.sub(r"\*$", "#", event).replace("/", ".")))
+    return keys
+
+
+def start_extractor(extractor):
+    '''
+    Start consuming messages: through the pyclowder connector as usual, or with several
+    RabbitMQ consumers if the extractor was asked to process several messages at a time
+    '''
+    pool = getattr(extractor, "message_pool", None)
+    if pool is None or extractor.args.connector != "RabbitMQ":
+        extractor.start()
+        return
+
+    from pyclowder.connectors import RabbitMQConnector
+
+    logger = logging.getLogger(__name__)
+    rabbitmq_key = [] if getattr(extractor.args, "nobind", False) else _routing_keys(extractor.extractor_info)
+    connectors = []
+    for number in range(pool.workers):
+        connector = RabbitMQConnector(extractor.args.rabbitmq_queuename,
+                                      extractor.extractor_info,
+                                      check_message=extractor.check_message,
+                                      process_message=extractor.process_message,
+                                      rabbitmq_uri=extractor.args.rabbitmq_uri,
+                                      rabbitmq_exchange=extractor.args.rabbitmq_exchange,
+                                      rabbitmq_key=rabbitmq_key,
+                                      rabbitmq_queue=extractor.args.rabbitmq_queuename,
+                                      mounted_paths=json.loads(extractor.args.mounted_paths))
+        connector.connect()
+        if number == 0:
+            connector.register_extractor(extractor.args.registration_endpoints)
+        connectors.append(connector)
+        threading.Thread(target=connector.listen, name="RabbitMQConnector-%s" % number).start()
+    logger.info("consuming with %s workers" % pool.workers)
+
+    stopping = threading.Event()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda number, frame: stopping.set())
+    while not stopping.is_set() and any(connector.alive() for connector in connectors):
+        stopping.wait(1)
+
+    logger.info("shutting down, waiting for %s messages in flight" % pool.in_flight)
+    if not pool.drain(extractor.args.drain_timeout):
+        logger.warning("%s messages still in flight after %ss, stopping anyway" % (pool.in_flight, extractor.args.drain_timeout))
+    for connector in connectors:
+        connector.stop()
+    pool.stopped.set()
+    logger.info(pool.summary())
@@ -0,0 +1,71 @@
+'''
+This is the unit test module for datapoints.py.
+It checks that the datapoints encoded straight into a request body are the
+JSON the geostreams bulk endpoint expects.
+
+To run the unit test, simply use:
+python datapoints_unittest.py
+'''
+
+import json
+import unittest
+
+import numpy as np
+
+import datapoints
+from datapoints import BatchPolicy, DatapointEncoder, post_datapoints
+
+
+class datapointsUnitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.encoder = DatapointEncoder("1", {"type": "Point", "coordinates": [-111.974304, 33.075576, 361]})
+
+	def test_canEncodeNumpyScalars(self):
+		'''
+		numpy scalars (e.g. from aggregated columns) are encoded as plain JSON numbers and booleans
+		'''
+		self.encoder.add("2017-06-01T00:00:00-07:00", "2017-06-01T00:05:00-07:00",
+						 {"air_temperature": np.float32(25.5), "count": np.int32(3), "flag": np.bool_(True)})
+		datapoint = json.loads(self.encoder.body(1))[0]
+		self.assertEqual(datapoint["properties"], {"air_temperature": 25.5, "count": 3, "flag": True})
+
+	def test_canLeaveOutNaNValues(self):
+		'''
+		NaN and infinite values, including numpy ones, are left out, since they are not valid JSON
+		'''
+		self.encoder.add("2017-06-01T00:00:00-07:00", "2017-06-01T00:05:00-07:00",
+						 {"a": float("nan"), "b": np.float64("inf"), "c": np.float32("nan"), "d": 1.0})
+		datapoint = json.loads(self.encoder.body(1))[0]
+		self.assertEqual(datapoint["properties"], {"d": 1.0})
+
+	def test_canBackOffAfterServerErrors(self):
+		'''
+		Batches failed with a server error are retried smaller, after waiting longer each time
+		'''
+		statuses = [503, 503, 200, 200, 200, 200]
+		posted, slept = [], []
+		class Answer(object):
+			def __init__(self, status_code):
+				self.status_code = status_code
+			def raise_for_status(self):
+				pass
+		def post(url, headers=None, data=None, verify=True):
+			posted.append(len(json.loads(data)))
+			return Answer(statuses[len(posted) - 1])
+
+		for minute in range(8):
+			self.encoder.add("2017-06-01T00:%02d:00-07:00" % minute, "2017-06-01T00:%02d:59-07:00" % minute, {"a": 1.0})
+		realPost, realSleep = datapoints.requests.post, datapoints.time.sleep
+		datapoints.requests.post, datapoints.time.sleep = post, slept.append
+		try:
+			sent = post_datapoints(None, "http://localhost/", "key", self.encoder, BatchPolicy(size=8, backoff=0.5))
+		finally:
+			datapoints.requests.post, datapoints.time.sleep = realPost, realSleep
+		self.assertEqual(sent, 8)
+		self.assertEqual(posted[:3], [8, 4, 2])
+		self.assertEqual(slept, [0.5, 1.0])
+
+
+if __name__ == "__main__":
+	unittest.main()
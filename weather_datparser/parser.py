@@ -5,7 +5,13 @@ import datetime
 import dateutil.parser
 import dateutil.tz
 import csv
+import heapq
 import json
+import os
+from contextlib import closing
+from StringIO import StringIO
+
+from prefetch import Prefetcher
 
 DEBUG = True
 
@@ -15,10 +21,6 @@ def log(x):
 	print x
 debug_log = log if DEBUG else void
 
-
-def avg(items):
-	return float(sum(items)) / max(len(items), 1)
-
 ISO_8601_UTC_MEAN = dateutil.tz.tzoffset(None, 0)
 
 # Convert the given ISO time string to timestamps in seconds.
@@ -107,18 +109,110 @@ PROP_MAPPING = {
 	)]
 }
 
-# Aggregation functions for each property.
+# The statistic published under each property's own name.
 PROP_AGGREGATE = {
-	'air_temperature': avg,
-	'relative_humidity': avg,
-	'surface_downwelling_shortwave_flux_in_air': avg,
-	'surface_downwelling_photosynthetic_photon_flux_in_air': avg,
-	'eastward_wind': avg,
-	'northward_wind': avg,
-	'wind_speed': avg,
-	'precipitation_rate': sum
+	'air_temperature': 'mean',
+	'relative_humidity': 'mean',
+	'surface_downwelling_shortwave_flux_in_air': 'mean',
+	'surface_downwelling_photosynthetic_photon_flux_in_air': 'mean',
+	'eastward_wind': 'mean',
+	'northward_wind': 'mean',
+	'wind_speed': 'mean',
+	'precipitation_rate': 'sum'
+}
+
+# Units of each property, as converted by PROP_MAPPING.
+PROP_UNITS = {
+	'air_temperature': 'K',
+	'relative_humidity': '%',
+	'surface_downwelling_shortwave_flux_in_air': 'W m-2',
+	'surface_downwelling_photosynthetic_photon_flux_in_air': 'umol m-2 s-1',
+	'eastward_wind': 'm s-1',
+	'northward_wind': 'm s-1',
+	'wind_speed': 'm s-1',
+	'precipitation_rate': 'mm'
 }
 
+# Statistics that can also be published, as "<property>_<statistic>" (e.g. air_temperature_max).
+STATISTICS = ['mean', 'variance', 'min', 'max', 'count', 'sum', 'last']
+
+# ----------------------------------------------------------------------
+# Streaming statistics.
+# Every property of every open bin has a fixed-size accumulator, so memory does not grow
+# with the number of records in a bin, and every statistic comes out of the same pass.
+# An accumulator is a list [count, mean, m2, min, max, sum, last] (lists, so aggregation
+# states stay plain JSON), where mean and m2 (the sum of squared deviations from the mean)
+# are updated with Welford's algorithm, and combined with Chan et al.'s formula.
+COUNT, MEAN, M2, MIN, MAX, SUM, LAST = range(7)
+
+def newStats():
+	return [0, 0.0, 0.0, None, None, 0.0, None]
+
+# Add one value to an accumulator; NaN (a missing reading) is left out of every statistic.
+def addToStats(stats, value):
+	if value != value:
+		return
+	stats[COUNT] += 1
+	delta = value - stats[MEAN]
+	stats[MEAN] += delta / stats[COUNT]
+	stats[M2] += delta * (value - stats[MEAN])
+	if stats[MIN] == None or value < stats[MIN]:
+		stats[MIN] = value
+	if stats[MAX] == None or value > stats[MAX]:
+		stats[MAX] = value
+	stats[SUM] += value
+	stats[LAST] = value
+
+# Add the accumulator of later values (e.g. of the next bin) to an accumulator.
+def mergeStats(stats, other):
+	if other[COUNT] == 0:
+		return
+	count = stats[COUNT] + other[COUNT]
+	delta = other[MEAN] - stats[MEAN]
+	stats[MEAN] += delta * other[COUNT] / count
+	stats[M2] += other[M2] + delta * delta * stats[COUNT] * other[COUNT] / count
+	stats[COUNT] = count
+	stats[MIN] = other[MIN] if stats[MIN] == None else min(stats[MIN], other[MIN])
+	stats[MAX] = other[MAX] if stats[MAX] == None else max(stats[MAX], other[MAX])
+	stats[SUM] += other[SUM]
+	stats[LAST] = other[LAST]
+
+# Return one of STATISTICS from an accumulator (the sample variance, NaN for fewer than 2 values).
+def statValue(stats, statistic):
+	if statistic == 'variance':
+		return stats[M2] / (stats[COUNT] - 1) if stats[COUNT] > 1 else float('nan')
+	return stats[STATISTICS_INDEX[statistic]]
+
+STATISTICS_INDEX = {'mean': MEAN, 'min': MIN, 'max': MAX, 'count': COUNT, 'sum': SUM, 'last': LAST}
+
+# Add the aggregated properties of a record to the accumulators of a bin (a dict by property).
+def accumulateProps(statsByProp, properties):
+	for key in properties:
+		# Properties start with "_" shouldn't be processed, nor properties without an aggregate.
+		if key.startswith('_') or key not in PROP_AGGREGATE:
+			continue
+		if key not in statsByProp:
+			statsByProp[key] = newStats()
+		addToStats(statsByProp[key], properties[key])
+
+# Add the accumulators of a bin to those of a coarser bin.
+def mergeProps(statsByProp, otherByProp):
+	for key in otherByProp:
+		if key not in statsByProp:
+			statsByProp[key] = newStats()
+		mergeStats(statsByProp[key], otherByProp[key])
+
+# Return the properties published for a bin: each property's aggregate under its own name,
+# and each of the other statistics asked for as "<property>_<statistic>".
+def publishProps(statsByProp, statistics = ()):
+	result = {}
+	for key in statsByProp:
+		result[key] = statValue(statsByProp[key], PROP_AGGREGATE[key])
+		for statistic in statistics:
+			if statistic != PROP_AGGREGATE[key]:
+				result['%s_%s' % (key, statistic)] = statValue(statsByProp[key], statistic)
+	return result
+
 def transformProps(propMetaDict, propValDict):
 	newProps = []
 	for propName in propValDict:
@@ -133,41 +227,53 @@ def transformProps(propMetaDict, propValDict):
 def parse_file_header_line(linestr):
 	return map(lambda x: json.loads(x), str(linestr).split(','))
 
+# Read the TOA5 header lines and return the property names and details.
+def parse_file_header(csvfile):
+	# First line is always the header.
+	# @see {@link https://www.manualslib.com/manual/538296/Campbell-Cr9000.html?page=41#manual}
+	header_lines = [
+		csvfile.readline()
+	]
+
+	file_format, station_name, logger_model, logger_serial, os_version, dld_file, dld_sig, table_name = parse_file_header_line(header_lines[0])
+
+	if file_format != 'TOA5':
+		raise ValueError('Unsupported format "%s".' % file_format)
+
+	# For TOA5, there are in total 4 header lines.
+	# @see {@link https://www.manualslib.com/manual/538296/Campbell-Cr9000.html?page=43#manual}
+	while (len(header_lines) < 4):
+		header_lines.append(csvfile.readline())
+
+	prop_names = parse_file_header_line(header_lines[1])
+	prop_units = parse_file_header_line(header_lines[2])
+	prop_sample_method = parse_file_header_line(header_lines[3])
+
+	# Associate the above lists.
+	props = dict()
+	for x in xrange(len(prop_names)):
+		props[prop_names[x]] = {
+			'title': prop_names[x],
+			'unit': prop_units[x],
+			'sample_method': prop_sample_method[x]
+		}
+	# [DEBUG] Print the property details if needed.
+	#print json.dumps(props)
+
+	return prop_names, props
+
+# Convert a TOA5 "TIMESTAMP" column to seconds since epoch in the given timezone.
+def TOA5TimeString2TimeStamp(timeStr, utc_offset = ISO_8601_UTC_MEAN):
+	time = datetime.datetime.strptime(timeStr, '%Y-%m-%d %H:%M:%S').replace(tzinfo=utc_offset)
+	isoStartTime = datetime.datetime(1970, 1, 1, 0, 0, 0, 0, ISO_8601_UTC_MEAN)
+	return int((time - isoStartTime).total_seconds())
+
 # ----------------------------------------------------------------------
-# Parse the CSV file and return a list of dictionaries.
-def parse_file(filepath, utc_offset = ISO_8601_UTC_MEAN):
-	results = []
-	with open(filepath) as csvfile:
-		# First line is always the header.
-		# @see {@link https://www.manualslib.com/manual/538296/Campbell-Cr9000.html?page=41#manual}
-		header_lines = [
-			csvfile.readline()
-		]
-
-		file_format, station_name, logger_model, logger_serial, os_version, dld_file, dld_sig, table_name = parse_file_header_line(header_lines[0])
-
-		if file_format != 'TOA5':
-			raise ValueError('Unsupported format "%s".' % file_format)
-
-		# For TOA5, there are in total 4 header lines.
-		# @see {@link https://www.manualslib.com/manual/538296/Campbell-Cr9000.html?page=43#manual}
-		while (len(header_lines) < 4):
-			header_lines.append(csvfile.readline())
-
-		prop_names = parse_file_header_line(header_lines[1])
-		prop_units = parse_file_header_line(header_lines[2])
-		prop_sample_method = parse_file_header_line(header_lines[3])
-
-		# Associate the above lists.
-		props = dict()
-		for x in xrange(len(prop_names)):
-			props[prop_names[x]] = {
-				'title': prop_names[x],
-				'unit': prop_units[x],
-				'sample_method': prop_sample_method[x]
-			}
-		# [DEBUG] Print the property details if needed.
-		#print json.dumps(props)
+# Parse the CSV file and yield one (timestamp, record) tuple per data row.
+# If the contents of the file were already read, they are parsed instead.
+def iter_file(filepath, utc_offset = ISO_8601_UTC_MEAN, contents = None):
+	with (open(filepath) if contents == None else closing(StringIO(contents))) as csvfile:
+		prop_names, props = parse_file_header(csvfile)
 
 		reader = csv.DictReader(csvfile, fieldnames=prop_names)
 		for row in reader:
@@ -185,11 +291,106 @@ def parse_file(filepath, utc_offset = ISO_8601_UTC_MEAN):
 			# Enable this if the raw data needs to be kept.
 # 			newResult['properties']['_raw'] = {
 # 				'data': row,
-# 				'units': prop_units,
-# 				'sample_method': prop_sample_method
+# 				'units': props,
 # 			}
-			results.append(newResult)
-	return results
+			yield TOA5TimeString2TimeStamp(row['TIMESTAMP'], utc_offset), newResult
+
+# ----------------------------------------------------------------------
+# Parse the CSV file and return a list of dictionaries.
+def parse_file(filepath, utc_offset = ISO_8601_UTC_MEAN):
+	return [record for timestamp, record in iter_file(filepath, utc_offset)]
+
+# ----------------------------------------------------------------------
+# Return the (first, last) timestamps of the data rows in a file without parsing it,
+# or None if the file contains no data rows.
+# Only the header, the first data row and the tail of the file are read.
+def peek_file_time_range(filepath, utc_offset = ISO_8601_UTC_MEAN, tailSize = 4096):
+	with open(filepath, 'rb') as csvfile:
+		parse_file_header(csvfile)
+		firstLine = csvfile.readline()
+		if not firstLine.strip():
+			return None
+		dataStart = csvfile.tell() - len(firstLine)
+
+		csvfile.seek(0, os.SEEK_END)
+		fileSize = csvfile.tell()
+		while True:
+			tailStart = max(dataStart, fileSize - tailSize)
+			csvfile.seek(tailStart)
+			lines = csvfile.read().splitlines()
+			# Unless the tail starts with the data, its first line may be cut
+			if tailStart > dataStart:
+				lines = lines[1:]
+			lines = [line for line in lines if line.strip()]
+			if lines:
+				lastLine = lines[-1]
+				break
+			tailSize *= 2
+
+	def rowTime(line):
+		return TOA5TimeString2TimeStamp(next(csv.reader([line]))[0], utc_offset)
+
+	return rowTime(firstLine), rowTime(lastLine)
+
+# ----------------------------------------------------------------------
+# Merge several files into a single stream sorted by time.
+# Yields (timestamp, fileIndex, record) where fileIndex is the position of the
+# record's file in filepaths.
+# Each file is expected to be sorted by time, but files may overlap each other.
+# Records whose timestamp was already emitted (overlapping downloads) are dropped,
+# as are records that would go back in time, so the output is strictly increasing.
+# Files are only opened once the merge reaches their first timestamp; with prefetchDepth,
+# up to that many of the next files are read ahead on a background thread.
+def merge_files(filepaths, utc_offset = ISO_8601_UTC_MEAN, prefetchDepth = 0):
+	# Peek at every file so they can be activated in time order.
+	pending = []
+	for fileIndex, filepath in enumerate(filepaths):
+		timeRange = peek_file_time_range(filepath, utc_offset)
+		if timeRange == None:
+			debug_log('Skipping %s: no records.' % filepath)
+			continue
+		pending.append((timeRange[0], timeRange[1], fileIndex))
+	pending.sort(reverse=True)
+
+	# Files are activated in the order of their first timestamp, so read them in that order.
+	prefetcher = Prefetcher([filepaths[fileIndex] for _, _, fileIndex in reversed(pending)], prefetchDepth)
+	contents = iter(prefetcher)
+
+	heap = []
+	def activate(fileIndex):
+		filepath, data = next(contents)
+		records = iter_file(filepath, utc_offset, data)
+		for timestamp, record in records:
+			heapq.heappush(heap, (timestamp, fileIndex, record, records))
+			break
+
+	lastTime = None
+	dropped = 0
+	try:
+		while heap or pending:
+			# Open every file starting no later than the current head of the merge.
+			while pending and (not heap or pending[-1][0] <= heap[0][0]):
+				activate(pending.pop()[2])
+			if not heap:
+				continue
+
+			timestamp, fileIndex, record, records = heapq.heappop(heap)
+			for nextTimestamp, nextRecord in records:
+				heapq.heappush(heap, (nextTimestamp, fileIndex, nextRecord, records))
+				break
+
+			if lastTime != None and timestamp <= lastTime:
+				dropped += 1
+				continue
+			lastTime = timestamp
+			yield timestamp, fileIndex, record
+	finally:
+		# Also when the consumer stops early or parsing fails, so the read-ahead thread does not linger
+		prefetcher.close()
+
+	if dropped > 0:
+		debug_log('Dropped %s duplicate or out of order records.' % dropped)
+	debug_log('Inputs: %s' % prefetcher.summary())
 
 # ----------------------------------------------------------------------
 # Aggregate the list of parsed results.
@@ -198,9 +399,22 @@ def parse_file(filepath, utc_offset = ISO_8601_UTC_MEAN):
 # which should be fed back into the function to continue or end the aggregation.
 # If there's no more data to input, provide None and the aggregation will stop.
 # When aggregation ended, the state package returned should be None to indicate that.
+# The state holds the accumulators of the open bin rather than its records (see newStats),
+# so it stays the same size however many records the bin gets; it is updated in place.
+# Besides each property's aggregate, the packages carry the statistics asked for
+# (see publishProps), and the accumulators they come from under 'stats'.
 # Note: data has to be sorted by time.
 # Note: cutoffSize is in seconds.
-def aggregate(cutoffSize, tz, inputData, state):
+def aggregate(cutoffSize, tz, inputData, state, statistics = ()):
+	timedData = None
+	if inputData != None:
+		timedData = [(ISOTimeString2TimeStamp(record['start_time']), ISOTimeString2TimeStamp(record['end_time']),
+				record['properties']) for record in inputData]
+	return aggregateTimed(cutoffSize, tz, timedData, state, statistics)
+
+# Works like aggregate(), but each record is a (startTime, endTime, properties) tuple with its
+# times in seconds, so records read back from an archive (see archive.py) need no time parsing.
+def aggregateTimed(cutoffSize, tz, inputData, state, statistics = ()):
 	# This function should always return this complex package no matter what happens.
 	result = {
 		'packages': [],
@@ -209,139 +423,159 @@ def aggregate(cutoffSize, tz, inputData, state):
 	}
 
 	# The aggregation ends when no more data is available. (inputData is None)
-	# In which case it needs to recover leftover data in the state package.
+	# In which case it needs to recover the open bin from the state package.
 	if inputData == None:
 		debug_log('Ending aggregation...')
 
-		# The aggregation is ending, try recover leftover data from the state.
-		if state == None:
-			# There is nothing to do.
-			pass
-		else:
-			# Recover leftover data from state.
-
-			data = state['leftover']
-
-			if len(data) == 0:
-				# There is nothing to recover.
-				pass
-			else:
-				# Aggregate leftover data.
-				# Assume leftover data never contain more data than the cutoff allows.
+		if state != None and state['records'] > 0:
+			# The open bin ends with the latest record in it.
+			result['packages'].append(aggregate_chunk(state['stats'], tz, state['starttime'], state['endtime'], statistics))
 
-				startTime = state['starttime']
-				# Use the latest date in the data entries.
-				# Assuming the data is always sorted, the last one should be the latest.
-				endTime = ISOTimeString2TimeStamp(data[-1]['end_time'])
-
-				newPackage = aggregate_chunk(data, tz, startTime, endTime)
-				if newPackage != None:
-					result['packages'].append(newPackage)
-
-			# Mark state with None to indicate the aggregation is done.
-			result['state'] = None
-	else:
+		# Mark state with None to indicate the aggregation is done.
+		result['state'] = None
+	elif len(inputData) > 0:
 		debug_log('Aggregating...')
 
-		data = inputData
-
-		# More data is provided, continue aggregation.
 		if state == None:
 			debug_log('Fresh start...')
 			# There is no previous state, starting afresh.
-
 			# Use the earliest date in the input data entries.
 			# Assuming the input data is always sorted, the first one should be the earliest.
-			startTime = ISOTimeString2TimeStamp(data[0]['start_time'])
-
+			state = {
+				'starttime': inputData[0][0],
+				'endtime': None,
+				'records': 0,
+				'stats': {}
+			}
 		else:
 			debug_log('Continuing...')
-			# Resume aggregation from a previous state.
-
-			startTime = state['starttime']
-			# Left over data should be part of the data being processed.
-			data = state['leftover'] + inputData
-
-		startIndex = 0
-
-		# Keep aggregating until all the data is consumed.
-		while startIndex < len(data):
-			# Find the nearest cut-off point.
-			endTimeCutoff = startTime - startTime % cutoffSize + cutoffSize
-			# Scan the input data to find the portion that fits in the cutoff.
-			endIndex = startIndex
-			while endIndex < len(data) and ISOTimeString2TimeStamp(data[endIndex]['end_time']) < endTimeCutoff:
-				endIndex += 1
-
-			# If everything fits in the cutoff, there may be more data in the next run.
-			# Otherwise, these data should be aggregated.
-			if endIndex >= len(data):
-				# End of data reached, but cutoff is not.
-				# Save everything into state.
-				result['state'] = {
+			state = dict(state)
+
+		startTime = state['starttime']
+		# Find the nearest cut-off point.
+		endTimeCutoff = startTime - startTime % cutoffSize + cutoffSize
+		for _, endTime, properties in inputData:
+			if endTime >= endTimeCutoff:
+				# Cutoff reached, the open bin is complete.
+				if state['records'] > 0:
+					result['packages'].append(aggregate_chunk(state['stats'], tz, startTime, endTimeCutoff, statistics))
+				# Move on to the bin of this record, skipping the empty ones.
+				startTime = max(endTimeCutoff, endTime - endTime % cutoffSize)
+				endTimeCutoff = startTime - startTime % cutoffSize + cutoffSize
+				state = {
 					'starttime': startTime,
-					'leftover': data[startIndex:]
+					'endtime': None,
+					'records': 0,
+					'stats': {}
 				}
-			else:
-				# Cutoff reached.
-				# Aggregate this chunk.
-				newPackage = aggregate_chunk(data[startIndex:endIndex], tz, startTime, endTimeCutoff)
-				if newPackage != None:
-					result['packages'].append(newPackage)
+			accumulateProps(state['stats'], properties)
+			state['records'] += 1
+			state['endtime'] = endTime
 
-			# Update variables for the next loop.
-			startTime = endTimeCutoff
-			startIndex = endIndex
-
-		# The above loop should end with some chunks aggregated into result['packages'],
-		# with the last chunk saved in result['state']['leftover']
+		# The above loop should end with some bins aggregated into result['packages'],
+		# with the last bin still open in result['state']
+		result['state'] = state
 
 	return result
 
-# Helper function for aggregating a chunk of data.
+# Helper function for turning the accumulators of a bin into a package.
 # @param {timestamp} startTime
 # @param {timestamp} endTime
-def aggregate_chunk(dataChunk, tz, startTime, endTime):
-	if len(dataChunk) == 0:
-		# There is nothing to aggregate.
-		return None
-	else:
-		# Prepare the list of properties for aggregation.
-		propertiesList = map(lambda x: x['properties'], dataChunk)
-
-		return {
-			'start_time': datetime.datetime.fromtimestamp(startTime, tz).isoformat(),
-			'end_time': datetime.datetime.fromtimestamp(endTime, tz).isoformat(),
-			'properties': aggregateProps(propertiesList),
-			'type': 'Point',
-			'geometry': STATION_GEOMETRY
-		}
-
-def aggregateProps(propertiesList):
-	collection = {}
+def aggregate_chunk(statsByProp, tz, startTime, endTime, statistics = ()):
+	return {
+		'start_time': datetime.datetime.fromtimestamp(startTime, tz).isoformat(),
+		'end_time': datetime.datetime.fromtimestamp(endTime, tz).isoformat(),
+		'properties': publishProps(statsByProp, statistics),
+		# Accumulators behind the properties, needed to roll packages up further.
+		'stats': statsByProp,
+		'type': 'Point',
+		'geometry': STATION_GEOMETRY
+	}
 
+# Aggregate the properties of a list of records at once.
+# If counts is given, it is filled with the number of values aggregated for each property.
+def aggregateProps(propertiesList, counts = None, statistics = ()):
+	statsByProp = {}
 	for properties in propertiesList:
-		for key in properties:
-			# Properties start with "_" shouldn't be processed.
-			if key.startswith('_'):
-				continue
-			value = properties[key]
-			# Collect property values and save them into collection
-			if key not in collection:
-				collection[key] = [value]
-			else:
-				collection[key].append(value)
+		accumulateProps(statsByProp, properties)
+	if counts != None:
+		for key in statsByProp:
+			counts[key] = statsByProp[key][COUNT]
+	return publishProps(statsByProp, statistics)
 
-	result = {}
-	for key in properties:
-		# If there is no aggregation function, ignore the property.
-		if key not in PROP_AGGREGATE:
-			continue
-		func = PROP_AGGREGATE[key]
-		result[key] = func(collection[key])
+# ----------------------------------------------------------------------
+# Check that the bin sizes of an aggregation and its rollups fit together, raising ValueError.
+# Each rollup has to be a multiple of the finer bin size. Rollups are aligned to local time in tz
+# while aggregate() bins are aligned to UTC, so with rollups, the aggregation bin size also has to
+# divide the UTC offset of tz (25200 s at the station), or a fine bin would straddle a coarse bin edge.
+def checkRollupCutoffs(cutoffSize, rollupCutoffs, tz):
+	finer = cutoffSize
+	for cutoff in sorted(rollupCutoffs):
+		if cutoff <= finer or cutoff % finer != 0:
+			raise ValueError('Rollup of %s seconds is not a multiple of %s seconds.' % (cutoff, finer))
+		finer = cutoff
+	offset = abs(int(tz.utcoffset(None).total_seconds()))
+	if rollupCutoffs and offset % cutoffSize != 0:
+		raise ValueError('Aggregation of %s seconds does not divide the %s seconds UTC offset the rollups are aligned to.' % (cutoffSize, offset))
+
+# ----------------------------------------------------------------------
+# Roll aggregated packages up into coarser bins.
+# Works like aggregate(), but the input data are packages produced by aggregate()
+# (or by a finer rollup) and the result packages can be fed into a coarser rollup,
+# so a whole hierarchy of resolutions is built from a single parse.
+# The accumulators of the packages are combined (see mergeStats), so every statistic
+# of a coarser bin is exactly that of its records, and the state holds one set of
+# accumulators, not the packages of the open bin.
+# Bins are aligned to local time in tz, so daily bins start at local midnight.
+# Note: packages have to be sorted by time, and the bin sizes have to pass checkRollupCutoffs.
+# Note: cutoffSize is in seconds.
+def rollup(cutoffSize, tz, inputData, state, statistics = ()):
+	result = {
+		'packages': [],
+		'state': None if state == None else dict(state)
+	}
+
+	if inputData == None:
+		debug_log('Ending rollup...')
+
+		if state != None and state['packages'] > 0:
+			result['packages'].append(rollup_chunk(state['stats'], tz, state['starttime'], state['endtime'], statistics))
+		result['state'] = None
+	else:
+		for package in inputData:
+			packageStart = ISOTimeString2TimeStamp(package['start_time'])
+			packageEnd = ISOTimeString2TimeStamp(package['end_time'])
+			# Find the local bin containing this package.
+			localStart = packageStart + int(tz.utcoffset(None).total_seconds())
+			binStart = packageStart - localStart % cutoffSize
+			open = result['state'] != None and result['state']['packages'] > 0
+
+			if open and binStart != result['state']['binstart']:
+				# This package starts a new bin, so the previous one is complete.
+				result['packages'].append(rollup_chunk(result['state']['stats'], tz, result['state']['starttime'], result['state']['endtime'], statistics))
+				open = False
+
+			if not open:
+				result['state'] = {
+					'binstart': binStart,
+					# The first bin starts with its data, like in aggregate().
+					'starttime': packageStart if state == None and len(result['packages']) == 0 else binStart,
+					'endtime': packageEnd,
+					'packages': 0,
+					'stats': {}
+				}
+			mergeProps(result['state']['stats'], package['stats'])
+			result['state']['packages'] += 1
+			result['state']['endtime'] = min(packageEnd, binStart + cutoffSize)
 
 	return result
 
+# Helper function for turning the combined accumulators of a chunk of packages into one package.
+# @param {timestamp} startTime
+# @param {timestamp} endTime
+def rollup_chunk(statsByProp, tz, startTime, endTime, statistics = ()):
+	return aggregate_chunk(statsByProp, tz, startTime, endTime, statistics)
+
 if __name__ == "__main__":
 	size = 5 * 60
 	tz = dateutil.tz.tzoffset("-07:00", -7 * 60 * 60)
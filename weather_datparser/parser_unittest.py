@@ -0,0 +1,155 @@
+'''
+This is the unit test module for parser.py.
+It writes small weather station DAT files and checks how they are merged
+into one time-ordered stream of records.
+
+To run the unit test, simply use:
+python parser_unittest.py
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import dateutil.tz
+import numpy as np
+
+import parser
+from parser import merge_files, peek_file_time_range, TOA5TimeString2TimeStamp, \
+	newStats, addToStats, mergeStats, statValue, checkRollupCutoffs
+
+parser.debug_log = lambda message: None
+
+# As the extractor reads them
+STATION_TZ = dateutil.tz.tzoffset("-07:00", -7 * 60 * 60)
+
+HEADER = ('"TOA5","MAC","CR1000","1","OS","CPU:x","1","Table"\n'
+		  '"TIMESTAMP","RECORD","AirTC","RH","Pyro","PAR_ref","WindDir","WS_ms","Rain_mm_Tot"\n'
+		  '"TS","RN","Deg C","%","W/m^2","umol/s/m^2","degrees","meters/second","mm"\n'
+		  '"","","Smp","Smp","Smp","Smp","Smp","Smp","Tot"\n')
+
+
+class parserUnitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def writeFile(self, name, seconds, temperature=25.0, trailer=""):
+		'''
+		Write a DAT file with one row at each of the given seconds of 2017-06-01
+		'''
+		path = os.path.join(self.directory, name)
+		with open(path, 'w') as datFile:
+			datFile.write(HEADER)
+			for second in seconds:
+				datFile.write('"2017-06-01 %02d:%02d:%02d",%d,%s,40,100,200,90,2.0,0.1\n' % (
+					second // 3600, second // 60 % 60, second % 60, second, temperature))
+			datFile.write(trailer)
+		return path
+
+	def secondOf(self, timestamp):
+		return int(timestamp - TOA5TimeString2TimeStamp("2017-06-01 00:00:00", STATION_TZ))
+
+	def test_canMergeFilesInTimeOrder(self):
+		'''
+		Records of files given out of time order, and interleaving in time, come out in time order
+		'''
+		later = self.writeFile("later.dat", range(100, 110))
+		odd = self.writeFile("odd.dat", range(1, 20, 2))
+		even = self.writeFile("even.dat", range(0, 20, 2))
+		merged = list(merge_files([later, odd, even], STATION_TZ))
+		self.assertEqual([self.secondOf(timestamp) for timestamp, fileIndex, record in merged],
+						 range(20) + range(100, 110))
+		self.assertEqual([fileIndex for timestamp, fileIndex, record in merged][:4], [2, 1, 2, 1])
+
+	def test_canDropRepeatedAndOutOfOrderRecords(self):
+		'''
+		Records at or before the last one emitted are dropped, keeping the first file's record at each time
+		'''
+		first = self.writeFile("first.dat", range(0, 10), temperature=20.0)
+		overlapping = self.writeFile("overlapping.dat", range(5, 15), temperature=30.0)
+		backwards = self.writeFile("backwards.dat", [20, 21, 16, 22])
+		merged = list(merge_files([first, overlapping, backwards], STATION_TZ))
+		seconds = [self.secondOf(timestamp) for timestamp, fileIndex, record in merged]
+		self.assertEqual(seconds, range(0, 15) + [20, 21, 22])
+		self.assertEqual([fileIndex for timestamp, fileIndex, record in merged][:10], [0] * 10)
+
+	def test_canPeekAtTheTimeRangeFromTheTail(self):
+		'''
+		The last row is found from the tail of the file, including past trailing blank lines
+		and when the tail read starts in the middle of a row
+		'''
+		path = self.writeFile("long.dat", range(0, 3000), trailer="\n\n")
+		first, last = peek_file_time_range(path, STATION_TZ, tailSize=100)
+		self.assertEqual((self.secondOf(first), self.secondOf(last)), (0, 2999))
+		self.assertEqual(peek_file_time_range(self.writeFile("one.dat", [7]), tailSize=10),
+						 peek_file_time_range(self.writeFile("one_again.dat", [7])))
+		self.assertEqual(peek_file_time_range(self.writeFile("empty.dat", [])), None)
+
+	def test_canStopReadingAheadWhenTheConsumerStops(self):
+		'''
+		The read-ahead thread is stopped when the merge is abandoned before its last file
+		'''
+		paths = [self.writeFile("%s.dat" % number, range(number * 10, number * 10 + 10)) for number in range(5)]
+		merge = merge_files(paths, STATION_TZ, prefetchDepth=1)
+		next(merge)
+		merge.close()
+		self.assertFalse([thread for thread in threading.enumerate() if thread.name == "prefetch" and thread.is_alive()])
+
+	def accumulate(self, values):
+		stats = newStats()
+		for value in values:
+			addToStats(stats, value)
+		return stats
+
+	def assertStatsMatch(self, stats, values):
+		values = np.asarray(values)
+		self.assertEqual(statValue(stats, 'count'), len(values))
+		self.assertAlmostEqual(statValue(stats, 'mean'), values.mean(), places=9)
+		self.assertAlmostEqual(statValue(stats, 'variance'), values.var(ddof=1), places=6)
+		self.assertEqual(statValue(stats, 'min'), values.min())
+		self.assertEqual(statValue(stats, 'max'), values.max())
+		self.assertAlmostEqual(statValue(stats, 'sum'), values.sum(), places=6)
+		self.assertEqual(statValue(stats, 'last'), values[-1])
+
+	def test_canAccumulateStatsLikeNumpy(self):
+		'''
+		Welford's update gives the statistics numpy computes over all the values, even far from zero
+		'''
+		values = list(np.random.RandomState(1).normal(1e6, 3.0, 1000))
+		self.assertStatsMatch(self.accumulate(values), values)
+
+	def test_canMergeStatsOfPartialBins(self):
+		'''
+		Merging the accumulators of two parts of a bin (as rollups and archives do) gives the
+		statistics of the combined values, whichever part is empty or has a single value
+		'''
+		values = list(np.random.RandomState(2).gamma(2.0, 10.0, 500))
+		for split in (0, 1, 137, 499, 500):
+			stats = self.accumulate(values[:split])
+			mergeStats(stats, self.accumulate(values[split:]))
+			self.assertStatsMatch(stats, values)
+
+	def test_canLeaveNaNOutOfEveryStatistic(self):
+		stats = self.accumulate([float('nan'), 3.0, float('nan'), 1.0, 2.0, float('nan')])
+		self.assertStatsMatch(stats, [3.0, 1.0, 2.0])
+
+	def test_canRejectCutoffsStraddlingLocalBins(self):
+		'''
+		Rollups have to be multiples of the finer bins, and the aggregation has to divide the UTC offset
+		the rollups are aligned to, so no UTC-aligned fine bin straddles a local coarse bin edge
+		'''
+		checkRollupCutoffs(300, [3600, 86400], STATION_TZ)
+		checkRollupCutoffs(7 * 3600, [], STATION_TZ)
+		self.assertRaises(ValueError, checkRollupCutoffs, 300, [3000, 3600], STATION_TZ)
+		self.assertRaises(ValueError, checkRollupCutoffs, 3600, [1800], STATION_TZ)
+		self.assertRaises(ValueError, checkRollupCutoffs, 2 * 3600, [86400], STATION_TZ)
+
+
+if __name__ == "__main__":
+	unittest.main()
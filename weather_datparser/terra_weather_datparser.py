@@ -2,16 +2,18 @@
 
 import os
 import urlparse
-import math
 
 from pyclowder.utils import CheckMessage
 from pyclowder.datasets import download_metadata, upload_metadata
 from terrautils.metadata import get_extractor_metadata
 from terrautils.extractors import TerrarefExtractor, is_latest_file, build_metadata
-from terrautils.geostreams import create_datapoints, create_sensor, create_stream, \
-	get_stream_by_name, get_sensor_by_name
+from terrautils.geostreams import create_sensor, create_stream, get_stream_by_name, get_sensor_by_name
 
 from parser import *
+from archive import ArchiveWriter
+from datapoints import DatapointEncoder, post_datapoints, add_batch_arguments, batch_policy_from_args
+from profiling import add_profiling_arguments, profile_messages
+from concurrency import add_concurrency_arguments, pool_messages, start_extractor
 
 
 def add_local_arguments(parser):
@@ -19,8 +21,20 @@ def add_local_arguments(parser):
 	parser.add_argument('--aggregation', dest="agg_cutoff", type=int, nargs='?',
 					default=(300),
 					help="minute chunks to aggregate records into (default is 5 mins)")
-	parser.add_argument('--batchsize', type=int, default=3000,
-						help="max number of datapoints to submit at a time")
+	parser.add_argument('--rollups', dest="rollup_cutoffs", type=int, nargs='*',
+					default=[],
+					help="coarser bin sizes in seconds to roll the aggregation up into, each posted to its own stream "
+						 "and each a multiple of the previous one (e.g. 3600 86400); the aggregation has to divide 7 hours")
+	parser.add_argument('--statistics', type=str, nargs='*', default=[], choices=STATISTICS,
+						help="statistics to post besides each property's mean (sum for precipitation), "
+							 "as <property>_<statistic> (e.g. min max variance)")
+	parser.add_argument('--archivedir', type=str, default=os.environ.get('WEATHER_ARCHIVE_DIR', None),
+						help="directory to also write each day's parsed records to, as a columnar archive (see archive.py)")
+	parser.add_argument('--prefetch', type=int, default=1,
+						help="number of DAT files to read ahead in the background while parsing (0 to disable)")
+	add_batch_arguments(parser)
+	add_profiling_arguments(parser)
+	add_concurrency_arguments(parser)
 
 class MetDATFileParser(TerrarefExtractor):
 	def __init__(self):
@@ -34,7 +48,19 @@ class MetDATFileParser(TerrarefExtractor):
 
 		# assign other arguments
 		self.agg_cutoff = self.args.agg_cutoff
-		self.batchsize = self.args.batchsize
+		self.rollup_cutoffs = sorted(self.args.rollup_cutoffs)
+		self.statistics = self.args.statistics
+		self.gzip = self.args.gzip
+		self.prefetch = self.args.prefetch
+		self.archive_dir = self.args.archivedir
+
+		checkRollupCutoffs(self.agg_cutoff, self.rollup_cutoffs, dateutil.tz.tzoffset("-07:00", -7 * 60 * 60))
+
+		# profile each message if asked to
+		profile_messages(self)
+
+		# process several messages at a time if asked to
+		pool_messages(self)
 
 	def check_message(self, connector, host, secret_key, resource, parameters):
 		if not is_latest_file(resource):
@@ -72,81 +98,104 @@ class MetDATFileParser(TerrarefExtractor):
 		else:
 			sensor_id = sensor_data['id']
 
-		# Get stream or create if not found
-		stream_name = "Weather Observations (5 min bins)"
-		stream_data = get_stream_by_name(connector, host, secret_key, stream_name)
-		if not stream_data:
-			stream_id = create_stream(connector, host, secret_key, stream_name, sensor_id, geom)
-		else:
-			stream_id = stream_data['id']
+		# Get streams or create if not found, one per resolution
+		stream_ids = []
+		for cutoff in [self.agg_cutoff] + self.rollup_cutoffs:
+			stream_name = "Weather Observations (%s bins)" % describe_cutoff(cutoff)
+			stream_data = get_stream_by_name(connector, host, secret_key, stream_name)
+			if not stream_data:
+				stream_ids.append(create_stream(connector, host, secret_key, stream_name, sensor_id, geom))
+			else:
+				stream_ids.append(stream_data['id'])
+
+		# Size datapoint batches according to how the server copes with this message's requests.
+		batch_policy = batch_policy_from_args(self.args)
 
 		# Process each file and concatenate results together.
 		datasetUrl = urlparse.urljoin(host, 'datasets/%s' % resource['id'])
 		ISO_8601_UTC_OFFSET = dateutil.tz.tzoffset("-07:00", -7 * 60 * 60)
-		#! Files should be sorted for the aggregation to work.
-		aggregationState = None
-		lastAggregatedFile = None
 		target_files = get_all_files(resource)
+		local_paths = get_local_paths(resource)
+		target_files = [file for file in target_files if file['filename'] in local_paths]
+		filepaths = [local_paths[file['filename']] for file in target_files]
+
+		# The aggregation needs sorted records, so merge all the files into one time-ordered stream.
+		# Records are fed to the aggregation in runs coming from the same file so that each
+		# aggregated package can refer to the file that completed it.
+		# The aggregated packages are then rolled up into each coarser resolution.
+		# The parsed records are also archived by day if asked to, so they can be aggregated again later.
+		aggregationStates = [None] * len(stream_ids)
 		datapoint_count = 0
-		# To work with the aggregation process, add an extra NULL file to indicate we are done with all the files.
-		for file in (list(target_files) + [ None ]):
-			if file == None:
-				# We are done with all the files, pass None to let aggregation wrap up any work left.
-				records = None
-				fileId = lastAggregatedFile['id']
-			else:
-				# Add this file to the aggregation.
-				for p in resource['local_paths']:
-					if os.path.basename(p) == file['filename']:
-						filepath = p
-				# Parse one file and get all the records in it.
-				records = parse_file(filepath, utc_offset=ISO_8601_UTC_OFFSET)
-				fileId = file['id']
-
-			aggregationResult = aggregate(
-					cutoffSize=self.agg_cutoff,
-					tz=ISO_8601_UTC_OFFSET,
-					inputData=records,
-					state=aggregationState
-			)
-			aggregationState = aggregationResult['state']
-			aggregationRecords = aggregationResult['packages']
-
-			# Add props to each record.
-			datapoint_list = []
-			for record in aggregationRecords:
-				record['properties']['source'] = datasetUrl
-				record['properties']['source_file'] = fileId
-				cleaned_properties = {}
-				# Check for nan values from the stream
-				for prop in record['properties']:
-					val = record['properties'][prop]
-					if not (type(val) == float and math.isnan(val)):
-						cleaned_properties[prop] = val
-				datapoint_list.append({
-					"start_time": record['start_time'],
-					"end_time": record['end_time'],
-					"type": "Point",
-					"geometry": record['geometry'],
-					"properties": cleaned_properties
-				})
-				if len(datapoint_list) > self.batchsize:
-					create_datapoints(connector, host, secret_key, stream_id, datapoint_list)
-					datapoint_count += len(datapoint_list)
-					datapoint_list = []
-			if len(datapoint_list) > 0:
-				create_datapoints(connector, host, secret_key, stream_id, datapoint_list)
-				datapoint_count += len(datapoint_list)
-
-			lastAggregatedFile = file
+		run = []
+		runFileIndex = None
+		archiveWriter = ArchiveWriter(self.archive_dir) if self.archive_dir else None
+		for timestamp, fileIndex, record in merge_files(filepaths, utc_offset=ISO_8601_UTC_OFFSET, prefetchDepth=self.prefetch):
+			if archiveWriter:
+				archiveWriter.add(timestamp, record)
+			if fileIndex != runFileIndex and len(run) > 0:
+				aggregationStates, created = self.aggregate_records(connector, host, secret_key, stream_ids, datasetUrl,
+						target_files[runFileIndex]['id'], ISO_8601_UTC_OFFSET, run, aggregationStates, batch_policy)
+				datapoint_count += created
+				run = []
+			runFileIndex = fileIndex
+			run.append(record)
+		if runFileIndex != None:
+			# After the last run, pass None to let aggregation wrap up any work left.
+			for records in (run, None):
+				aggregationStates, created = self.aggregate_records(connector, host, secret_key, stream_ids, datasetUrl,
+						target_files[runFileIndex]['id'], ISO_8601_UTC_OFFSET, records, aggregationStates, batch_policy)
+				datapoint_count += created
+		if archiveWriter:
+			archiveWriter.close()
+			self.log_info(resource, "archived %s" % archiveWriter.summary())
 
 		# Mark dataset as processed
 		metadata = build_metadata(host, self.extractor_info, resource['id'], {
 			"datapoints_created": datapoint_count}, 'dataset')
 		upload_metadata(connector, host, secret_key, resource['id'], metadata)
 
+		self.log_info(resource, "geostreams: %s" % batch_policy.summary())
 		self.end_message(resource)
 
+	# Feed records to the aggregation and its rollups and post the resulting datapoints.
+	# Returns the new aggregation states and the number of datapoints created.
+	def aggregate_records(self, connector, host, secret_key, stream_ids, datasetUrl, fileId, tz, records, aggregationStates, batch_policy):
+		aggregationResult = aggregate(
+				cutoffSize=self.agg_cutoff,
+				tz=tz,
+				inputData=records,
+				state=aggregationStates[0],
+				statistics=self.statistics
+		)
+		results = [aggregationResult]
+		for level, cutoff in enumerate(self.rollup_cutoffs, 1):
+			result = rollup(cutoff, tz, results[-1]['packages'], aggregationStates[level], self.statistics)
+			if records == None:
+				# The finer level has flushed its last packages, so this level can end too.
+				ending = rollup(cutoff, tz, None, result['state'], self.statistics)
+				result = {'packages': result['packages'] + ending['packages'], 'state': ending['state']}
+			results.append(result)
+
+		datapoint_count = 0
+		for stream_id, result in zip(stream_ids, results):
+			datapoint_count += self.post_packages(connector, host, secret_key, stream_id, datasetUrl, fileId, result['packages'], batch_policy)
+
+		return [result['state'] for result in results], datapoint_count
+
+	# Post aggregated packages to a stream and return the number of datapoints created.
+	def post_packages(self, connector, host, secret_key, stream_id, datasetUrl, fileId, packages, batch_policy):
+		encoder = DatapointEncoder(stream_id, STATION_GEOMETRY, compress=self.gzip)
+		# Add props to each record.
+		encoder.set_constants([('source', datasetUrl), ('source_file', fileId)])
+		datapoint_count = 0
+		for record in packages:
+			encoder.add(record['start_time'], record['end_time'], record['properties'])
+			if batch_policy.full(encoder):
+				datapoint_count += post_datapoints(connector, host, secret_key, encoder, batch_policy)
+		datapoint_count += post_datapoints(connector, host, secret_key, encoder, batch_policy)
+
+		return datapoint_count
+
 # Find as many expected files as possible and return the set.
 def get_all_files(resource):
 	target_files = []
@@ -163,6 +212,24 @@ def get_all_files(resource):
 
 	return target_files
 
+# Describe a bin size in seconds the way stream names do, e.g. "5 min" or "1 day".
+def describe_cutoff(cutoff):
+	if cutoff % 86400 == 0:
+		return "%s day" % (cutoff / 86400)
+	elif cutoff % 3600 == 0:
+		return "%s hour" % (cutoff / 3600)
+	elif cutoff % 60 == 0:
+		return "%s min" % (cutoff / 60)
+	else:
+		return "%s sec" % cutoff
+
+# Index the downloaded files by filename.
+def get_local_paths(resource):
+	local_paths = {}
+	for p in resource.get('local_paths', []):
+		local_paths[os.path.basename(p)] = p
+	return local_paths
+
 if __name__ == "__main__":
 	extractor = MetDATFileParser()
-	extractor.start()
+	start_extractor(extractor)